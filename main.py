@@ -1,8 +1,18 @@
 from dify_plugin import Plugin, DifyPluginEnv
 
+from utils.config import env_int
+
 # 配置插件环境
-# OpenRouter API 通常响应较快，设置 60 秒超时
-plugin = Plugin(DifyPluginEnv(MAX_REQUEST_TIMEOUT=60))
+# OpenRouter API 通常响应较快，默认 60 秒超时；
+# MAX_REQUEST_TIMEOUT 是单次请求的总时长上限，流式模式不会延长它。
+# 生成时间较长时可调大该值，或使用 submit_job 后台任务
+plugin = Plugin(DifyPluginEnv(MAX_REQUEST_TIMEOUT=env_int("MAX_REQUEST_TIMEOUT", 60)))
 
 if __name__ == '__main__':
+    # 可选的启动预热：预连接 OpenRouter、加载图像编解码器（后台线程，不阻塞启动）
+    from utils.warmup import start_warmup
+    start_warmup()
+    # 继续执行上次退出前未完成的后台任务
+    from utils.job_queue import resume_pending_jobs
+    resume_pending_jobs()
     plugin.run()
\ No newline at end of file
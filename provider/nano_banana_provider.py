@@ -3,6 +3,8 @@ import requests
 from dify_plugin.errors.tool import ToolProviderCredentialValidationError
 from dify_plugin import ToolProvider
 
+from utils.credentials import get_credential_validator
+
 class NanaBananaProvider(ToolProvider):
     def _validate_credentials(self, credentials: dict[str, Any]) -> None:
         """
@@ -56,51 +58,10 @@ class NanaBananaProvider(ToolProvider):
             ToolProviderCredentialValidationError: 当 API 连接测试失败时
         """
         try:
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # 使用一个更通用的模型进行测试，避免404错误
-            test_payload = {
-                "model": "deepseek/deepseek-chat-v3.1:free",  # 使用更常见的模型进行验证
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": "test"  # 简化内容格式
-                    }
-                ],
-                "max_tokens": 1  # 最小 token 数量，减少费用
-            }
-            
-            response = requests.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                headers=headers,
-                json=test_payload,
-                timeout=10
-            )
-            
-            # 检查响应状态
-            if response.status_code == 401:
-                raise ToolProviderCredentialValidationError(
-                    "OpenRouter API key 无效或已过期"
-                )
-            elif response.status_code == 402:
-                raise ToolProviderCredentialValidationError(
-                    "OpenRouter 账户余额不足"
-                )
-            elif response.status_code == 429:
-                raise ToolProviderCredentialValidationError(
-                    "OpenRouter API 调用频率过高"
-                )
-            elif response.status_code >= 500:
-                raise ToolProviderCredentialValidationError(
-                    "OpenRouter 服务器暂时不可用"
-                )
-            elif response.status_code not in [200, 400]:  # 400 可能是因为测试请求格式
-                raise ToolProviderCredentialValidationError(
-                    f"OpenRouter API 连接测试失败，状态码: {response.status_code}"
-                )
+            # 优先使用免费的 GET /key 接口，结果按 key 指纹缓存，并发校验合并为一次请求
+            result = get_credential_validator().check(api_key, timeout=10)
+            if not result.valid:
+                raise ToolProviderCredentialValidationError(result.message)
                 
         except requests.exceptions.Timeout:
             raise ToolProviderCredentialValidationError(
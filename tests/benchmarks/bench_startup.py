@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+插件启动耗时基准测试
+
+在新的解释器中以 python -X importtime 导入插件启动时加载的模块（provider
+和 provider 清单中列出的全部工具），报告：
+
+- 导入耗时（多次运行取中位数），以及只导入 dify_plugin 的基线；
+- 插件自身各顶层模块的累计导入耗时（来自 importtime 报告）；
+- 延迟导入的重型模块（Pillow）是否在启动时被加载；
+- 启动后第一次加载 Pillow 并编解码（预热 prime_codecs 提前完成的部分）的耗时。
+
+用法: python tests/benchmarks/bench_startup.py [--runs N] [--top N] [--json 文件]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(BENCH_DIR, "..", ".."))
+
+# 应延迟到第一次使用时才导入的重型模块
+DEFERRED_MODULES = ("PIL",)
+# dify_plugin 自身会导入 httpx；先导入 httpx 与插件运行时的导入顺序一致
+BASELINE_IMPORTS = "import httpx, dify_plugin"
+# 写入 stderr 的分隔行：之后的 importtime 记录属于启动完成后的首次使用
+STARTUP_MARKER = "-- startup imports done --"
+
+MEASURE_CODE = """
+import json, sys, time
+started = time.perf_counter()
+{imports}
+imported = time.perf_counter() - started
+modules = sorted(sys.modules)
+print({marker!r}, file=sys.stderr, flush=True)
+codecs = 0.0
+if {prime}:
+    from utils.warmup import prime_codecs
+    codecs = prime_codecs()
+print(json.dumps({{"import_seconds": imported, "codecs_seconds": codecs, "modules": modules}}))
+"""
+
+
+def startup_modules() -> list[str]:
+    """按 provider 清单列出插件启动时加载的 Python 模块"""
+    with open(os.path.join(ROOT, "provider", "nano_banana.yaml"), encoding="utf-8") as f:
+        provider = yaml.safe_load(f)
+    sources = [provider["extra"]["python"]["source"]]
+    for tool_yaml in provider["tools"]:
+        with open(os.path.join(ROOT, tool_yaml), encoding="utf-8") as f:
+            sources.append(yaml.safe_load(f)["extra"]["python"]["source"])
+    return [source[:-len(".py")].replace("/", ".") for source in sources]
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """解析 -X importtime 的输出（到启动分隔行为止），返回每个模块的自身耗时、累计耗时和嵌套层级"""
+    rows = []
+    for line in stderr.splitlines():
+        if line == STARTUP_MARKER:
+            break
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append({
+            "module": name.strip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+            "level": level,
+        })
+    return rows
+
+
+def measure(imports: str, prime: bool = False) -> tuple[dict, list[dict]]:
+    """在新的解释器中执行导入，返回 (测量结果, importtime 记录)"""
+    code = MEASURE_CODE.format(imports=imports, prime=prime, marker=STARTUP_MARKER)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(proc.stdout.strip().splitlines()[-1]), parse_importtime(proc.stderr)
+
+
+def run(runs: int = 5, top: int = 10) -> dict:
+    """多次测量基线和插件启动导入，返回汇总结果"""
+    modules = startup_modules()
+    plugin_imports = f"{BASELINE_IMPORTS}\nimport {', '.join(modules)}"
+
+    baseline = [measure(BASELINE_IMPORTS)[0]["import_seconds"] for _ in range(runs)]
+    samples = [measure(plugin_imports, prime=True) for _ in range(runs)]
+    full = [result["import_seconds"] for result, _ in samples]
+    result, records = samples[-1]
+
+    baseline_modules = set(measure(BASELINE_IMPORTS)[0]["modules"])
+    # 基线之后才导入的顶层模块即插件自身（及其独有依赖）的导入开销
+    plugin_records = [
+        record for record in records
+        if record["level"] == 0 and record["module"] not in baseline_modules
+    ]
+    plugin_records.sort(key=lambda record: record["cumulative_ms"], reverse=True)
+    return {
+        "modules": modules,
+        "baseline_ms": statistics.median(baseline) * 1000,
+        "startup_ms": statistics.median(full) * 1000,
+        "plugin_ms": sum(record["cumulative_ms"] for record in plugin_records),
+        "top_modules": plugin_records[:top],
+        "deferred_loaded": [
+            name for name in DEFERRED_MODULES if name in result["modules"] and name not in baseline_modules
+        ],
+        "first_codec_ms": statistics.median(sample["codecs_seconds"] for sample, _ in samples) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="插件启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数（取中位数）")
+    parser.add_argument("--top", type=int, default=10, help="列出累计耗时最高的插件模块数")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    summary = run(args.runs, args.top)
+    print(f"启动模块: {', '.join(summary['modules'])}")
+    print(f"基线（{BASELINE_IMPORTS}）: {summary['baseline_ms']:.1f}ms")
+    print(f"插件启动导入: {summary['startup_ms']:.1f}ms（插件自身模块 {summary['plugin_ms']:.1f}ms）")
+    print(f"{'模块':<32} {'自身':>8} {'累计':>8}")
+    for record in summary["top_modules"]:
+        print(f"{record['module']:<32} {record['self_ms']:>6.1f}ms {record['cumulative_ms']:>6.1f}ms")
+    deferred = ", ".join(summary["deferred_loaded"]) or "无"
+    print(f"启动时加载的延迟导入模块: {deferred}")
+    print(f"首次加载 Pillow 并编解码: {summary['first_codec_ms']:.1f}ms（启用预热时在后台提前完成）")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
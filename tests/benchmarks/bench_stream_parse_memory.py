@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+响应解析内存基准测试
+
+对比 "response.json() + base64.b64decode" 与流式解析在解析内嵌大尺寸
+Base64 图像的 chat/completions 响应时的峰值内存。流式解析分别测量缓冲池
+为空（进程内第一次解析）和缓冲池已预热（长期运行时的稳态）两种情况。
+
+用法: python tests/benchmarks/bench_stream_parse_memory.py [图像大小MB ...]
+"""
+
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from utils.buffer_pool import get_buffer_pool  # noqa: E402
+from utils.stream_parse import STREAM_CHUNK_SIZE, parse_completion_stream, resolve_blob  # noqa: E402
+
+
+def build_response_body(image_size: int) -> tuple[bytes, bytes]:
+    """构造内嵌一张 image_size 字节图像的响应体"""
+    image = os.urandom(image_size)
+    body = json.dumps({
+        "choices": [{
+            "message": {
+                "role": "assistant",
+                "content": "",
+                "images": [{
+                    "type": "image_url",
+                    "image_url": {"url": "data:image/png;base64," + base64.b64encode(image).decode()},
+                }],
+            },
+        }],
+        "usage": {"total_tokens": 1290, "prompt_tokens": 10, "completion_tokens": 1280},
+    }).encode("utf-8")
+    return body, image
+
+
+def iter_chunks(body: bytes):
+    """模拟 response.iter_content() 按块读取"""
+    for start in range(0, len(body), STREAM_CHUNK_SIZE):
+        yield body[start:start + STREAM_CHUNK_SIZE]
+
+
+def parse_naive(body: bytes) -> bytes:
+    """原实现：完整读取响应后 json 解析，再整体 Base64 解码"""
+    content = b"".join(iter_chunks(body))
+    data = json.loads(content)
+    url = data["choices"][0]["message"]["images"][0]["image_url"]["url"]
+    return base64.b64decode(url.split(",", 1)[1])
+
+
+def parse_streaming(body: bytes) -> bytes:
+    """流式解析：边读边解码"""
+    parsed = parse_completion_stream(iter_chunks(body))
+    url = parsed.data["choices"][0]["message"]["images"][0]["image_url"]["url"]
+    return resolve_blob(url, parsed.blobs)
+
+
+def measure(func, body: bytes) -> tuple[bytes, int, float]:
+    """返回 (结果, 峰值新增内存, 耗时秒)"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(body)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak, elapsed
+
+
+def run(image_sizes_mb: list[float]) -> list[dict]:
+    """对每个图像大小运行各种解析方式，返回测量结果"""
+    rows = []
+    for size_mb in image_sizes_mb:
+        body, image = build_response_body(int(size_mb * 1024 * 1024))
+        for name, func in (("naive", parse_naive), ("cold-pool", parse_streaming), ("streaming", parse_streaming)):
+            if name == "cold-pool":
+                get_buffer_pool().clear()
+            result, peak, elapsed = measure(func, body)
+            assert result == image
+            rows.append({
+                "mode": name,
+                "image_bytes": len(image),
+                "peak_bytes": peak,
+                "peak_ratio": peak / len(image),
+                "seconds": elapsed,
+            })
+    return rows
+
+
+def main():
+    sizes = [float(arg) for arg in sys.argv[1:]] or [1, 4, 8]
+    print(f"{'模式':<10} {'图像大小':>12} {'峰值内存':>12} {'倍数':>6} {'耗时':>8}")
+    for row in run(sizes):
+        print(
+            f"{row['mode']:<10} {row['image_bytes']:>12,} {row['peak_bytes']:>12,} "
+            f"{row['peak_ratio']:>6.2f} {row['seconds'] * 1000:>6.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Text2ImageTool 端到端基准测试
+
+每组配置启动一个独立的模拟服务进程（见 mock_openrouter.py）和一个独立的
+测量进程，测量进程通过 OPENROUTER_API_BASE 指向模拟服务，按给定并发数
+反复调用 Text2ImageTool._invoke()，统计吞吐量、p50/p95/p99 延迟、CPU 时间
+和峰值 RSS。模拟服务运行在单独的进程中，不计入测量进程的 CPU 和内存。
+
+用法:
+    python tests/benchmarks/bench_tool.py                  # 默认配置矩阵
+    python tests/benchmarks/bench_tool.py --quick          # 小规模快速运行
+    python tests/benchmarks/bench_tool.py --scenario sse --concurrency 1 8 --calls 64
+    python tests/benchmarks/bench_tool.py --env HTTP_ENGINE=async --json results.json
+"""
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..", "..")
+
+# 场景: (模拟服务配置, 工具参数)
+SCENARIOS: dict[str, tuple[dict, dict]] = {
+    "base64-256px": ({"latency": 0.1, "image_px": 256}, {}),
+    "base64-1024px": ({"latency": 0.1, "image_px": 1024}, {}),
+    "url-2x512px": ({"latency": 0.1, "image_px": 512, "images": 2, "image_mode": "url"}, {}),
+    "sse-512px": ({"latency": 0.1, "image_px": 512}, {"stream": True}),
+    "webp-512px": ({"latency": 0.1, "image_px": 512}, {"output_format": "webp"}),
+    "jitter-errors": ({"latency": 0.2, "jitter": 0.15, "error_rate": 0.1, "image_px": 256}, {}),
+}
+DEFAULT_CONCURRENCY = [1, 4, 16]
+DEFAULT_CALLS = 32
+
+
+def percentile(values: list[float], p: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def worker(spec: dict) -> dict:
+    """测量进程：在当前进程中调用工具并返回统计结果"""
+    import resource
+
+    # 先导入工具模块（与插件入口的导入顺序一致），再导入 dify_plugin 的类型
+    from tools.text2image import Text2ImageTool
+    from dify_plugin.entities.tool import ToolInvokeMessage
+    from utils.buffer_pool import get_buffer_pool
+
+    class Runtime:
+        credentials = {"api_key": "sk-or-v1-benchmark"}
+
+    def invoke_once() -> tuple[float, bool]:
+        tool = Text2ImageTool.__new__(Text2ImageTool)
+        tool.runtime = Runtime()
+        tool.response_type = ToolInvokeMessage
+        params = dict({"prompt": "a banana", "verbosity": "quiet"}, **spec["params"])
+        started = time.perf_counter()
+        blobs = 0
+        failed = False
+        for message in tool._invoke(params):
+            if message.type == ToolInvokeMessage.MessageType.BLOB:
+                blobs += 1
+            elif message.type == ToolInvokeMessage.MessageType.TEXT and message.message.text.startswith("❌"):
+                failed = True
+        return time.perf_counter() - started, blobs > 0 and not failed
+
+    # 预热：建立连接、加载编解码器，不计入结果
+    invoke_once()
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    calls, concurrency = spec["calls"], spec["concurrency"]
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(lambda _: invoke_once(), range(calls)))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    latencies = [latency for latency, ok in outcomes if ok]
+    return {
+        "calls": calls,
+        "ok": len(latencies),
+        "errors": calls - len(latencies),
+        "wall_seconds": wall,
+        "throughput": len(latencies) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "cpu_seconds": cpu,
+        "cpu_ms_per_call": cpu / calls * 1000,
+        # Linux 下 ru_maxrss 的单位是 KB
+        "baseline_rss_mb": baseline_rss / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "buffer_pool": get_buffer_pool().stats(),
+    }
+
+
+def start_mock(mock_config: dict) -> tuple[subprocess.Popen, str]:
+    """启动模拟服务进程，返回 (进程, API 地址)"""
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "mock_openrouter.py"), json.dumps(mock_config)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    line = process.stdout.readline().strip()
+    if not line.startswith("PORT "):
+        process.kill()
+        raise RuntimeError(f"模拟服务启动失败: {line!r}")
+    return process, f"http://127.0.0.1:{line.split()[1]}/api/v1"
+
+
+def run_one(name: str, concurrency: int, calls: int, env: dict = None) -> dict:
+    """在独立进程中运行一组配置"""
+    mock_config, params = SCENARIOS[name]
+    mock, api_base = start_mock(mock_config)
+    try:
+        spec = {"params": params, "concurrency": concurrency, "calls": calls}
+        worker_env = dict(os.environ, OPENROUTER_API_BASE=api_base, **(env or {}))
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(spec)],
+            cwd=ROOT,
+            env=worker_env,
+            capture_output=True,
+            text=True,
+            timeout=600,
+        )
+        result_line = next(
+            (line for line in reversed(completed.stdout.splitlines()) if line.startswith("{")), None
+        )
+        if completed.returncode != 0 or result_line is None:
+            raise RuntimeError(f"测量进程失败 ({name}, 并发 {concurrency}):\n{completed.stderr[-2000:]}")
+        return dict({"scenario": name, "concurrency": concurrency}, **json.loads(result_line))
+    finally:
+        mock.kill()
+        mock.wait()
+
+
+def run(scenarios: list[str], concurrencies: list[int], calls: int, env: dict = None) -> list[dict]:
+    """运行配置矩阵，返回每组配置的统计结果"""
+    return [run_one(name, concurrency, calls, env) for name in scenarios for concurrency in concurrencies]
+
+
+def print_table(rows: list[dict]) -> None:
+    print(
+        f"{'场景':<16} {'并发':>4} {'成功/总数':>9} {'吞吐/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+        f"{'CPU/次':>8} {'峰值RSS':>9}"
+    )
+    for row in rows:
+        print(
+            f"{row['scenario']:<16} {row['concurrency']:>4} {row['ok']:>4}/{row['calls']:<4} "
+            f"{row['throughput']:>8.2f} {row['p50_ms']:>6.0f}ms {row['p95_ms']:>6.0f}ms {row['p99_ms']:>6.0f}ms "
+            f"{row['cpu_ms_per_call']:>6.1f}ms {row['peak_rss_mb']:>7.1f}MB"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Text2ImageTool 离线基准测试")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=None)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=None)
+    parser.add_argument("--calls", type=int, default=None)
+    parser.add_argument("--quick", action="store_true", help="每个场景只运行并发 1 和 4、各 8 次调用")
+    parser.add_argument("--env", nargs="+", default=[], metavar="KEY=VALUE", help="测量进程的额外环境变量")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    if args.worker:
+        sys.path.insert(0, ROOT)
+        print(json.dumps(worker(json.loads(args.worker))), flush=True)
+        return
+
+    scenarios = args.scenario or list(SCENARIOS)
+    concurrencies = args.concurrency or ([1, 4] if args.quick else DEFAULT_CONCURRENCY)
+    calls = args.calls or (8 if args.quick else DEFAULT_CALLS)
+    env = dict(item.split("=", 1) for item in args.env)
+    rows = run(scenarios, concurrencies, calls, env)
+    print_table(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
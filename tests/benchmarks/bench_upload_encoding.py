@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+输入图像上传编码基准测试
+
+对比不同上传编码设置（格式、质量、最长边、目标大小）下单张输入图像
+实际发送的字节数（Base64 data URL 长度）和编码耗费的 CPU 时间。
+源图像为合成的类照片 JPEG（渐变 + 分形纹理 + 噪声），与常见的照片输入一致。
+
+用法: python tests/benchmarks/bench_upload_encoding.py [源图像最长边 ...]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", ".."))
+
+from io import BytesIO  # noqa: E402
+
+from PIL import Image, ImageChops, ImageFilter  # noqa: E402
+
+from utils.input_images import (  # noqa: E402
+    JPEG_QUALITY, MAX_INPUT_SIZE, UploadEncoding, model_max_input_size, preprocess_image, upload_format_supported,
+)
+
+# (名称, 上传编码参数)
+SETTINGS = [
+    ("jpeg-q85", UploadEncoding()),
+    ("jpeg-q85-gemini", UploadEncoding(max_size=model_max_input_size("google/gemini-2.5-pro"))),
+    ("webp-q80", UploadEncoding(format="webp", quality=80)),
+    ("avif-q60", UploadEncoding(format="avif", quality=60)),
+    ("jpeg-100k", UploadEncoding(target_bytes=100 * 1024)),
+    ("webp-100k", UploadEncoding(format="webp", quality=JPEG_QUALITY, target_bytes=100 * 1024)),
+]
+
+
+def build_source_image(long_side: int) -> bytes:
+    """构造类照片的 JPEG 源图像（4:3，质量 95）"""
+    size = (long_side, long_side * 3 // 4)
+    gradient = Image.linear_gradient("L").resize(size)
+    fractal = Image.effect_mandelbrot(size, (-2.2, -1.2, 0.8, 1.2), 64)
+    noise = Image.effect_noise(size, 48).filter(ImageFilter.GaussianBlur(0.6))
+    image = Image.merge("RGB", (
+        gradient,
+        ImageChops.add(fractal, noise, scale=1.5),
+        ImageChops.multiply(gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT), fractal),
+    ))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=95)
+    return buffer.getvalue()
+
+
+def run(long_sides: list[int], repeats: int = 3) -> list[dict]:
+    """对每个源图像尺寸运行各种编码设置，返回测量结果（不支持的格式跳过）"""
+    rows = []
+    for long_side in long_sides:
+        source = build_source_image(long_side)
+        for name, encoding in SETTINGS:
+            if not upload_format_supported(encoding.format):
+                continue
+            cpu_seconds = 0.0
+            for _ in range(repeats):
+                started = time.process_time()
+                prepared = preprocess_image(
+                    source, max_size=encoding.max_size, quality=encoding.quality,
+                    upload_format=encoding.format, target_bytes=encoding.target_bytes,
+                )
+                cpu_seconds += time.process_time() - started
+            rows.append({
+                "setting": name,
+                "source_px": long_side,
+                "size": prepared.size,
+                "encoded_bytes": len(prepared.encoded),
+                "wire_bytes": len(prepared.data_url),
+                "target_bytes": encoding.target_bytes,
+                "cpu_seconds": cpu_seconds / repeats,
+            })
+    return rows
+
+
+def main():
+    long_sides = [int(arg) for arg in sys.argv[1:]] or [MAX_INPUT_SIZE * 3]
+    baseline = {}
+    print(f"{'设置':<16} {'源图像':>6} {'输出尺寸':>12} {'编码大小':>10} {'传输大小':>10} {'相对':>6} {'CPU':>8}")
+    for row in run(long_sides):
+        base = baseline.setdefault(row["source_px"], row["wire_bytes"])
+        print(
+            f"{row['setting']:<16} {row['source_px']:>6} {str(row['size']):>12} {row['encoded_bytes']:>10,} "
+            f"{row['wire_bytes']:>10,} {row['wire_bytes'] / base:>6.2f} {row['cpu_seconds'] * 1000:>6.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+本地 OpenRouter 模拟服务
+
+模拟 /api/v1/chat/completions（普通响应与 SSE 流式响应）、/api/v1/key
+以及生成图像的下载地址，用于在无网络、无 API Key 的环境下对 Text2ImageTool 做基准测试。
+响应延迟、错误率、图像尺寸、图像数量以及 Base64 内嵌或 URL 返回方式均可配置。
+
+用法: python tests/benchmarks/mock_openrouter.py '{"latency": 0.2, "image_px": 512}'
+启动后在标准输出打印 "PORT <端口>"，API 地址为 http://127.0.0.1:<端口>/api/v1
+"""
+
+import base64
+import json
+import random
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from typing import Optional
+
+from PIL import Image
+
+
+@dataclass
+class MockConfig:
+    """模拟服务的行为配置"""
+    latency: float = 0.1  # 生成请求的基础延迟（秒）
+    jitter: float = 0.0  # 延迟的随机波动范围（秒）
+    error_rate: float = 0.0  # 返回 503 的概率
+    image_px: int = 256  # 生成图像的边长（像素，随机噪声 PNG，几乎不可压缩）
+    images: int = 1  # 每次响应返回的图像数量
+    image_mode: str = "base64"  # base64：内嵌 data URL；url：返回下载地址
+    sse_chunks: int = 4  # SSE 模式下文本分成的事件数
+    sse_chunked: bool = True  # SSE 响应使用 chunked 编码；False 时以关闭连接结束（模拟去掉分块的代理）
+    seed: int = 0
+
+
+def build_png(size_px: int, seed: int = 0) -> bytes:
+    """生成随机噪声 PNG"""
+    rng = random.Random(seed)
+    image = Image.frombytes("RGB", (size_px, size_px), rng.randbytes(size_px * size_px * 3))
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+class MockOpenRouter:
+    """在后台线程中运行的模拟服务，可作为上下文管理器使用"""
+
+    def __init__(self, config: Optional[MockConfig] = None, port: int = 0):
+        self.config = config or MockConfig()
+        self.png = build_png(self.config.image_px, self.config.seed)
+        self.data_url = "data:image/png;base64," + base64.b64encode(self.png).decode("ascii")
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.port}/api/v1"
+
+    def start(self) -> "MockOpenRouter":
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "MockOpenRouter":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def _next_outcome(self) -> tuple[float, bool]:
+        """返回 (本次延迟, 是否返回错误)"""
+        config = self.config
+        with self._lock:
+            self.requests += 1
+            delay = config.latency + (self._rng.uniform(-config.jitter, config.jitter) if config.jitter else 0)
+            failed = self._rng.random() < config.error_rate
+            if failed:
+                self.errors += 1
+        return max(delay, 0.0), failed
+
+    def _image_urls(self) -> list[str]:
+        if self.config.image_mode == "url":
+            return [f"http://127.0.0.1:{self.port}/images/{i}.png" for i in range(self.config.images)]
+        return [self.data_url] * self.config.images
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json") -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                if self.path.startswith("/images/"):
+                    self._send(200, mock.png, "image/png")
+                elif self.path == "/api/v1/key":
+                    self._send(200, b'{"data": {"label": "mock", "limit": null, "usage": 0, "is_free_tier": false}}')
+                else:
+                    self._send(404, b'{"error": {"message": "not found"}}')
+
+            def do_POST(self) -> None:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, b'{"error": {"message": "not found"}}')
+                    return
+                delay, failed = mock._next_outcome()
+                if failed:
+                    time.sleep(delay / 2)
+                    self._send(503, b'{"error": {"code": 503, "message": "mock overloaded"}}')
+                    return
+                usage = {"prompt_tokens": 12, "completion_tokens": 1290, "total_tokens": 1302}
+                images = [{"type": "image_url", "image_url": {"url": url}} for url in mock._image_urls()]
+                if payload.get("stream"):
+                    self._stream(delay, images, usage)
+                    return
+                time.sleep(delay)
+                body = json.dumps({
+                    "id": "gen-mock",
+                    "model": payload.get("model"),
+                    "choices": [{"message": {"role": "assistant", "content": "", "images": images}}],
+                    "usage": usage,
+                }).encode("utf-8")
+                self._send(200, body)
+
+            def _stream(self, delay: float, images: list[dict], usage: dict) -> None:
+                chunked = mock.config.sse_chunked
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                if chunked:
+                    self.send_header("Transfer-Encoding", "chunked")
+                else:
+                    self.send_header("Connection", "close")
+                self.end_headers()
+                chunks = max(mock.config.sse_chunks, 1)
+
+                def write(data: bytes) -> None:
+                    if chunked:
+                        data = b"%x\r\n%s\r\n" % (len(data), data)
+                    self.wfile.write(data)
+                    self.wfile.flush()
+
+                def event(data: dict) -> None:
+                    write(b"data: " + json.dumps(data).encode("utf-8") + b"\n\n")
+
+                write(b": OPENROUTER PROCESSING\n\n")
+                for i in range(chunks):
+                    time.sleep(delay / (chunks + 1))
+                    event({"choices": [{"delta": {"content": f"part {i} "}}]})
+                time.sleep(delay / (chunks + 1))
+                for image in images:
+                    event({"choices": [{"delta": {"images": [image]}}]})
+                event({"choices": [{"delta": {}, "finish_reason": "stop"}], "usage": usage})
+                write(b"data: [DONE]\n\n")
+                if chunked:
+                    self.wfile.write(b"0\r\n\r\n")
+                    self.wfile.flush()
+                else:
+                    self.close_connection = True
+
+        return Handler
+
+
+def main():
+    config = MockConfig(**json.loads(sys.argv[1])) if len(sys.argv) > 1 else MockConfig()
+    server = MockOpenRouter(config)
+    print(f"PORT {server.port}", flush=True)
+    print(json.dumps(asdict(config)), file=sys.stderr, flush=True)
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
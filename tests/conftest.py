@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+测试共用的夹具
+
+- make_tool: 创建可以直接调用 _invoke() 的工具实例（不经过插件会话）
+"""
+
+import pytest
+
+# 先导入工具模块（与插件入口的导入顺序一致），再导入 dify_plugin 的类型
+from tools.text2image import Text2ImageTool
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+
+class MockRuntime:
+    """模拟运行时环境"""
+    def __init__(self, api_key: str):
+        self.credentials = {"api_key": api_key}
+
+
+@pytest.fixture
+def make_tool():
+    """make_tool(cls=Text2ImageTool, api_key=...) 返回工具实例"""
+    def factory(cls=Text2ImageTool, api_key: str = "sk-or-v1-test"):
+        tool = cls.__new__(cls)
+        tool.runtime = MockRuntime(api_key)
+        tool.response_type = ToolInvokeMessage
+        return tool
+
+    return factory
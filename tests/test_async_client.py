@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+异步引擎测试
+验证后台事件循环、同步适配器以及对本地服务的异步请求
+"""
+
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.mock_openrouter import MockConfig, MockOpenRouter
+from utils import async_client
+
+
+class PingHandler(BaseHTTPRequestHandler):
+    """返回固定内容的测试处理器"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"pong"
+        self.send_response(200 if self.path == "/ok" else 404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_run_sync_and_iterate_sync():
+    """同步适配器返回协程结果，异步迭代器可按顺序同步遍历"""
+    async def double(value):
+        await asyncio.sleep(0)
+        return value * 2
+
+    async def numbers():
+        for i in range(3):
+            yield i
+
+    assert async_client.run_sync(double(21)) == 42
+    assert list(async_client.iterate_sync(numbers())) == [0, 1, 2]
+
+
+def test_fetch_bytes_concurrently():
+    """同一事件循环上可以并发完成多个下载，错误状态码抛出异常"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        async def fetch_all():
+            responses = await asyncio.gather(*[
+                async_client.fetch_bytes(f"{base}/ok") for _ in range(5)
+            ])
+            return [r.content for r in responses]
+
+        assert async_client.run_sync(fetch_all(), timeout=10) == [b"pong"] * 5
+
+        try:
+            async_client.run_sync(async_client.fetch_bytes(f"{base}/missing"), timeout=10)
+            assert False, "404 应该抛出异常"
+        except async_client.httpx.HTTPStatusError as e:
+            assert e.response.status_code == 404
+    finally:
+        async_client.close_async_client()
+        server.shutdown()
+
+
+def test_response_decoded_off_event_loop(monkeypatch):
+    """内嵌图像的 Base64 解码在线程池中执行，不占用事件循环线程"""
+    threads = []
+    feed = async_client.CompletionStreamParser.feed
+
+    def recording_feed(self, chunk):
+        threads.append(threading.current_thread().name)
+        return feed(self, chunk)
+
+    monkeypatch.setattr(async_client.CompletionStreamParser, "feed", recording_feed)
+    with MockOpenRouter(MockConfig(latency=0, image_px=512)) as mock:
+        monkeypatch.setattr(async_client, "OPENROUTER_API_BASE", mock.api_base)
+        response, parsed = async_client.run_sync(
+            async_client.post_chat_completion("sk-or-v1-test", {"model": "mock/model"}), timeout=10
+        )
+    assert response.status_code == 200 and parsed.blobs == [mock.png]
+    assert threads and "nano-banana-async-engine" not in threads
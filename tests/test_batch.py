@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+批量生成测试
+"""
+
+import asyncio
+
+from utils.async_client import iterate_sync
+from utils.batch import build_batch_items, parse_batch_prompts, run_batch
+from utils.generation import GenerationResult
+
+
+def test_parse_batch_prompts():
+    """支持按行分隔和 JSON 数组两种格式"""
+    assert parse_batch_prompts("香蕉\n\n  苹果  \n") == ["香蕉", "苹果"]
+    assert parse_batch_prompts('["frame 1", "frame 2", ""]') == ["frame 1", "frame 2"]
+    assert parse_batch_prompts("[not json") == ["[not json"]
+    assert parse_batch_prompts("") == []
+
+
+def test_build_batch_items_expands_variations():
+    """每个提示词按变体数展开，索引连续"""
+    items = build_batch_items(["a", "b"], 3)
+    assert [(i.index, i.prompt, i.variation) for i in items][:4] == [
+        (0, "a", 0), (1, "a", 1), (2, "a", 2), (3, "b", 0),
+    ]
+    assert len(items) == 6
+
+
+def test_run_batch_bounds_concurrency_and_isolates_failures():
+    """并发数不超过上限，单个失败不影响其他任务，结果按完成顺序返回"""
+    items = build_batch_items([f"p{i}" for i in range(6)], 1)
+    state = {"running": 0, "peak": 0}
+
+    async def worker(item):
+        state["running"] += 1
+        state["peak"] = max(state["peak"], state["running"])
+        await asyncio.sleep(0.01 * (6 - item.index))
+        state["running"] -= 1
+        if item.index == 2:
+            raise RuntimeError("boom")
+        return GenerationResult(text=item.prompt)
+
+    results = list(iterate_sync(run_batch(items, worker, concurrency=2)))
+    assert state["peak"] == 2
+    assert len(results) == 6
+    failed = [r for r in results if r.error]
+    assert len(failed) == 1 and failed[0].item.index == 2 and failed[0].error == "boom"
+    assert all(r.latency > 0 for r in results)
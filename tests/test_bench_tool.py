@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+"""
+离线基准测试框架测试：通过本地模拟服务驱动 Text2ImageTool
+"""
+
+from benchmarks.bench_tool import percentile, run
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) == 0
+
+
+def test_tool_against_mock_server():
+    rows = run(["base64-256px", "sse-512px"], [2], calls=4)
+    for row in rows:
+        assert row["ok"] == row["calls"] == 4, row
+        assert 0 < row["p50_ms"] <= row["p95_ms"] <= row["p99_ms"]
+        assert row["throughput"] > 0
+        assert row["peak_rss_mb"] >= row["baseline_rss_mb"] > 0
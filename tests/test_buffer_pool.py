@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+缓冲池测试
+"""
+
+from io import BytesIO
+
+from PIL import Image
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+import tools.text2image as text2image
+from benchmarks.mock_openrouter import MockConfig, MockOpenRouter
+from utils.buffer_pool import BufferPool, get_buffer_pool
+from utils.images import encode_output, load_generated_image
+
+
+def test_buffers_are_reused_and_pool_size_is_bounded():
+    """归还的缓冲区被复用，扩容保留已写入数据，缓存总大小不超过上限"""
+    pool = BufferPool(max_bytes=256 * 1024, max_buffer_bytes=128 * 1024)
+    with pool.acquire() as buffer:
+        buffer.write(b"a" * 1000)
+        buffer.write(b"b" * 200_000)
+        assert buffer.capacity >= 201_000
+        assert buffer.getvalue() == b"a" * 1000 + b"b" * 200_000
+        assert bytes(buffer.view()[998:1002]) == b"aabb"
+    # 超过单个缓冲区上限的缓冲区用完即释放
+    assert pool.stats()["pooled_bytes"] == 0
+
+    first = pool.acquire(100)
+    data = first._data
+    first.release()
+    second = pool.acquire(100)
+    assert second._data is data
+    second.release()
+    for buffer in [pool.acquire(100_000) for _ in range(4)]:
+        buffer.release()
+
+    stats = pool.stats()
+    assert stats["reused"] >= 1
+    assert stats["pooled_bytes"] <= 256 * 1024
+    assert stats["discarded"] >= 1
+    assert stats["in_use_bytes"] == 0
+
+
+def test_encode_from_pooled_buffer_returns_it_to_pool():
+    """从缓冲区视图直接转码，结果与 bytes 输入一致且不引用缓冲区"""
+    source = BytesIO()
+    Image.new("RGBA", (16, 16), (255, 0, 0, 128)).save(source, format="PNG")
+    png = source.getvalue()
+    pool = get_buffer_pool()
+    in_use = pool.stats()["in_use_bytes"]
+
+    def fetch(url):
+        return pool.acquire(len(png)).extend([png[:10], png[10:]])
+
+    converted, mime_type = load_generated_image("https://example.com/a.png", fetch, "jpeg")
+    assert mime_type == "image/jpeg"
+    assert converted == encode_output(png, "jpeg")[0]
+    passthrough, _ = load_generated_image("https://example.com/a.png", fetch, "png")
+    assert isinstance(passthrough, bytes) and passthrough == png
+    assert pool.stats()["in_use_bytes"] == in_use
+
+
+def test_url_images_are_downloaded_into_pool(monkeypatch, make_tool):
+    """URL 返回的图像经缓冲池下载，调用结束后缓冲区全部归还"""
+    pool = get_buffer_pool()
+    with MockOpenRouter(MockConfig(latency=0, image_px=64, images=2, image_mode="url")) as mock:
+        monkeypatch.setattr(text2image, "OPENROUTER_API_BASE", mock.api_base)
+        messages = list(make_tool(api_key="sk-or-v1-pool")._invoke({"prompt": "pooled download", "verbosity": "quiet"}))
+
+    blobs = [m.message.blob for m in messages if m.type == ToolInvokeMessage.MessageType.BLOB]
+    assert blobs == [mock.png, mock.png]
+    assert pool.stats()["in_use_bytes"] == 0
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+相同并发生成请求合并测试
+"""
+
+import threading
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+import tools.text2image as text2image
+from benchmarks.mock_openrouter import MockConfig, MockOpenRouter
+
+
+def run_concurrently(make_tool, params_list):
+    results = [None] * len(params_list)
+
+    def worker(i):
+        results[i] = list(make_tool(api_key="sk-or-v1-coalesce")._invoke(params_list[i]))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(params_list))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_identical_concurrent_requests_share_one_generation(monkeypatch, make_tool):
+    monkeypatch.delenv("COALESCE_ENABLED", raising=False)
+    with MockOpenRouter(MockConfig(latency=0.3, image_px=32)) as mock:
+        monkeypatch.setattr(text2image, "OPENROUTER_API_BASE", mock.api_base)
+        params = {"prompt": "coalesce me", "verbosity": "normal"}
+        results = run_concurrently(make_tool, [params] * 4 + [dict(params, prompt="something else")])
+
+    assert mock.requests == 2
+    summaries = []
+    for messages in results:
+        blobs = [m for m in messages if m.type == ToolInvokeMessage.MessageType.BLOB]
+        assert len(blobs) == 1 and blobs[0].message.blob == results[0][0].message.blob
+        summaries.append(messages[-1].message.json_object)
+    assert all(s["status"] == "ok" for s in summaries)
+    assert sum(1 for s in summaries[:4] if s.get("coalesced")) == 3
+    assert not summaries[4].get("coalesced")
+
+
+def test_coalescing_can_be_disabled(monkeypatch, make_tool):
+    monkeypatch.setenv("COALESCE_ENABLED", "false")
+    with MockOpenRouter(MockConfig(latency=0.2, image_px=32)) as mock:
+        monkeypatch.setattr(text2image, "OPENROUTER_API_BASE", mock.api_base)
+        run_concurrently(make_tool, [{"prompt": "no coalescing"}] * 3)
+    assert mock.requests == 3
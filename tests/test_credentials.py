@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+API Key 校验缓存与请求合并测试
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from utils import credentials
+from utils.credentials import CredentialValidator
+from utils.single_flight import SingleFlight
+
+
+class KeyHandler(BaseHTTPRequestHandler):
+    """模拟 GET /api/v1/key：good 有效，bad 返回 401，flaky 返回 503"""
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def do_GET(self):
+        key = self.headers["Authorization"].split()[-1]
+        type(self).requests.append(key)
+        time.sleep(0.1)
+        status, body = {
+            "sk-or-v1-good": (200, {"data": {"label": "test", "limit_remaining": 5}}),
+            "sk-or-v1-spent": (200, {"data": {"label": "test", "limit_remaining": 0}}),
+            "sk-or-v1-bad": (401, {"error": {"message": "No auth credentials found"}}),
+        }.get(key, (503, {"error": {"message": "unavailable"}}))
+        raw = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def api_base(monkeypatch):
+    KeyHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(credentials, "OPENROUTER_API_BASE", f"http://127.0.0.1:{server.server_port}/api/v1")
+    monkeypatch.setenv("MAX_RETRIES", "1")
+    yield
+    server.shutdown()
+    server.server_close()
+
+
+def test_concurrent_checks_share_one_probe_and_are_cached(api_base):
+    validator = CredentialValidator(ttl=60, negative_ttl=60)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(validator.check("sk-or-v1-good")))
+        for _ in range(5)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert all(r.valid for r in results)
+    assert KeyHandler.requests == ["sk-or-v1-good"]
+    assert sorted(r.cache_status for r in results).count("miss") == 1
+
+    cached = validator.check("sk-or-v1-good")
+    assert cached.valid and cached.cache_status == "hit"
+    assert cached.info["label"] == "test"
+    assert len(KeyHandler.requests) == 1
+
+    validator.invalidate("sk-or-v1-good")
+    validator.check("sk-or-v1-good")
+    assert len(KeyHandler.requests) == 2
+
+
+def test_failures_cached_only_when_definite(api_base):
+    validator = CredentialValidator(ttl=60, negative_ttl=60)
+    for _ in range(2):
+        bad = validator.check("sk-or-v1-bad")
+        assert not bad.valid and "无效" in bad.message
+        spent = validator.check("sk-or-v1-spent")
+        assert not spent.valid and "额度" in spent.message
+        flaky = validator.check("sk-or-v1-flaky")
+        assert not flaky.valid and not flaky.cacheable
+    assert KeyHandler.requests.count("sk-or-v1-bad") == 1
+    assert KeyHandler.requests.count("sk-or-v1-spent") == 1
+    assert KeyHandler.requests.count("sk-or-v1-flaky") == 2
+    # 缓存中只保存指纹，不保存明文 key
+    assert not any(key.startswith("sk-or-v1") for key in validator._cache)
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+    gate = threading.Event()
+    errors = []
+
+    def slow_failure():
+        gate.wait(1)
+        raise RuntimeError("boom")
+
+    def call():
+        try:
+            flight.do("k", slow_failure)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    while flight.stats()["shared"] < 2:
+        time.sleep(0.01)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(errors) == 3 and len({id(e) for e in errors}) == 1
+    assert flight.stats() == {"executed": 1, "shared": 2, "in_flight": 0}
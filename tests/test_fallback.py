@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+模型回退链与对冲请求测试
+"""
+
+import asyncio
+
+import pytest
+
+from utils.async_client import run_sync
+from utils.fallback import call_with_fallback, model_routing_stats, parse_model_list
+
+
+def fake_models(behaviour):
+    """behaviour: {模型: (延迟秒数, 结果或异常)}，返回调用函数和取消记录"""
+    cancelled = []
+
+    async def call(model):
+        delay, outcome = behaviour[model]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    return call, cancelled
+
+
+def test_parse_model_list():
+    assert parse_model_list("a, b\nc,,a") == ["a", "b", "c"]
+    assert parse_model_list("") == []
+
+
+def test_fallback_on_error_and_empty_result():
+    call, _ = fake_models({
+        "fb-primary": (0, RuntimeError("overloaded")),
+        "fb-second": (0, ""),
+        "fb-third": (0, "image"),
+    })
+    result, model = run_sync(call_with_fallback(["fb-primary", "fb-second", "fb-third"], call, bool))
+    assert (result, model) == ("image", "fb-third")
+    stats = model_routing_stats()
+    assert stats["fb-primary"]["failures"] == 1
+    assert stats["fb-second"]["failures"] == 1
+    assert stats["fb-third"]["fallback_served"] == 1
+
+
+def test_all_models_fail_raises_last_error():
+    call, _ = fake_models({"ex-a": (0, ""), "ex-b": (0, RuntimeError("down"))})
+    with pytest.raises(RuntimeError, match="down"):
+        run_sync(call_with_fallback(["ex-a", "ex-b"], call, bool))
+
+
+def test_hedge_takes_first_finisher_and_cancels_loser():
+    call, cancelled = fake_models({"hg-slow": (5, "slow"), "hg-fast": (0.01, "fast")})
+    result, model = run_sync(call_with_fallback(["hg-slow", "hg-fast"], call, bool, hedge_after=0.05), timeout=2)
+    assert (result, model) == ("fast", "hg-fast")
+    assert cancelled == ["hg-slow"]
+    stats = model_routing_stats()
+    assert stats["hg-fast"]["hedges_fired"] == 1
+    assert stats["hg-fast"]["hedge_wins"] == 1
+    assert stats["hg-slow"]["cancelled"] == 1
+
+
+def test_primary_within_threshold_does_not_hedge():
+    call, _ = fake_models({"nh-primary": (0.01, "ok"), "nh-backup": (0, "backup")})
+    result, model = run_sync(call_with_fallback(["nh-primary", "nh-backup"], call, bool, hedge_after=1))
+    assert model == "nh-primary"
+    stats = model_routing_stats()
+    assert "nh-backup" not in stats
+    assert stats["nh-primary"]["p95_seconds"] >= 0.01
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+共享 HTTP 连接池测试
+使用本地 HTTP 服务验证 keep-alive 连接复用和按主机统计
+"""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import http_pool
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """返回固定内容并保持连接的测试处理器"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b"ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_session_reuses_connections():
+    """多次请求同一主机只建立一条连接"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    http_pool.close_session()
+    try:
+        session = http_pool.get_session()
+        assert session is http_pool.get_session()
+
+        url = f"http://127.0.0.1:{server.server_port}/"
+        for _ in range(3):
+            assert session.get(url, timeout=5).text == "ok"
+
+        stats = http_pool.pool_stats()[f"127.0.0.1:{server.server_port}"]
+        assert stats["requests"] == 3
+        assert stats["errors"] == 0
+        assert stats["connections_opened"] == 1
+        assert stats["idle_connections"] == 1
+    finally:
+        http_pool.close_session()
+        server.shutdown()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+生成图像解码与并行处理测试
+"""
+
+import base64
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from utils.images import encode_output, load_generated_image, map_ordered, sniff_mime
+
+
+def make_image(fmt="PNG", size=(32, 32), color="yellow") -> bytes:
+    """生成测试用的图像字节"""
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def test_load_generated_image_from_data_url_and_url():
+    """data URL 直接解码，普通 URL 通过 fetch 下载，结果统一为 PNG"""
+    jpeg = make_image("JPEG")
+    data_url = "data:image/jpeg;base64," + base64.b64encode(jpeg).decode()
+    blob, mime_type = load_generated_image(data_url, fetch=None)
+    assert blob.startswith(b"\x89PNG") and mime_type == "image/png"
+
+    fetched = []
+    blob, _ = load_generated_image("https://example.com/a.jpg", lambda url: fetched.append(url) or jpeg)
+    assert blob.startswith(b"\x89PNG") and fetched == ["https://example.com/a.jpg"]
+
+
+def test_encode_output_passthrough_and_conversion():
+    """已是目标格式时原样返回，否则按指定格式和质量转换"""
+    png = make_image("PNG")
+    blob, mime_type = encode_output(png, "png")
+    assert blob is png and mime_type == "image/png"
+
+    jpeg = make_image("JPEG")
+    blob, mime_type = encode_output(jpeg, "original")
+    assert blob is jpeg and mime_type == "image/jpeg"
+
+    blob, mime_type = encode_output(png, "webp", quality=80)
+    assert sniff_mime(blob) == mime_type == "image/webp"
+
+    rgba = BytesIO()
+    Image.new("RGBA", (8, 8)).save(rgba, format="PNG")
+    blob, mime_type = encode_output(rgba.getvalue(), "jpeg")
+    assert sniff_mime(blob) == mime_type == "image/jpeg"
+
+
+def test_map_ordered_keeps_input_order():
+    """耗时不同的任务并行执行，但结果按输入顺序返回"""
+    def slow_identity(value):
+        time.sleep(0.02 * (4 - value))
+        return value
+
+    start = time.perf_counter()
+    results = [future.result() for future in map_ordered(slow_identity, range(4))]
+    assert results == [0, 1, 2, 3]
+    assert time.perf_counter() - start < 0.02 * (4 + 3 + 2 + 1)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+输入图像预处理与缓存测试
+"""
+
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+import utils.input_images as input_images
+from benchmarks.bench_upload_encoding import run as run_upload_benchmark
+from utils.buffer_pool import get_buffer_pool
+from utils.input_images import (
+    MAX_INPUT_SIZE, InputImageCache, InputImageError, UploadEncoding, model_max_input_size, parse_image_urls,
+    prepare_input_images, preprocess_image, read_image_body, upload_encoding_for,
+)
+from utils.stream_parse import STREAM_CHUNK_SIZE
+
+
+def make_image(fmt, size, mode="RGB") -> bytes:
+    buffer = BytesIO()
+    Image.new(mode, size, "orange" if mode == "RGB" else None).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class ETagHandler(BaseHTTPRequestHandler):
+    """支持 If-None-Match 的图像服务，记录完整下载次数"""
+    protocol_version = "HTTP/1.1"
+    body = make_image("JPEG", (2048, 1536))
+    downloads = 0
+
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        type(self).downloads += 1
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_preprocess_resizes_and_passes_through():
+    """大图缩小到 1024 以内，合适尺寸的 RGB JPEG 原样透传，其余转为 JPEG"""
+    large = preprocess_image(make_image("JPEG", (4000, 3000)))
+    assert large.original_size == (4000, 3000)
+    assert max(large.size) == 1024
+
+    small_jpeg = make_image("JPEG", (640, 480))
+    assert preprocess_image(small_jpeg).encoded is small_jpeg
+
+    rgba = preprocess_image(make_image("PNG", (300, 200), mode="RGBA"))
+    assert rgba.encoded.startswith(b"\xff\xd8\xff") and rgba.size == (300, 200)
+    assert rgba.data_url.startswith("data:image/jpeg;base64,")
+
+
+def test_cache_fresh_hit_and_conditional_revalidation():
+    """新鲜期内不访问网络，过期后通过 304 复用预处理结果"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ETagHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/ref.jpg"
+    try:
+        cache = InputImageCache(max_entries=4, fresh_seconds=60)
+        first = cache.get(url)
+        assert first.cache_status == "miss" and max(first.size) == 1024
+        assert cache.get(url).cache_status == "fresh"
+
+        cache.fresh_seconds = 0
+        again = cache.get(url)
+        assert again.cache_status == "revalidated"
+        assert again.data_url == first.data_url
+        assert ETagHandler.downloads == 1
+        assert cache.stats() == {"hits": 2, "misses": 1, "entries": 1}
+    finally:
+        server.shutdown()
+
+
+def make_noise_image(fmt, size) -> bytes:
+    buffer = BytesIO()
+    Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+class LimitedHandler(BaseHTTPRequestHandler):
+    """按路径返回不同的输入图像：先发送第一块，停顿后再发送其余部分"""
+    protocol_version = "HTTP/1.1"
+    png = make_noise_image("PNG", (400, 300))
+    tiff = make_noise_image("TIFF", (400, 300))
+
+    def do_GET(self):
+        if self.path == "/declared-huge.png":
+            body, length = self.png, 10 ** 9
+        elif self.path == "/image.tiff":
+            body, length = self.tiff, len(self.tiff)
+        else:
+            body, length = self.png, len(self.png)
+        self.send_response(200)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+        self.wfile.write(body[:STREAM_CHUNK_SIZE])
+        self.wfile.flush()
+        time.sleep(1)
+        try:
+            self.wfile.write(body[STREAM_CHUNK_SIZE:])
+        except OSError:
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_download_rejects_large_unsupported_and_oversized_images_early():
+    """Content-Length 超限、格式不支持、像素数超限时不等下载完成就中止"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LimitedHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    try:
+        cache = InputImageCache(max_entries=4, fresh_seconds=60, max_bytes=1024 * 1024, max_pixels=100_000)
+        for path, message in (
+            ("/declared-huge.png", "输入图像过大"),
+            ("/image.tiff", "不支持的输入图像格式"),
+            ("/large.png", "400x300"),
+        ):
+            started = time.perf_counter()
+            with pytest.raises(InputImageError, match=message):
+                cache.get(base + path)
+            assert time.perf_counter() - started < 0.8
+
+        cache.max_pixels = 1_000_000
+        prepared = cache.get(base + "/ok.png")
+        assert prepared.size == (400, 300) and prepared.downloaded_bytes == len(LimitedHandler.png)
+        assert get_buffer_pool().stats()["in_use_bytes"] == 0
+    finally:
+        server.shutdown()
+
+
+def test_body_exceeding_byte_budget_without_content_length():
+    """没有 Content-Length 的响应在读取超过上限时中止"""
+    class Response:
+        headers = {}
+
+        def iter_content(self, chunk_size):
+            yield make_image("PNG", (8, 8))
+            while True:
+                yield b"\0" * chunk_size
+
+    with pytest.raises(InputImageError, match="输入图像过大"):
+        read_image_body(Response(), max_bytes=256 * 1024, max_pixels=10 ** 6)
+
+
+def test_format_sniffed_after_enough_bytes_arrive():
+    """chunked 响应的第一块短于文件头时，累积到足够字节后再判断格式"""
+    class Response:
+        headers = {}
+
+        def __init__(self, body, first):
+            self.body, self.first = body, first
+
+        def iter_content(self, chunk_size):
+            yield self.body[:self.first]
+            for i in range(self.first, len(self.body), 5):
+                yield self.body[i:i + 5]
+
+    for fmt in ("WEBP", "PNG"):
+        body = make_image(fmt, (8, 8))
+        buffer, _ = read_image_body(Response(body, 3), max_bytes=1 << 20, max_pixels=10 ** 6)
+        assert buffer.getvalue() == body
+        buffer.release()
+
+    with pytest.raises(InputImageError, match="不支持的输入图像格式"):
+        read_image_body(Response(b"RIFF\0\0\0\0WAVEfmt ", 3), max_bytes=1 << 20, max_pixels=10 ** 6)
+    with pytest.raises(InputImageError, match="不支持的输入图像格式"):
+        read_image_body(Response(b"\xff\xd8", 1), max_bytes=1 << 20, max_pixels=10 ** 6)
+    assert get_buffer_pool().stats()["in_use_bytes"] == 0
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """每个请求延迟 0.3 秒返回；/copy.png 与 /a.png 内容相同"""
+    protocol_version = "HTTP/1.1"
+    images = {
+        "/a.png": make_noise_image("PNG", (600, 400)),
+        "/b.png": make_noise_image("PNG", (500, 500)),
+        "/c.jpg": make_noise_image("JPEG", (800, 600)),
+    }
+    images["/copy.png"] = images["/a.png"]
+
+    def do_GET(self):
+        time.sleep(0.3)
+        body = self.images[self.path]
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_parse_image_urls():
+    """支持每行一个或 JSON 数组，多个参数合并后去重"""
+    assert parse_image_urls("http://a/1.png", "http://a/2.png\n http://a/1.png \n") == [
+        "http://a/1.png", "http://a/2.png",
+    ]
+    assert parse_image_urls('["http://a/3.png", "http://a/4.png"]', "") == ["http://a/3.png", "http://a/4.png"]
+    assert parse_image_urls("", "") == []
+
+
+def test_multiple_images_fetched_concurrently_deduplicated_and_fit_budget(monkeypatch):
+    """多张输入图像并发获取，内容重复的只附加一次，总大小超出预算时缩小重新编码"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    urls = [base + path for path in ("/a.png", "/b.png", "/c.jpg", "/copy.png")]
+    monkeypatch.setattr(input_images, "_cache", InputImageCache(max_entries=8, fresh_seconds=60))
+    try:
+        started = time.perf_counter()
+        image_set = prepare_input_images(urls, budget_bytes=0)
+        assert time.perf_counter() - started < 0.9
+        assert len(image_set.fetched) == 4 and image_set.duplicates == 1
+        assert [image.size for image in image_set.images] == [(600, 400), (500, 500), (800, 600)]
+        assert image_set.budget_step is None
+        assert image_set.encoded == b"".join(image.encoded for image in image_set.images)
+
+        budget = image_set.payload_bytes // 3
+        fitted = prepare_input_images(urls, budget_bytes=budget)
+        assert [image.cache_status for image in fitted.fetched] == ["fresh"] * 4
+        assert fitted.budget_step is not None and fitted.payload_bytes <= budget
+        assert all(max(image.size) <= fitted.budget_step[0] for image in fitted.images)
+        assert [image.content_hash for image in fitted.images] == [image.content_hash for image in image_set.images]
+    finally:
+        server.shutdown()
+
+
+def test_upload_encoding_format_target_bytes_and_model_table(monkeypatch):
+    """按模型查最长边，WebP 编码写入对应的 MIME，目标大小模式降低质量直到满足"""
+    assert model_max_input_size("google/gemini-2.5-flash-image-preview:free") == 1024
+    assert model_max_input_size("google/gemini-2.5-pro") == 768
+    assert model_max_input_size("anthropic/claude-3-5-sonnet-20241022") == 1568
+    assert model_max_input_size("unknown/model") == MAX_INPUT_SIZE
+
+    monkeypatch.setenv("INPUT_IMAGE_FORMAT", "webp")
+    monkeypatch.setenv("INPUT_IMAGE_TARGET_KB", "40")
+    encoding = upload_encoding_for("google/gemini-2.5-pro")
+    assert encoding == UploadEncoding(format="webp", quality=85, max_size=768, target_bytes=40 * 1024)
+    monkeypatch.setenv("INPUT_IMAGE_FORMAT", "bmp")
+    assert upload_encoding_for("google/gemini-2.5-pro").format == "jpeg"
+
+    raw = make_noise_image("PNG", (600, 400))
+    webp = preprocess_image(raw, upload_format="webp")
+    assert webp.data_url.startswith("data:image/webp;base64,") and webp.mime_type == "image/webp"
+
+    full = preprocess_image(raw)
+    limited = preprocess_image(raw, target_bytes=len(full.encoded) // 2)
+    assert len(limited.encoded) <= len(full.encoded) // 2 and limited.size == full.size
+    # 目标大小无法满足时返回最低质量的结果，而不是失败
+    tiny = preprocess_image(raw, target_bytes=1024)
+    assert len(tiny.encoded) < len(limited.encoded)
+
+
+def test_upload_encoding_benchmark():
+    """WebP 传输量小于默认 JPEG，目标大小模式不超过目标"""
+    rows = {row["setting"]: row for row in run_upload_benchmark([1536], repeats=1)}
+    assert rows["webp-q80"]["wire_bytes"] < rows["jpeg-q85"]["wire_bytes"]
+    assert rows["jpeg-q85-gemini"]["size"] == (768, 576)
+    for name in ("jpeg-100k", "webp-100k"):
+        assert rows[name]["encoded_bytes"] <= rows[name]["target_bytes"]
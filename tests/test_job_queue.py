@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+后台任务队列测试
+"""
+
+import json
+import os
+import stat
+import tempfile
+import time
+from dataclasses import asdict
+
+import pytest
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+import utils.async_client as async_client
+import utils.job_queue as job_queue
+from benchmarks.mock_openrouter import MockConfig, MockOpenRouter
+from tools.job_result import JobResultTool
+from tools.submit_job import SubmitJobTool
+from utils.credentials import key_fingerprint
+from utils.generation import GenerationResult
+from utils.job_queue import JobQueue, JobSpec
+from utils.result_cache import CachedBlob
+
+API_KEY = "sk-or-v1-job-queue-test"
+
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    with MockOpenRouter(MockConfig(latency=0.05, image_px=32)) as mock:
+        monkeypatch.setattr(async_client, "OPENROUTER_API_BASE", mock.api_base)
+        yield mock
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), workers=2, timeout=10)
+    monkeypatch.setattr(job_queue, "_queue", queue)
+    yield queue
+    queue.stop(timeout=5)
+
+
+def test_submit_and_fetch_job_results(mock_api, queue, make_tool):
+    """提交后立即返回任务 ID，完成后按条目顺序取回图像，其他 key 无法查询"""
+    messages = list(make_tool(SubmitJobTool, API_KEY)._invoke({"prompt": "unused", "batch_prompts": "a cat\na dog"}))
+    job = next(m.message.json_object for m in messages if m.type == ToolInvokeMessage.MessageType.JSON)
+    assert job["status"] == "queued" and job["total"] == 2
+
+    messages = list(make_tool(JobResultTool, API_KEY)._invoke({"job_id": job["job_id"], "wait_seconds": 10}))
+    blobs = [m.message.blob for m in messages if m.type == ToolInvokeMessage.MessageType.BLOB]
+    status = next(m.message.json_object for m in messages if m.type == ToolInvokeMessage.MessageType.JSON)
+    assert blobs == [mock_api.png, mock_api.png]
+    assert status["status"] == "succeeded" and status["completed"] == 2
+    assert status["usage"]["total_tokens"] == 2 * 1302
+
+    other = list(make_tool(JobResultTool, "sk-or-v1-someone-else")._invoke({"job_id": job["job_id"]}))
+    assert other[0].message.text.startswith("❌ 任务不存在")
+    # 任务结束后不再保存 API Key
+    row = queue._connect().execute("SELECT api_key FROM jobs WHERE id = ?", (job["job_id"],)).fetchone()
+    assert row == (None,)
+
+
+def test_interrupted_job_resumes_without_repeating_finished_items(mock_api, tmp_path):
+    """进程退出后租约过期的任务被重新领取，已完成的条目不会重新生成"""
+    path = str(tmp_path / "jobs.sqlite3")
+    first = JobQueue(path, timeout=10)
+    spec = JobSpec(prompts=["one", "two", "three"], model="mock/model")
+    job_id = "interrupted"
+    with first._connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, status, spec, api_key, owner, total, attempts, created_at, lease_until) "
+            "VALUES (?, 'running', ?, ?, ?, 3, 1, ?, ?)",
+            (job_id, json.dumps(asdict(spec)), API_KEY, key_fingerprint(API_KEY), time.time(), time.time()),
+        )
+    first._record_item(job_id, 0, GenerationResult(blobs=[CachedBlob(b"done", "image/png")]), None)
+    # 模拟进程退出：租约过期
+    first._connect().execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() - 1, job_id))
+
+    restarted = JobQueue(path, timeout=10)
+    try:
+        restarted.start()
+        status = restarted.wait(job_id, timeout=10, api_key=API_KEY)
+    finally:
+        restarted.stop(timeout=5)
+    assert status.status == "succeeded" and status.attempts == 2
+    assert mock_api.requests == 2
+    assert [blob.blob for blob in restarted.outputs(job_id)] == [b"done", mock_api.png, mock_api.png]
+
+
+def test_job_interrupted_too_often_is_failed(tmp_path):
+    """超过最大尝试次数的中断任务标记为失败"""
+    queue = JobQueue(str(tmp_path / "jobs.sqlite3"), max_attempts=2)
+    spec = JobSpec(prompts=["one"], model="mock/model")
+    with queue._connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, status, spec, api_key, owner, total, attempts, created_at, lease_until) "
+            "VALUES ('stuck', 'running', ?, ?, ?, 1, 2, ?, ?)",
+            (json.dumps(asdict(spec)), API_KEY, key_fingerprint(API_KEY), time.time(), time.time() - 1),
+        )
+    assert queue._claim() is None
+    status = queue.status("stuck")
+    assert status.status == "failed" and "多次中断" in status.error
+    assert queue._connect().execute("SELECT api_key FROM jobs").fetchall() == [(None,)]
+
+
+def test_job_db_is_private(tmp_path, monkeypatch):
+    """数据库文件只允许当前用户读写，默认目录为 0700 的私有目录"""
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = JobQueue(path)
+    queue._connect().execute(
+        "INSERT INTO jobs (id, status, spec, api_key, owner, total, created_at) VALUES ('j', 'queued', '{}', ?, '', 1, 0)",
+        (API_KEY,),
+    )
+    for name in (path, f"{path}-wal", f"{path}-shm"):
+        if os.path.exists(name):
+            assert stat.S_IMODE(os.stat(name).st_mode) == 0o600
+
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    default = job_queue.default_db_path()
+    assert stat.S_IMODE(os.stat(os.path.dirname(default)).st_mode) == 0o700
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+分阶段耗时统计与指标导出测试
+"""
+
+import base64
+import json
+
+import pytest
+
+import utils.fallback as fallback
+import utils.http_pool as http_pool
+import utils.rate_limit as rate_limit
+import utils.result_cache as result_cache
+import utils.retry as retry
+from benchmarks.mock_openrouter import MockConfig, MockOpenRouter
+from utils.buffer_pool import get_buffer_pool
+from utils.metrics import Trace, get_metrics_registry, metrics_json
+from utils.rate_limit import BucketConfig, MemoryBucketStore, RateLimiter
+from utils.result_cache import ResultCache
+from utils.stream_parse import parse_completion_stream
+
+
+def test_trace_records_spans_and_status():
+    trace = Trace(model="metrics/test-model")
+    with trace.span("api_request", http_status=200) as span:
+        span["bytes"] = 1234
+    with pytest.raises(RuntimeError):
+        with trace.span("encode"):
+            raise RuntimeError("boom")
+    trace.add("base64_decode", 0.002, nbytes=99)
+
+    summary = trace.finish("ok")
+    assert summary["status"] == "ok"
+    assert summary["model"] == "metrics/test-model"
+    stages = {s["stage"]: s for s in summary["stages"]}
+    assert stages["api_request"]["bytes"] == 1234
+    assert stages["api_request"]["http_status"] == 200
+    assert stages["encode"]["status"] == "error"
+    assert stages["base64_decode"]["ms"] == 2.0
+    # JSON 日志行必须可以序列化
+    json.dumps(summary)
+    # 重复调用不会重复计数
+    assert trace.finish("error") is summary
+
+
+def test_prometheus_export(tmp_path, monkeypatch):
+    prom_file = tmp_path / "nano_banana.prom"
+    monkeypatch.setenv("METRICS_PROM_FILE", str(prom_file))
+    trace = Trace(model='metrics/"quoted"')
+    trace.add("image_fetch", 0.3, nbytes=500)
+    trace.finish("ok")
+
+    text = prom_file.read_text(encoding="utf-8")
+    assert text == get_metrics_registry().prometheus_text()
+    assert "# TYPE nano_banana_stage_duration_seconds histogram" in text
+    labels = 'stage="image_fetch",model="metrics/\\"quoted\\"",status="ok"'
+    assert f'nano_banana_stage_duration_seconds_bucket{{{labels},le="0.5"}} 1' in text
+    assert f'nano_banana_stage_duration_seconds_bucket{{{labels},le="0.25"}} 0' in text
+    assert 'nano_banana_stage_bytes_total{stage="image_fetch",model="metrics/\\"quoted\\""} 500' in text
+
+
+def test_component_stats_exported(tmp_path, monkeypatch):
+    """连接池、重试、回退、限流、缓存、缓冲池和请求合并的统计出现在 Prometheus 与 JSON 导出中"""
+    limiter = RateLimiter(MemoryBucketStore(), BucketConfig(rate=1, burst=5))
+    limiter.acquire("sk-or-v1-metrics", "m")
+    monkeypatch.setattr(rate_limit, "_limiter", limiter)
+    cache = ResultCache(str(tmp_path / "results"), 1 << 20, 60)
+    cache.get("missing")
+    monkeypatch.setattr(result_cache, "_cache", cache)
+    get_buffer_pool().acquire(1024).release()
+    retry._metrics.record("metrics_op", attempts=2, backoff=0.5, gave_up=False)
+    fallback._stats.record("metrics/model", "served", 0.2)
+    with MockOpenRouter(MockConfig(latency=0)) as mock:
+        http_pool.get_session().get(f"{mock.api_base}/key", timeout=5).close()
+        host = f"127.0.0.1:{mock.port}"
+
+        text = get_metrics_registry().prometheus_text()
+        snapshot = json.loads(metrics_json())
+
+    assert f'nano_banana_http_pool_requests_total{{host="{host}"}}' in text
+    assert "# TYPE nano_banana_http_pool_idle_connections gauge" in text
+    assert 'nano_banana_retry_retries_total{operation="metrics_op"}' in text
+    assert 'nano_banana_model_routing_served_total{model="metrics/model"}' in text
+    assert 'nano_banana_model_routing_p95_seconds{model="metrics/model"}' in text
+    assert "# TYPE nano_banana_rate_limit_queue_depth gauge" in text
+    assert "nano_banana_rate_limit_wait_seconds_total{bucket=" in text
+    assert "nano_banana_result_cache_misses_total 1" in text
+    assert "nano_banana_buffer_pool_acquired_total" in text
+    assert "nano_banana_coalescing_shared_total" in text
+
+    components = snapshot["components"]
+    assert components["http_pool"]["series"][host]["requests"] >= 1
+    assert components["retry"]["series"]["metrics_op"]["retries"] >= 1
+    assert components["rate_limit"]["label"] == "bucket"
+    assert components["result_cache"]["stats"]["misses"] == 1
+    assert set(components) >= {"model_routing", "buffer_pool", "coalescing"}
+
+
+def test_stream_parser_reports_bytes_and_decode_time():
+    image = bytes(range(256)) * 100
+    body = json.dumps({"choices": [{"message": {"images": [{"image_url": {
+        "url": "data:image/png;base64," + base64.b64encode(image).decode()
+    }}]}}]}).encode()
+    parsed = parse_completion_stream(body[i:i + 1000] for i in range(0, len(body), 1000))
+    assert parsed.blobs == [image]
+    assert parsed.response_bytes == len(body)
+    assert parsed.decode_seconds > 0
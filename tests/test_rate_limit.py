@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+客户端令牌桶限流测试
+"""
+
+import pytest
+
+import utils.rate_limit as rate_limit
+from utils.async_client import run_sync
+from utils.rate_limit import (
+    BucketConfig,
+    FileBucketStore,
+    MemoryBucketStore,
+    RateLimiter,
+    RateLimitExceeded,
+    get_rate_limiter,
+)
+
+
+def test_burst_then_reservations_queue_in_order():
+    """突发额度用完后，后续请求按预约顺序依次等待"""
+    store = MemoryBucketStore()
+    config = BucketConfig(rate=10, burst=2)
+    waits = [store.reserve("b", config, now=100.0)[0] for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1)
+    assert waits[3] == pytest.approx(0.2)
+
+
+def test_max_wait_rejects_and_returns_token():
+    """等待时间超过上限时拒绝请求，并归还已预约的令牌"""
+    limiter = RateLimiter(MemoryBucketStore(), BucketConfig(rate=0.01, burst=1), max_wait=1)
+    assert limiter.acquire("sk-or-v1-a", "m") == 0.0
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("sk-or-v1-a", "m")
+    stats = next(iter(limiter.stats().values()))
+    assert stats["rejected"] == 1 and stats["queue_depth"] == 0
+
+    # 不同 key 使用各自的桶
+    assert limiter.acquire("sk-or-v1-b", "m") == 0.0
+
+
+def test_model_bucket_limits_per_model():
+    """配置了模型级限流时，同一模型共享额度，不同模型互不影响"""
+    limiter = RateLimiter(
+        MemoryBucketStore(),
+        key_config=BucketConfig(rate=100, burst=100),
+        model_config=BucketConfig(rate=0.01, burst=1),
+        max_wait=1,
+    )
+    limiter.acquire("sk", "model-a")
+    limiter.acquire("sk", "model-b")
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire("sk", "model-a")
+
+
+def test_file_store_shared_between_limiters(tmp_path):
+    """文件后端让多个限流器实例（模拟多个进程）共享同一份额度"""
+    config = BucketConfig(rate=0.01, burst=2)
+    first = RateLimiter(FileBucketStore(str(tmp_path)), config, max_wait=1)
+    second = RateLimiter(FileBucketStore(str(tmp_path)), config, max_wait=1)
+    first.acquire("sk", "m")
+    second.acquire("sk", "m")
+    with pytest.raises(RateLimitExceeded):
+        first.acquire("sk", "m")
+    with pytest.raises(RateLimitExceeded):
+        second.acquire("sk", "m")
+
+
+def test_zero_rpm_disables_bucket(monkeypatch):
+    """RPM 为 0 时不创建对应的桶，而不是按 0 速率计算等待时间"""
+    monkeypatch.setattr(rate_limit, "_limiter", None)
+    monkeypatch.setenv("RATE_LIMIT_ENABLED", "true")
+    monkeypatch.setenv("RATE_LIMIT_KEY_RPM", "0")
+    monkeypatch.delenv("RATE_LIMIT_MODEL_RPM", raising=False)
+    assert get_rate_limiter() is None
+
+    monkeypatch.setenv("RATE_LIMIT_MODEL_RPM", "60")
+    limiter = get_rate_limiter()
+    assert limiter.key_config is None
+    assert [limiter.acquire("sk", "m") for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert all(name.startswith("model-") for name in limiter.stats())
+
+
+def test_file_store_async_acquire(tmp_path):
+    """异步调用方在线程中预约文件后端的令牌"""
+    limiter = RateLimiter(FileBucketStore(str(tmp_path)), BucketConfig(rate=100, burst=1), max_wait=1)
+
+    async def acquire_twice():
+        return [await limiter.acquire_async("sk", "m") for _ in range(2)]
+
+    waits = run_sync(acquire_twice())
+    assert waits[0] == 0.0 and 0 < waits[1] <= 0.011
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+派生版本（缩略图、多格式）测试
+"""
+
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+import tools.text2image as text2image
+from benchmarks.mock_openrouter import MockConfig, MockOpenRouter
+from utils.renditions import Rendition, parse_renditions, render_renditions
+
+
+def test_parse_renditions():
+    """支持缩略图尺寸、格式和 格式:尺寸，去重并拒绝无效写法"""
+    assert parse_renditions("256, webp\njpeg:1024, 256", quality=80) == [
+        Rendition(max_size=256, quality=80),
+        Rendition(format="webp", quality=80),
+        Rendition(format="jpeg", max_size=1024, quality=80),
+    ]
+    assert [r.name for r in parse_renditions("webp:512, 128, png")] == ["webp:512", "128", "png"]
+    for text in ("gif", "webp:abc", "8"):
+        with pytest.raises(ValueError):
+            parse_renditions(text)
+
+
+def test_renditions_share_one_decode(monkeypatch):
+    """所有派生版本共用一次解码，不放大图像，跳过与原图相同的版本"""
+    buffer = BytesIO()
+    Image.new("RGBA", (800, 600), (255, 128, 0, 200)).save(buffer, format="PNG")
+    raw = buffer.getvalue()
+
+    opened = []
+    original_open = Image.open
+    monkeypatch.setattr(Image, "open", lambda fp: opened.append(fp) or original_open(fp))
+    rendered = render_renditions(raw, parse_renditions("200, webp, jpeg:400, png, 1024"))
+    assert len(opened) == 1
+
+    assert [(r.rendition.name, r.mime_type, r.size) for r in rendered] == [
+        ("200", "image/png", (200, 150)),
+        ("webp", "image/webp", (800, 600)),
+        ("jpeg:400", "image/jpeg", (400, 300)),
+    ]
+    monkeypatch.setattr(Image, "open", original_open)
+    assert Image.open(BytesIO(rendered[2].blob)).format == "JPEG"
+
+
+def test_tool_returns_renditions_after_each_image(monkeypatch, make_tool):
+    """每张生成的图像后紧跟它的派生版本，元数据标明版本名称"""
+    with MockOpenRouter(MockConfig(latency=0, image_px=64, images=2)) as mock:
+        monkeypatch.setattr(text2image, "OPENROUTER_API_BASE", mock.api_base)
+        messages = list(make_tool(api_key="sk-or-v1-renditions")._invoke({"prompt": "renditions", "verbosity": "quiet", "renditions": "32, webp"}))
+
+    blobs = [m for m in messages if m.type == ToolInvokeMessage.MessageType.BLOB]
+    assert [m.meta.get("rendition") for m in blobs] == [None, "32", "webp", None, "32", "webp"]
+    assert blobs[0].message.blob == mock.png
+    assert Image.open(BytesIO(blobs[1].message.blob)).size == (32, 32)
+    assert blobs[2].meta["mime_type"] == "image/webp"
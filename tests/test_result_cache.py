@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+生成结果缓存测试
+"""
+
+import os
+import stat
+import tempfile
+import time
+
+import utils.result_cache as result_cache
+from utils.result_cache import CachedBlob, ResultCache, make_cache_key
+
+
+def test_cache_key_depends_on_all_inputs():
+    """调用方、模型、提示词、输入图像和参数任一变化都会改变缓存键"""
+    base = make_cache_key("m", "banana", b"img", {"format": "png"})
+    assert base == make_cache_key("m", "banana", b"img", {"format": "png"})
+    assert base != make_cache_key("m2", "banana", b"img", {"format": "png"})
+    assert base != make_cache_key("m", "apple", b"img", {"format": "png"})
+    assert base != make_cache_key("m", "banana", b"other", {"format": "png"})
+    assert base != make_cache_key("m", "banana", b"img", {"format": "webp"})
+    tenant = make_cache_key("m", "banana", b"img", {"format": "png"}, owner="fingerprint-a")
+    assert tenant not in (base, make_cache_key("m", "banana", b"img", {"format": "png"}, owner="fingerprint-b"))
+
+
+def test_default_directory_and_files_are_private(tmp_path, monkeypatch):
+    """默认缓存目录只有当前用户可访问，缓存文件的权限为 0600"""
+    monkeypatch.setattr(result_cache, "_cache", None)
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    monkeypatch.setenv("RESULT_CACHE_ENABLED", "true")
+    monkeypatch.delenv("RESULT_CACHE_DIR", raising=False)
+    cache = result_cache.get_result_cache()
+    assert cache.directory == os.path.join(tmp_path, f"nano_banana-{os.getuid()}", "results")
+    assert stat.S_IMODE(os.stat(cache.directory).st_mode) == 0o700
+
+    cache.put("k", [CachedBlob(b"png-bytes", "image/png")])
+    entry = os.path.join(cache.directory, "k")
+    assert stat.S_IMODE(os.stat(entry).st_mode) == 0o700
+    assert {stat.S_IMODE(os.stat(os.path.join(entry, name)).st_mode) for name in os.listdir(entry)} == {0o600}
+
+
+def test_hit_miss_and_persistence(tmp_path):
+    """命中、未命中计数正确，重启后仍可读取"""
+    cache = ResultCache(str(tmp_path), max_bytes=1024, ttl_seconds=60)
+    assert cache.get("k") is None
+    cache.put("k", [CachedBlob(b"png-bytes", "image/png")])
+    hit = cache.get("k")
+    assert hit is not None and hit[0].blob == b"png-bytes"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+    reopened = ResultCache(str(tmp_path), max_bytes=1024, ttl_seconds=60)
+    assert reopened.get("k")[0].mime_type == "image/png"
+
+
+def test_lru_and_ttl_eviction(tmp_path):
+    """超出容量时淘汰最久未使用的条目，过期条目视为未命中"""
+    cache = ResultCache(str(tmp_path), max_bytes=20, ttl_seconds=60)
+    cache.put("a", [CachedBlob(b"x" * 8, "image/png")])
+    cache.put("b", [CachedBlob(b"y" * 8, "image/png")])
+    cache.get("a")
+    cache.put("c", [CachedBlob(b"z" * 8, "image/png")])
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+    cache.ttl_seconds = 0.01
+    time.sleep(0.02)
+    assert cache.get("c") is None
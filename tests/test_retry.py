@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+重试策略测试
+"""
+
+from types import SimpleNamespace
+
+import requests
+
+from utils.async_client import run_sync
+from utils.retry import (
+    RetryPolicy,
+    call_with_retry,
+    call_with_retry_async,
+    retry_after_seconds,
+    retry_metrics,
+)
+
+FAST = RetryPolicy(max_attempts=3, base_delay=0.001, max_delay=0.01, deadline=5)
+
+
+def response(status, retry_after=None):
+    headers = {"Retry-After": retry_after} if retry_after is not None else {}
+    return SimpleNamespace(status_code=status, headers=headers, close=lambda: None)
+
+
+def sequence(*results):
+    """按顺序返回结果（异常则抛出）的请求函数"""
+    results = list(results)
+    calls = []
+
+    def func():
+        calls.append(1)
+        result = results.pop(0)
+        if isinstance(result, BaseException):
+            raise result
+        return result
+    return func, calls
+
+
+def test_retry_after_parsing():
+    """Retry-After 支持秒数和 HTTP 日期"""
+    assert retry_after_seconds(response(429, "2")) == 2.0
+    assert retry_after_seconds(response(429, "Wed, 21 Oct 2015 07:28:00 GMT")) == 0.0
+    assert retry_after_seconds(response(429, "soon")) is None
+    assert retry_after_seconds(response(429)) is None
+
+
+def test_retries_rate_limit_then_succeeds():
+    """429 会重试，最终返回成功响应并记录指标"""
+    func, calls = sequence(response(429, "0"), response(503), response(200))
+    assert call_with_retry(func, "test_ok", idempotent=False, policy=FAST).status_code == 200
+    assert len(calls) == 3
+    stats = retry_metrics()["test_ok"]
+    assert stats["attempts"] == 3 and stats["retries"] == 2 and stats["giveups"] == 0
+
+
+def test_non_idempotent_only_retries_safe_failures():
+    """非幂等请求不重试 500、502 和读超时，幂等请求会重试"""
+    for status in (500, 502):
+        func, calls = sequence(response(status), response(200))
+        assert call_with_retry(func, "test_gen", idempotent=False, policy=FAST).status_code == status
+        assert len(calls) == 1
+
+    func, calls = sequence(response(502), response(200))
+    assert call_with_retry(func, "test_get", idempotent=True, policy=FAST).status_code == 200
+
+    func, calls = sequence(requests.exceptions.ReadTimeout(), response(200))
+    try:
+        call_with_retry(func, "test_gen", idempotent=False, policy=FAST)
+        assert False, "读超时不应重试"
+    except requests.exceptions.ReadTimeout:
+        assert len(calls) == 1
+
+    func, calls = sequence(requests.exceptions.ConnectTimeout(), response(200))
+    assert call_with_retry(func, "test_gen", idempotent=False, policy=FAST).status_code == 200
+
+
+def test_gives_up_when_attempts_or_deadline_exhausted():
+    """超过最大尝试次数或时间预算时返回最后一次响应"""
+    func, calls = sequence(*[response(429)] * 5)
+    assert call_with_retry(func, "test_giveup", policy=FAST).status_code == 429
+    assert len(calls) == 3
+    assert retry_metrics()["test_giveup"]["giveups"] == 1
+
+    func, calls = sequence(response(429, "60"), response(200))
+    assert call_with_retry(func, "test_deadline", policy=FAST).status_code == 429
+    assert len(calls) == 1
+
+
+def test_async_retry():
+    """异步版本的行为与同步版本一致"""
+    results = [response(503), response(200)]
+
+    async def func():
+        return results.pop(0)
+
+    result = run_sync(call_with_retry_async(func, "test_async", idempotent=False, policy=FAST))
+    assert result.status_code == 200
+
+
+def test_deadline_defaults_to_request_timeout(monkeypatch):
+    """未设置 RETRY_DEADLINE 时，重试的总时间预算不超过插件的单次请求超时"""
+    monkeypatch.delenv("RETRY_DEADLINE", raising=False)
+    monkeypatch.delenv("MAX_REQUEST_TIMEOUT", raising=False)
+    assert RetryPolicy.from_env().deadline == 60
+    monkeypatch.setenv("MAX_REQUEST_TIMEOUT", "45")
+    assert RetryPolicy.from_env().deadline == 45
+    monkeypatch.setenv("RETRY_DEADLINE", "30")
+    assert RetryPolicy.from_env().deadline == 30
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+SSE 流式响应解析测试
+"""
+
+import json
+import time
+
+import pytest
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+import tools.text2image as text2image
+import utils.async_client as async_client
+from benchmarks.mock_openrouter import MockConfig, MockOpenRouter
+from utils.sse import iter_completion_events, iter_sse_data, iter_stream_lines
+
+
+def test_iter_sse_data_skips_comments_and_joins_lines():
+    """注释行被忽略，多行 data 合并为一个事件"""
+    lines = [b": OPENROUTER PROCESSING", b"", b"data: a", b"data: b", b"", "data:c", ""]
+    assert list(iter_sse_data(lines)) == ["a\nb", "c"]
+
+
+def test_iter_completion_events_in_arrival_order():
+    """文本、图像和用量事件按到达顺序产出，[DONE] 之后停止"""
+    def event(obj):
+        return ["data: " + json.dumps(obj), ""]
+
+    lines = (
+        event({"choices": [{"delta": {"content": "Hi"}}]})
+        + [": keep-alive", ""]
+        + event({"choices": [{"delta": {"images": [{"image_url": {"url": "data:image/png;base64,AA=="}}]}}]})
+        + event({"choices": [{"delta": {}}], "usage": {"total_tokens": 3}})
+        + ["data: [DONE]", ""]
+        + event({"choices": [{"delta": {"content": "ignored"}}]})
+    )
+    events = list(iter_completion_events(lines))
+    assert [e.kind for e in events] == ["text", "image", "usage"]
+    assert events[0].text == "Hi"
+    assert events[1].image_url == "data:image/png;base64,AA=="
+    assert events[2].usage == {"total_tokens": 3}
+
+
+def test_iter_completion_events_stops_on_error():
+    """流中出现错误对象时产出 error 事件并结束"""
+    lines = ['data: {"error": {"message": "overloaded"}}', ""]
+    events = list(iter_completion_events(lines))
+    assert len(events) == 1 and events[0].kind == "error" and events[0].text == "overloaded"
+
+
+def test_iter_stream_lines_splits_across_reads():
+    """跨越多次读取的行被拼接完整，最后一行没有换行符时也会产出"""
+    reads = iter([b"data: a", b"bc\n\nda", b"ta: " + b"x" * 10 + b"\r\n", b"\ntail", b""])
+    assert list(iter_stream_lines(lambda size: next(reads), 4)) == [
+        b"data: abc", b"", b"data: " + b"x" * 10 + b"\r", b"", b"tail",
+    ]
+
+
+@pytest.mark.parametrize("engine", ["sync", "async"])
+@pytest.mark.parametrize("chunked", [True, False])
+def test_text_deltas_forwarded_before_stream_ends(make_tool, monkeypatch, engine, chunked):
+    """文本增量到达即转发，不等流结束；不分块、以关闭连接结束的响应也是如此"""
+    monkeypatch.setenv("HTTP_ENGINE", engine)
+    monkeypatch.delenv("RESULT_CACHE_ENABLED", raising=False)
+    # 文本增量在 0.3 秒、0.6 秒到达，图像在 0.9 秒到达
+    with MockOpenRouter(MockConfig(latency=0.9, image_px=32, sse_chunks=2, sse_chunked=chunked)) as mock:
+        monkeypatch.setattr(text2image, "OPENROUTER_API_BASE", mock.api_base)
+        monkeypatch.setattr(async_client, "OPENROUTER_API_BASE", mock.api_base)
+        started = time.perf_counter()
+        arrivals = {}
+        for message in make_tool()._invoke({"prompt": "stream me", "stream": True, "verbosity": "normal"}):
+            if message.type == ToolInvokeMessage.MessageType.TEXT and message.message.text.startswith("part"):
+                arrivals.setdefault(message.message.text.strip(), time.perf_counter() - started)
+            elif message.type == ToolInvokeMessage.MessageType.BLOB:
+                arrivals.setdefault("image", time.perf_counter() - started)
+
+    assert list(arrivals) == ["part 0", "part 1", "image"]
+    assert arrivals["part 0"] < 0.55 and arrivals["image"] >= 0.85
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+启动耗时与启动预热测试
+"""
+
+import subprocess
+import sys
+
+import utils.http_pool as http_pool
+from benchmarks.bench_startup import BASELINE_IMPORTS, ROOT, parse_importtime, run
+from benchmarks.mock_openrouter import MockConfig, MockOpenRouter
+from utils.warmup import start_warmup, warm_up
+
+
+def test_parse_importtime():
+    stderr = (
+        "import time: self [us] | cumulative | imported package\n"
+        "import time:       120 |        120 |     utils.config\n"
+        "import time:       300 |        420 |   utils.retry\n"
+        "import time:       500 |        920 | tools.text2image\n"
+        "-- startup imports done --\n"
+        "import time:      9000 |       9000 | PIL\n"
+    )
+    assert parse_importtime(stderr) == [
+        {"module": "utils.config", "self_ms": 0.12, "cumulative_ms": 0.12, "level": 2},
+        {"module": "utils.retry", "self_ms": 0.3, "cumulative_ms": 0.42, "level": 1},
+        {"module": "tools.text2image", "self_ms": 0.5, "cumulative_ms": 0.92, "level": 0},
+    ]
+
+
+def test_startup_does_not_import_pillow():
+    """插件启动时只加载工具模块，Pillow 延迟到第一次处理图像时导入"""
+    summary = run(runs=1)
+    assert summary["modules"][0] == "provider.nano_banana_provider"
+    assert "tools.text2image" in summary["modules"]
+    assert {record["module"] for record in summary["top_modules"]} >= {"tools.text2image"}
+    assert summary["deferred_loaded"] == []
+    assert summary["first_codec_ms"] > 0
+
+
+def test_submit_job_does_not_import_generation_tool():
+    """任务提交工具只依赖轻量的常量模块，不会加载生成工具"""
+    code = f"{BASELINE_IMPORTS}\nimport sys, tools.submit_job\nprint('tools.text2image' in sys.modules)"
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert proc.stdout.strip() == "False"
+
+
+def test_warm_up_primes_codecs_and_preconnects(monkeypatch):
+    """预热后连接池中保留了到 OpenRouter 的空闲连接；未开启时不启动预热线程"""
+    monkeypatch.delenv("WARMUP_ENABLED", raising=False)
+    assert start_warmup() is None
+
+    with MockOpenRouter(MockConfig(latency=0)) as mock:
+        monkeypatch.setattr(http_pool, "OPENROUTER_API_BASE", mock.api_base)
+        timings = warm_up()
+        stats = http_pool.pool_stats()[f"127.0.0.1:{mock.port}"]
+    assert set(timings) == {"codecs", "connect"}
+    assert stats["requests"] >= 1 and stats["idle_connections"] >= 1
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+响应流式解析测试
+"""
+
+import base64
+import json
+import os
+
+from benchmarks.bench_stream_parse_memory import run
+from utils.stream_parse import parse_completion_stream, resolve_blob
+
+
+def split_every(data: bytes, size: int) -> list[bytes]:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_extracts_images_across_chunk_boundaries():
+    """任意分块位置都能正确还原图像和其余 JSON 字段"""
+    images = [os.urandom(1000), os.urandom(7)]
+    body = json.dumps({
+        "choices": [{"message": {
+            "content": 'say "data:image/" \\ here',
+            "images": [
+                {"image_url": {"url": "data:image/png;base64," + base64.b64encode(img).decode()}}
+                for img in images
+            ],
+        }}],
+        "note": "data:image/svg+xml,<svg/>",
+    }).replace("/", "\\/").encode()
+
+    for size in (1, 3, 17, 4096):
+        parsed = parse_completion_stream(split_every(body, size))
+        message = parsed.data["choices"][0]["message"]
+        assert message["content"] == 'say "data:image/" \\ here'
+        assert parsed.data["note"] == "data:image/svg+xml,<svg/>"
+        urls = [item["image_url"]["url"] for item in message["images"]]
+        assert [resolve_blob(url, parsed.blobs) for url in urls] == images
+        assert parsed.mime_types == ["image/png", "image/png"]
+
+
+def test_streaming_parse_peak_memory_close_to_blob_size():
+    """流式解析的峰值内存接近图像本身大小，远低于整体解析"""
+    rows = {row["mode"]: row for row in run([4])}
+    assert rows["streaming"]["peak_ratio"] < 1.5
+    assert rows["naive"]["peak_ratio"] > 3 * rows["streaming"]["peak_ratio"]
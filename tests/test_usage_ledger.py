@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+用量台账与花费预算测试
+"""
+
+import os
+import stat
+import tempfile
+import time
+
+import pytest
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+import tools.text2image as text2image
+import utils.async_client as async_client
+import utils.result_cache as result_cache
+import utils.usage_ledger as usage_ledger
+from benchmarks.mock_openrouter import MockConfig, MockOpenRouter
+from utils.budget import FREE_MODEL
+from utils.credentials import key_fingerprint
+from utils.result_cache import CachedBlob, ResultCache
+from utils.usage_ledger import UsageLedger, UsageRecord, estimate_cost
+
+API_KEY = "sk-or-v1-usage-ledger-test"
+
+
+@pytest.fixture
+def invoke(make_tool):
+    return lambda params: list(make_tool(api_key=API_KEY)._invoke(params))
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    ledger = UsageLedger(str(tmp_path / "usage.sqlite3"), flush_seconds=60)
+    monkeypatch.setattr(usage_ledger, "_ledger", ledger)
+    monkeypatch.setenv("USAGE_LEDGER_ENABLED", "true")
+    return ledger
+
+
+def test_ledger_is_opt_in_and_private(tmp_path, monkeypatch):
+    """默认不记录用量（设置了预算时除外），数据库位于私有目录且只有当前用户可读写"""
+    monkeypatch.setattr(usage_ledger, "_ledger", None)
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    monkeypatch.delenv("USAGE_LEDGER_ENABLED", raising=False)
+    monkeypatch.delenv("USAGE_LEDGER_DB", raising=False)
+    monkeypatch.delenv("BUDGET_USD", raising=False)
+    assert usage_ledger.get_usage_ledger() is None
+
+    monkeypatch.setenv("BUDGET_USD", "5")
+    ledger = usage_ledger.get_usage_ledger()
+    assert ledger is not None and os.path.dirname(ledger.path) == os.path.join(tmp_path, f"nano_banana-{os.getuid()}")
+    assert stat.S_IMODE(os.stat(os.path.dirname(ledger.path)).st_mode) == 0o700
+    assert stat.S_IMODE(os.stat(ledger.path).st_mode) == 0o600
+
+
+def test_batched_writes_and_aggregates(ledger):
+    """记录先进入内存队列，汇总时一次写入；费用优先使用 usage.cost"""
+    usage = {"prompt_tokens": 100, "completion_tokens": 1290, "total_tokens": 1390}
+    ledger.record(UsageRecord.from_usage("a", "google/gemini-2.5-flash-image", usage, images=1, workflow="app-1"))
+    ledger.record(UsageRecord.from_usage("a", "openai/gpt-4o", dict(usage, cost=0.5), workflow="app-2"))
+    ledger.record(UsageRecord.from_usage("b", "google/gemini-2.5-flash-image:free", usage, images=2))
+    assert ledger._connect().execute("SELECT COUNT(*) FROM usage").fetchone() == (0,)
+    assert ledger.spent("a", since=0) == pytest.approx(estimate_cost("google/gemini-2.5-flash-image", usage) + 0.5)
+
+    by_model = {row["model"]: row for row in ledger.aggregate(("model",))}
+    assert by_model["openai/gpt-4o"]["cost"] == 0.5
+    assert by_model["google/gemini-2.5-flash-image"]["cost"] == pytest.approx((100 * 0.30 + 1290 * 30.0) / 1e6)
+    assert by_model["google/gemini-2.5-flash-image:free"]["cost"] == 0
+    assert ledger._connect().execute("SELECT COUNT(*) FROM usage").fetchone() == (3,)
+
+    by_owner_workflow = ledger.aggregate(("owner", "workflow"), owner="a")
+    assert [(row["workflow"], row["calls"]) for row in by_owner_workflow] == [("app-2", 1), ("app-1", 1)]
+    (total,) = ledger.aggregate(())
+    assert total["calls"] == 3 and total["images"] == 3 and total["total_tokens"] == 3 * 1390
+    assert ledger.aggregate(since=time.time() + 60) == []
+    with pytest.raises(ValueError):
+        ledger.aggregate(("api_key",))
+
+
+def test_tool_records_usage_without_double_counting_cache_hits(ledger, invoke, monkeypatch, tmp_path):
+    """每次实际生成记录一条用量，命中结果缓存时不计费"""
+    monkeypatch.setenv("RESULT_CACHE_ENABLED", "true")
+    monkeypatch.setattr(result_cache, "_cache", ResultCache(str(tmp_path / "results"), 1 << 20, 60))
+    with MockOpenRouter(MockConfig(latency=0, image_px=32)) as mock:
+        monkeypatch.setattr(text2image, "OPENROUTER_API_BASE", mock.api_base)
+        invoke({"prompt": "ledger cat"})
+        invoke({"prompt": "ledger cat"})
+    rows = ledger.aggregate(("owner", "model", "mode"))
+    assert len(rows) == 1
+    assert rows[0]["owner"] == key_fingerprint(API_KEY)
+    assert rows[0]["model"] == text2image.DEFAULT_MODEL
+    assert mock.requests == 1
+    assert rows[0]["calls"] == 1 and rows[0]["total_tokens"] == 1302
+    assert rows[0]["images"] == 1 and rows[0]["cost"] > 0
+
+
+@pytest.mark.parametrize("action", ["reject", "downgrade"])
+def test_budget_guard(ledger, invoke, monkeypatch, action):
+    """第二次调用会超出预算：reject 时不发送请求，downgrade 时改用免费模型"""
+    monkeypatch.setenv("BUDGET_USD", "0.05")
+    monkeypatch.setenv("BUDGET_ACTION", action)
+    monkeypatch.delenv("RESULT_CACHE_ENABLED", raising=False)
+    with MockOpenRouter(MockConfig(latency=0, image_px=32)) as mock:
+        monkeypatch.setattr(text2image, "OPENROUTER_API_BASE", mock.api_base)
+        invoke({"prompt": "budget one"})
+        messages = invoke({"prompt": "budget two"})
+
+    texts = [m.message.text for m in messages if m.type == ToolInvokeMessage.MessageType.TEXT]
+    blobs = [m for m in messages if m.type == ToolInvokeMessage.MessageType.BLOB]
+    if action == "reject":
+        assert mock.requests == 1 and not blobs
+        assert any(text.startswith("❌ 花费预算不足") for text in texts)
+    else:
+        assert mock.requests == 2 and len(blobs) == 1
+        assert any(FREE_MODEL in text for text in texts)
+        models = {row["model"]: row["cost"] for row in ledger.aggregate(("model",))}
+        assert models[FREE_MODEL] == 0
+
+
+@pytest.mark.parametrize("action", ["reject", "downgrade"])
+def test_budget_checked_only_on_cache_miss(ledger, invoke, monkeypatch, tmp_path, action):
+    """命中结果缓存的请求不消耗预算，也不会因降级而绕过请求模型的缓存"""
+    monkeypatch.setenv("RESULT_CACHE_ENABLED", "true")
+    monkeypatch.setattr(result_cache, "_cache", ResultCache(str(tmp_path / "results"), 1 << 20, 60))
+    with MockOpenRouter(MockConfig(latency=0, image_px=32)) as mock:
+        monkeypatch.setattr(text2image, "OPENROUTER_API_BASE", mock.api_base)
+        monkeypatch.setattr(async_client, "OPENROUTER_API_BASE", mock.api_base)
+        invoke({"prompt": "cached cat"})
+        invoke({"prompt": "cached dog", "batch_prompts": "cached dog\ncached fox"})
+        monkeypatch.setenv("BUDGET_USD", "0.05")
+        monkeypatch.setenv("BUDGET_ACTION", action)
+        single = invoke({"prompt": "cached cat"})
+        batch = invoke({"prompt": "cached dog", "batch_prompts": "cached dog\ncached fox"})
+        partial = invoke({"prompt": "cached dog", "batch_prompts": "cached dog\nnew owl"})
+
+    for messages in (single, batch):
+        texts = [m.message.text for m in messages if m.type == ToolInvokeMessage.MessageType.TEXT]
+        assert not any("花费预算" in text for text in texts)
+    assert len([m for m in batch if m.type == ToolInvokeMessage.MessageType.BLOB]) == 2
+    partial_blobs = [m for m in partial if m.type == ToolInvokeMessage.MessageType.BLOB]
+    if action == "reject":
+        # 只返回已缓存的条目，未缓存的条目不发送请求
+        assert mock.requests == 3 and len(partial_blobs) == 1
+    else:
+        assert mock.requests == 4 and len(partial_blobs) == 2
+        assert {row["model"] for row in ledger.aggregate(("model",))} == {text2image.DEFAULT_MODEL, FREE_MODEL}
+
+
+def test_usage_recorded_per_served_model(ledger, invoke, monkeypatch):
+    """回退链中由备用模型完成的生成按实际模型计费"""
+    usage = {"prompt_tokens": 10, "completion_tokens": 1290, "total_tokens": 1300}
+
+    async def fake_fallback(api_key, models, content, **kwargs):
+        served = models[0] if content[0]["text"] == "primary" else models[1]
+        return text2image.GenerationResult(blobs=[CachedBlob(b"img", "image/png")], usage=usage, model=served)
+
+    monkeypatch.setattr(text2image, "generate_with_fallback", fake_fallback)
+    invoke({"prompt": "primary", "fallback_models": "openai/gpt-4o"})
+    invoke({"prompt": "x", "batch_prompts": "primary\nbackup\nbackup", "fallback_models": "openai/gpt-4o"})
+
+    rows = {row["model"]: row for row in ledger.aggregate(("model",))}
+    assert rows[text2image.DEFAULT_MODEL]["calls"] == 2
+    assert rows["openai/gpt-4o"]["calls"] == 2
+    assert rows["openai/gpt-4o"]["cost"] == pytest.approx(2 * estimate_cost("openai/gpt-4o", usage))
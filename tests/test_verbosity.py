@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+消息详细程度测试
+"""
+
+from dify_plugin.entities.tool import ToolInvokeMessage
+
+from tools.text2image import resolve_verbosity
+
+
+def test_resolve_verbosity(monkeypatch):
+    monkeypatch.delenv("DEBUG", raising=False)
+    monkeypatch.delenv("VERBOSITY", raising=False)
+    assert resolve_verbosity(None) == "normal"
+    assert resolve_verbosity("Quiet") == "quiet"
+    assert resolve_verbosity("unknown") == "normal"
+    monkeypatch.setenv("VERBOSITY", "quiet")
+    assert resolve_verbosity("") == "quiet"
+    monkeypatch.setenv("DEBUG", "true")
+    assert resolve_verbosity(None) == "debug"
+    assert resolve_verbosity("normal") == "normal"
+
+
+def test_errors_always_sent_and_summary_only_above_quiet(monkeypatch, make_tool):
+    monkeypatch.delenv("DEBUG", raising=False)
+    quiet = list(make_tool()._invoke({"prompt": "", "verbosity": "quiet"}))
+    assert [m.type for m in quiet] == [ToolInvokeMessage.MessageType.TEXT]
+    assert "提示词" in quiet[0].message.text
+
+    normal = list(make_tool()._invoke({"prompt": ""}))
+    assert [m.type for m in normal] == [ToolInvokeMessage.MessageType.TEXT, ToolInvokeMessage.MessageType.JSON]
+    summary = normal[1].message.json_object
+    assert summary["status"] == "invalid_params"
+    assert "duration_ms" in summary and summary["stages"] == []
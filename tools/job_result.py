@@ -0,0 +1,54 @@
+from collections.abc import Generator
+from dify_plugin.entities.tool import ToolInvokeMessage
+from dify_plugin import Tool
+
+from utils.job_queue import get_job_queue
+
+# 单次查询最长等待时间（秒），需小于插件的请求超时
+MAX_WAIT_SECONDS = 50
+
+
+class JobResultTool(Tool):
+    def _invoke(
+        self, tool_parameters: dict
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        """
+        查询后台生成任务的进度，任务结束后返回生成的图像
+
+        Args:
+            tool_parameters: job_id，以及可选的 wait_seconds（任务未结束时最多等待的秒数）
+        """
+        api_key = self.runtime.credentials.get("api_key")
+        job_id = (tool_parameters.get("job_id") or "").strip()
+        if not job_id:
+            yield self.create_text_message("❌ 请输入任务 ID")
+            return
+        wait_seconds = min(max(float(tool_parameters.get("wait_seconds") or 0), 0), MAX_WAIT_SECONDS)
+
+        queue = get_job_queue()
+        status = queue.wait(job_id, wait_seconds, api_key=api_key)
+        if status is None:
+            yield self.create_text_message(f"❌ 任务不存在或已过期: {job_id}")
+            return
+
+        if not status.finished:
+            state = "排队中" if status.status == "queued" else "生成中"
+            yield self.create_text_message(
+                f"⏳ 任务{state}: 已完成 {status.completed}/{status.total}，失败 {status.failed}"
+            )
+            yield self.create_json_message(status.to_dict())
+            return
+
+        blobs = queue.outputs(job_id)
+        for blob in blobs:
+            yield self.create_blob_message(
+                blob=blob.blob,
+                meta={"mime_type": blob.mime_type}
+            )
+        if status.status == "failed":
+            yield self.create_text_message(f"❌ 任务失败: {status.error or '没有生成图像数据'}")
+        else:
+            yield self.create_text_message(f"🎉 任务完成: 成功 {status.completed}/{status.total}，共 {len(blobs)} 张图像")
+        for error in status.errors:
+            yield self.create_text_message(f"⚠️ {error}")
+        yield self.create_json_message(status.to_dict())
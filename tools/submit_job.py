@@ -0,0 +1,76 @@
+from collections.abc import Generator
+from dify_plugin.entities.tool import ToolInvokeMessage
+from dify_plugin import Tool
+
+from utils.batch import parse_batch_prompts
+from utils.budget import BudgetExceeded, get_budget_guard
+from utils.config import env_int, env_str
+from utils.fallback import parse_model_list
+from utils.input_images import parse_image_urls
+from utils.job_queue import JobSpec, get_job_queue
+from utils.models import DEFAULT_MODEL
+
+
+class SubmitJobTool(Tool):
+    def _invoke(
+        self, tool_parameters: dict
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        """
+        提交后台生成任务，立即返回任务 ID
+
+        任务写入本地持久化队列，由后台工作线程执行，不受插件单次请求超时的限制；
+        使用 job_result 工具查询进度并取回生成的图像。
+
+        Args:
+            tool_parameters: 与 text2image 相同的生成参数（prompt、batch_prompts、model 等）
+        """
+        api_key = self.runtime.credentials.get("api_key")
+        prompt = tool_parameters.get("prompt", "")
+        prompts = parse_batch_prompts(tool_parameters.get("batch_prompts") or "") or ([prompt] if prompt else [])
+        if not prompts:
+            yield self.create_text_message("❌ 请输入图像生成提示词")
+            return
+
+        model = tool_parameters.get("model", DEFAULT_MODEL)
+        session = getattr(self, "session", None)
+        spec = JobSpec(
+            prompts=prompts,
+            model=model,
+            variations=int(tool_parameters.get("variations") or 1),
+            fallback_models=[
+                m for m in parse_model_list(tool_parameters.get("fallback_models") or env_str("FALLBACK_MODELS", ""))
+                if m != model
+            ],
+            hedge_after=float(tool_parameters.get("hedge_after_ms") or env_int("HEDGE_AFTER_MS", 0)) / 1000,
+            input_image_urls=parse_image_urls(
+                tool_parameters.get("input_image_url") or "", tool_parameters.get("input_image_urls") or ""
+            ),
+            output_format=tool_parameters.get("output_format") or "png",
+            quality=int(tool_parameters.get("output_quality") or 90),
+            concurrency=int(tool_parameters.get("batch_concurrency") or env_int("BATCH_CONCURRENCY", 4)),
+            workflow=getattr(session, "app_id", None) or "",
+        )
+
+        # 预算检查：按任务的全部条目预估费用
+        budget = get_budget_guard()
+        if budget is not None:
+            try:
+                decision = budget.check(api_key, spec.model, calls=len(spec.items()))
+            except BudgetExceeded as e:
+                yield self.create_text_message(f"❌ 花费预算不足: {str(e)}")
+                return
+            if decision.downgraded:
+                spec.model, spec.fallback_models = decision.model, []
+                yield self.create_text_message(f"💸 即将超出花费预算，改用免费模型 {spec.model}")
+
+        try:
+            queue = get_job_queue()
+            job_id = queue.submit(api_key, spec)
+        except Exception as e:
+            yield self.create_text_message(f"❌ 提交任务失败: {str(e)}")
+            return
+
+        total = len(spec.items())
+        yield self.create_text_message(f"📮 任务已提交，ID: {job_id}（共 {total} 张图像）")
+        yield self.create_text_message("💡 请使用 job_result 工具查询进度并获取图像")
+        yield self.create_json_message({"job_id": job_id, "status": "queued", "total": total})
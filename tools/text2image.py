@@ -1,13 +1,541 @@
+import httpx
 import requests
 import json
-import base64
+import time
 from collections.abc import Generator
-from PIL import Image
-from io import BytesIO
+from typing import Optional
 from dify_plugin.entities.tool import ToolInvokeMessage
 from dify_plugin import Tool
 
+from utils.async_client import (
+    fetch_into_buffer,
+    iterate_sync,
+    post_chat_completion,
+    run_sync,
+    stream_chat_completion_lines,
+    use_async_engine,
+)
+from utils.batch import BatchItem, build_batch_items, parse_batch_prompts, run_batch
+from utils.budget import BudgetExceeded, get_budget_guard
+from utils.buffer_pool import PooledBuffer, get_buffer_pool
+from utils.config import env_int, env_str
+from utils.credentials import get_credential_validator, key_fingerprint
+from utils.fallback import parse_model_list
+from utils.generation import (
+    GenerationResult,
+    build_payload,
+    generate_async,
+    generate_with_fallback,
+    get_generation_flight,
+)
+from utils.http_pool import OPENROUTER_API_BASE, get_session
+from utils.images import encode_output, load_generated_image, map_ordered
+from utils.input_images import parse_image_urls, prepare_input_images, upload_encoding_for
+from utils.metrics import Trace, debug_messages_enabled
+from utils.models import DEFAULT_MODEL
+from utils.rate_limit import RateLimitExceeded, get_rate_limiter
+from utils.renditions import parse_renditions, render_renditions
+from utils.result_cache import CachedBlob, get_result_cache, make_cache_key
+from utils.retry import call_with_retry
+from utils.sse import iter_completion_events, iter_stream_lines
+from utils.stream_parse import (
+    STREAM_CHUNK_SIZE,
+    ParsedCompletion,
+    parse_completion_stream,
+    resolve_blob,
+    streaming_parse_enabled,
+)
+from utils.usage_ledger import UsageRecord, get_usage_ledger
+
+# 流式模式下两次收到数据之间的最长等待时间（秒）
+STREAM_READ_TIMEOUT = env_int("STREAM_READ_TIMEOUT", 60)
+
+# 消息详细程度：quiet 只返回图像和错误，normal 额外返回一条 JSON 汇总，debug 返回逐步的进度信息
+VERBOSITY_LEVELS = {"quiet": 0, "normal": 1, "debug": 2}
+
+
+def resolve_verbosity(value: Optional[str]) -> str:
+    """工具参数优先，其次是 VERBOSITY 环境变量；DEBUG=true 时默认为 debug"""
+    default = "debug" if debug_messages_enabled() else env_str("VERBOSITY", "normal")
+    value = (value or default).lower()
+    return value if value in VERBOSITY_LEVELS else "normal"
+
+
 class Text2ImageTool(Tool):
+    _verbosity = "normal"
+    # 本次调用要求的派生版本（参数 renditions）
+    _renditions: tuple = ()
+    # 本次调用中每次生成的 (实际模型, 用量, 图像数)，在 _invoke 中重置
+    _served_usage: list
+
+    def _progress(self, text: str, level: str = "debug") -> Generator[ToolInvokeMessage, None, None]:
+        """按当前详细程度决定是否发送进度消息"""
+        if VERBOSITY_LEVELS[self._verbosity] >= VERBOSITY_LEVELS[level]:
+            yield self.create_text_message(text)
+
+    def _check_budget(
+        self, api_key: str, model: str, calls: int, trace: Trace
+    ) -> Generator[ToolInvokeMessage, None, Optional[str]]:
+        """
+        发送 calls 次请求前检查花费预算
+
+        Returns:
+            实际使用的模型（按配置降级时为免费模型）；超出预算被拒绝时返回 None
+        """
+        budget = get_budget_guard()
+        if budget is None or calls <= 0:
+            return model
+        try:
+            decision = budget.check(api_key, model, calls=calls)
+        except BudgetExceeded as e:
+            trace.status = "budget_exceeded"
+            yield self.create_text_message(f"❌ 花费预算不足: {str(e)}")
+            yield self.create_text_message("💡 可以改用免费模型，或调整 BUDGET_USD / BUDGET_WINDOW_HOURS")
+            return None
+        if decision.downgraded:
+            trace.labels["budget_downgraded_from"] = model
+            trace.labels["model"] = decision.model
+            yield from self._progress(
+                f"💸 即将超出花费预算（已花费 ${decision.spent:.4f} / ${decision.limit:.2f}），"
+                f"改用免费模型 {decision.model}",
+                level="normal",
+            )
+        return decision.model
+
+    def _add_usage(self, model: str, usage: Optional[dict], images: int) -> None:
+        """记录实际完成生成的模型及其用量，调用结束时写入用量台账"""
+        if usage:
+            self._served_usage.append((model, usage, images))
+
+    def _record_output(self, trace: Trace, blobs: list[CachedBlob], usage: Optional[dict] = None) -> None:
+        """把返回的图像大小和 Token 用量写入汇总"""
+        trace.labels["images"] = [{"mime_type": b.mime_type, "bytes": len(b.blob)} for b in blobs]
+        if usage:
+            trace.labels["usage"] = usage
+
+    def _emit_image(self, blob: bytes, mime_type: str, trace: Trace) -> Generator[ToolInvokeMessage, None, None]:
+        """返回一张生成的图像，以及参数 renditions 要求的派生版本（只解码一次）"""
+        yield self.create_blob_message(
+            blob=blob,
+            meta={"mime_type": mime_type}
+        )
+        if not self._renditions:
+            return
+        try:
+            with trace.span("renditions") as span:
+                rendered = render_renditions(blob, self._renditions)
+                span["bytes"] = sum(len(item.blob) for item in rendered)
+        except Exception as e:
+            yield self.create_text_message(f"⚠️ 生成派生版本失败: {str(e)}")
+            return
+        for item in rendered:
+            yield self.create_blob_message(
+                blob=item.blob,
+                meta={"mime_type": item.mime_type, "rendition": item.rendition.name}
+            )
+            yield from self._progress(
+                f"🖼️ 派生版本 {item.rendition.name}: {item.size[0]}x{item.size[1]}，{len(item.blob)} 字节"
+            )
+
+    def _download(self, url: str, timeout: float = 30) -> PooledBuffer:
+        """
+        下载 URL 内容到缓冲池借出的缓冲区（调用方负责归还），根据 HTTP_ENGINE 选择同步或异步引擎
+        """
+        if use_async_engine():
+            return run_sync(fetch_into_buffer(url, timeout=timeout))
+        response = call_with_retry(
+            lambda: get_session().get(url, timeout=timeout, stream=True),
+            operation="image_download",
+        )
+        with response:
+            response.raise_for_status()
+            # 按 Content-Length 一次分配到位，不再拼接 response.content 的分块
+            buffer = get_buffer_pool().acquire(int(response.headers.get("Content-Length") or 0))
+            try:
+                return buffer.extend(response.iter_content(STREAM_CHUNK_SIZE))
+            except BaseException:
+                buffer.release()
+                raise
+
+    def _throttle(self, api_key: str, model: str, trace: Optional[Trace] = None) -> None:
+        """启用客户端限流时，按 API key 和模型排队等待令牌"""
+        limiter = get_rate_limiter()
+        if limiter is not None:
+            started = time.perf_counter()
+            limiter.acquire(api_key, model)
+            if trace is not None:
+                trace.add("rate_limit_wait", time.perf_counter() - started, model=model)
+
+    def _post_generation(self, api_key: str, payload: dict, timeout: float = 60, trace: Optional[Trace] = None):
+        """
+        发送生成请求并流式解析响应
+
+        Returns:
+            (未检查状态码的响应对象, 解析结果)，状态码为 4xx/5xx 时解析结果为 None
+        """
+        self._throttle(api_key, payload["model"], trace)
+        if use_async_engine():
+            return run_sync(post_chat_completion(api_key, payload, timeout=timeout))
+        # 生成请求是付费的非幂等调用，只在请求确定未被处理时重试
+        response = call_with_retry(
+            lambda: get_session().post(
+                f"{OPENROUTER_API_BASE}/chat/completions",
+                headers={
+                    'Authorization': f'Bearer {api_key}',
+                    'Content-Type': 'application/json'
+                },
+                data=json.dumps(payload),  # 使用 data 参数，与 zz.py 保持一致
+                timeout=timeout,
+                stream=True
+            ),
+            operation="generation",
+            idempotent=False,
+        )
+        with response:
+            if response.status_code >= 400:
+                response.content  # 读取错误信息后释放连接
+                return response, None
+            if not streaming_parse_enabled():
+                return response, ParsedCompletion(data=response.json(), response_bytes=len(response.content))
+            return response, parse_completion_stream(response.iter_content(STREAM_CHUNK_SIZE))
+
+    def _stream_lines(self, api_key: str, payload: dict, timeout: float = 60, trace: Optional[Trace] = None):
+        """
+        以 SSE 流式模式发送生成请求，逐行返回响应
+
+        timeout 是两次收到数据之间的最长等待时间，OpenRouter 会定期发送
+        心跳注释，因此长时间的生成不会因为总时长而超时。
+        """
+        self._throttle(api_key, payload["model"], trace)
+        if use_async_engine():
+            yield from iterate_sync(stream_chat_completion_lines(api_key, payload, timeout=timeout))
+            return
+        response = call_with_retry(
+            lambda: get_session().post(
+                f"{OPENROUTER_API_BASE}/chat/completions",
+                headers={
+                    'Authorization': f'Bearer {api_key}',
+                    'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream'
+                },
+                data=json.dumps(dict(payload, stream=True)),
+                timeout=(10, timeout),
+                stream=True
+            ),
+            operation="generation_stream",
+            idempotent=False,
+        )
+        with response:
+            if response.status_code >= 400:
+                response.content  # 读取错误信息后再抛出异常
+            response.raise_for_status()
+            # iter_lines 会等待凑满 chunk_size 字节，不分块的响应中文本增量要到流结束才能读到；
+            # read1 只读取已到达的数据
+            read1 = getattr(response.raw, "read1", None)
+            if read1 is None:
+                yield from response.iter_lines(chunk_size=STREAM_CHUNK_SIZE)
+                return
+            yield from iter_stream_lines(lambda size: read1(size, decode_content=True), STREAM_CHUNK_SIZE)
+
+    def _invoke_stream(
+        self,
+        api_key: str,
+        payload: dict,
+        output_options: dict,
+        result_cache,
+        cache_key: str,
+        trace: Trace,
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        """
+        流式生成：文本增量到达即转发，每张图像完整到达后立即返回
+        """
+        generated: list[CachedBlob] = []
+        failed = 0
+        usage = {}
+        lines = self._stream_lines(api_key, payload, timeout=STREAM_READ_TIMEOUT, trace=trace)
+        started = time.perf_counter()
+        first_event = True
+        for event in iter_completion_events(lines):
+            if first_event:
+                # 流式模式下记录首个事件的到达时间，总时长包含了调用方消费消息的时间
+                trace.add("api_first_event", time.perf_counter() - started, model=payload["model"])
+                first_event = False
+            if event.kind == "text":
+                yield from self._progress(event.text, level="normal")
+            elif event.kind == "image":
+                try:
+                    with trace.span("image_load", model=payload["model"]) as span:
+                        img_byte_arr, mime_type = load_generated_image(
+                            event.image_url, lambda u: self._download(u, timeout=30), **output_options
+                        )
+                        span["bytes"] = len(img_byte_arr)
+                except Exception as e:
+                    failed += 1
+                    yield self.create_text_message(f"❌ 处理第 {len(generated) + failed} 张图像时出错: {str(e)}")
+                    continue
+                yield from self._emit_image(img_byte_arr, mime_type, trace)
+                generated.append(CachedBlob(blob=img_byte_arr, mime_type=mime_type))
+            elif event.kind == "usage":
+                usage = event.usage
+            elif event.kind == "error":
+                trace.status = "stream_error"
+                yield self.create_text_message(f"❌ 生成过程中出错: {event.text}")
+                return
+
+        if not generated and not failed:
+            trace.status = "no_image"
+            yield self.create_text_message("❌ 没有生成图像数据")
+            return
+        trace.status = "partial" if failed else "ok"
+        self._record_output(trace, generated, usage)
+        self._add_usage(payload["model"], usage, len(generated))
+        if result_cache is not None and generated and not failed:
+            result_cache.put(cache_key, generated)
+        if usage:
+            yield from self._progress(self._format_usage(usage))
+        yield from self._progress("🍌 Nano Banana 图像生成任务完成！")
+
+    def _generate_single(
+        self, api_key: str, payload: dict, output_options: dict, trace: Trace
+    ) -> GenerationResult:
+        """
+        单次生成：发送请求，并行下载/解码生成的图像
+
+        Raises:
+            requests.exceptions.HTTPError / httpx.HTTPStatusError: API 返回错误状态码
+            ValueError: 响应中没有生成结果
+        """
+        model = payload["model"]
+        with trace.span("api_request", model=model) as span:
+            response, parsed = self._post_generation(api_key, payload, timeout=60, trace=trace)
+            span["http_status"] = response.status_code
+            if parsed is not None:
+                span["bytes"] = parsed.response_bytes
+        response.raise_for_status()
+        
+        # 解析响应数据（图像已在流式解析时解码为字节）
+        response_data = parsed.data
+        if parsed.blobs:
+            trace.add("base64_decode", parsed.decode_seconds, nbytes=sum(len(b) for b in parsed.blobs), model=model)
+        choices = response_data.get("choices", [])
+        if not choices:
+            raise ValueError("API 响应中没有找到生成结果")
+        message = choices[0].get("message", {})
+        result = GenerationResult(
+            text=message.get("content") or "",
+            usage=response_data.get("usage", {}),
+            model=model,
+        )
+        
+        # 并行下载/解码生成的图像，按原始顺序收集
+        def fetch(u: str) -> PooledBuffer:
+            with trace.span("image_fetch", model=model) as span:
+                body = self._download(u, timeout=30)
+                span["bytes"] = len(body)
+            return body
+        
+        def load(url: str):
+            if not url:
+                return None
+            raw = resolve_blob(url, parsed.blobs)
+            if raw is not None:
+                with trace.span("encode", model=model) as span:
+                    loaded = encode_output(raw, **output_options)
+                    span["bytes"] = len(loaded[0])
+                return loaded
+            return load_generated_image(url, fetch, **output_options)
+        
+        image_urls = [image_data.get("image_url", {}).get("url", "") for image_data in message.get("images", [])]
+        for i, future in enumerate(map_ordered(load, image_urls)):
+            try:
+                loaded = future.result()
+            except Exception as e:
+                result.errors.append(f"处理第 {i+1} 张图像时出错: {str(e)}")
+                continue
+            if loaded is None:
+                result.errors.append(f"第 {i+1} 张图像数据无效")
+                continue
+            # 已是目标格式时直接透传原始字节
+            img_byte_arr, mime_type = loaded
+            result.blobs.append(CachedBlob(blob=img_byte_arr, mime_type=mime_type))
+        return result
+
+    def _emit_result(
+        self,
+        result: GenerationResult,
+        model: str,
+        trace: Trace,
+        result_cache,
+        cache_key: str,
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        """
+        返回一次生成的图像和统计信息，并报告实际完成生成的模型
+
+        Args:
+            model: 请求的主模型
+            result_cache: 结果缓存，为 None 时不写入
+        """
+        self._add_usage(result.model or model, result.usage, len(result.blobs))
+        if not result.blobs and not result.errors:
+            trace.status = "no_image"
+            yield self.create_text_message("❌ 没有生成图像数据")
+            # 输出描述文本（如果有）
+            if result.text:
+                yield self.create_text_message(f"📝 模型响应: {result.text}")
+            return
+        
+        if result.model and result.model != model:
+            trace.labels["served_model"] = result.model
+            yield from self._progress(f"🔀 主模型未能及时返回，由 {result.model} 完成生成")
+        trace.status = "ok" if not result.errors else ("partial" if result.blobs else "error")
+        self._record_output(trace, result.blobs, result.usage)
+        yield from self._progress(f"🎉 成功生成 {len(result.blobs)} 张图像！（模型: {result.model or model}）")
+        
+        for i, blob in enumerate(result.blobs):
+            yield from self._emit_image(blob.blob, blob.mime_type, trace)
+            yield from self._progress(f"✅ 第 {i+1} 张图像生成完成！")
+            yield from self._progress(f"📊 图像大小: {len(blob.blob)} 字节")
+        for error in result.errors:
+            yield self.create_text_message(f"❌ {error}")
+        
+        # 写入结果缓存（仅在所有图像都处理成功时）
+        if result_cache is not None and result.blobs and not result.errors:
+            result_cache.put(cache_key, result.blobs)
+        
+        # 输出使用统计信息（如果有）
+        if result.usage:
+            yield from self._progress(self._format_usage(result.usage))
+        yield from self._progress("🍌 Nano Banana 图像生成任务完成！")
+        yield from self._progress("🎉 感谢使用 Nano Banana 文生图服务！")
+
+    def _record_usage(self, trace: Trace) -> None:
+        """
+        把本次调用的 Token 用量和费用写入用量台账，每次生成按实际完成生成的模型记一条
+        （共享其他请求的结果时不重复计费）
+        """
+        ledger = get_usage_ledger()
+        if not self._served_usage or ledger is None or trace.labels.get("coalesced"):
+            return
+        session = getattr(self, "session", None)
+        owner = key_fingerprint(self.runtime.credentials.get("api_key") or "")
+        for model, usage, images in self._served_usage:
+            ledger.record(UsageRecord.from_usage(
+                owner=owner,
+                model=model,
+                usage=usage,
+                images=images,
+                workflow=getattr(session, "app_id", None) or "",
+                mode=trace.labels.get("mode", ""),
+            ))
+
+    def _format_usage(self, usage: dict) -> str:
+        """格式化 Token 使用统计"""
+        total_tokens = usage.get("total_tokens", 0)
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        return f"📊 Token 使用统计: 总计 {total_tokens} (提示 {prompt_tokens} + 完成 {completion_tokens})"
+
+    def _invoke_batch(
+        self,
+        api_key: str,
+        model: str,
+        items: list[BatchItem],
+        extra_content: list[dict],
+        input_image_bytes,
+        result_cache,
+        concurrency: int,
+        output_options: dict,
+        fallback_models: list[str],
+        hedge_after: float,
+        trace: Trace,
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        """
+        批量生成：并发执行多个提示词，每完成一个立即返回其图像
+
+        Args:
+            items: 展开后的批次任务
+            extra_content: 每个请求都附带的额外内容（例如输入图像）
+            concurrency: 同时在途的最大请求数
+            output_options: 输出格式参数（output_format、quality）
+            fallback_models: 回退模型列表，为空时只使用 model
+            hedge_after: 对冲阈值（秒），0 表示不对冲
+            trace: 记录各阶段耗时的 Trace，所有任务共用
+        """
+        owner = key_fingerprint(api_key)
+
+        def cache_key_for(item: BatchItem, model: str) -> str:
+            # 第一个变体与单次生成共用缓存键
+            params = dict(output_options, variation=item.variation) if item.variation else output_options
+            return make_cache_key(model, item.prompt, input_image_bytes, params, owner=owner)
+
+        total = len(items)
+        # 先查缓存，只为需要请求 API 的条目检查花费预算
+        cached_items: dict[int, list[CachedBlob]] = {}
+        if result_cache is not None:
+            for item in items:
+                cached = result_cache.get(cache_key_for(item, model))
+                if cached:
+                    cached_items[item.index] = cached
+        budget_model = yield from self._check_budget(api_key, model, len(items) - len(cached_items), trace)
+        if budget_model is None:
+            # 超出预算时只返回已缓存的结果
+            items = [item for item in items if item.index in cached_items]
+            if not items:
+                return
+        elif budget_model != model:
+            model, fallback_models = budget_model, []
+
+        yield from self._progress(f"📦 批量模式: 共 {total} 个任务，并发数 {concurrency}")
+
+        async def worker(item: BatchItem) -> GenerationResult:
+            if item.index in cached_items:
+                return GenerationResult(blobs=cached_items[item.index])
+            cache_key = cache_key_for(item, model)
+            content = [{"type": "text", "text": item.prompt}] + extra_content
+            if fallback_models:
+                result = await generate_with_fallback(
+                    api_key, [model] + fallback_models, content, hedge_after=hedge_after, timeout=60,
+                    trace=trace, **output_options,
+                )
+            else:
+                result = await generate_async(
+                    api_key, build_payload(model, content), timeout=60, trace=trace, **output_options
+                )
+            if result_cache is not None and result.blobs and not result.errors:
+                result_cache.put(cache_key, result.blobs)
+            return result
+
+        succeeded = 0
+        outputs: list[CachedBlob] = []
+        usage: dict = {}
+        for done in iterate_sync(run_batch(items, worker, concurrency)):
+            label = f"[{done.item.index + 1}/{total}]"
+            if done.result is not None:
+                self._add_usage(done.result.model or model, done.result.usage, len(done.result.blobs))
+            if done.error is not None or not done.result.blobs:
+                reason = done.error or "没有生成图像数据"
+                yield self.create_text_message(f"❌ {label} 失败（耗时 {done.latency:.1f}s）: {reason}")
+                continue
+
+            succeeded += 1
+            outputs.extend(done.result.blobs)
+            for name, value in done.result.usage.items():
+                if isinstance(value, (int, float)):
+                    usage[name] = usage.get(name, 0) + value
+            for blob in done.result.blobs:
+                yield from self._emit_image(blob.blob, blob.mime_type, trace)
+            served_by = f"，由 {done.result.model} 完成" if done.result.model and done.result.model != model else ""
+            yield from self._progress(
+                f"✅ {label} 生成 {len(done.result.blobs)} 张图像，耗时 {done.latency:.1f}s{served_by}"
+            )
+            for error in done.result.errors:
+                yield self.create_text_message(f"⚠️ {label} {error}")
+
+        trace.labels["batch_size"] = total
+        self._record_output(trace, outputs, usage)
+        trace.status = "ok" if succeeded == total else ("partial" if succeeded else "error")
+        yield from self._progress(f"📊 批量生成完成: 成功 {succeeded}/{total}，失败 {total - succeeded}")
+
     def _invoke(
         self, tool_parameters: dict
     ) -> Generator[ToolInvokeMessage, None, None]:
@@ -16,41 +544,81 @@ class Text2ImageTool(Tool):
         完全基于 zz.py 的实现逻辑
         
         Args:
-            tool_parameters: 工具参数字典，包含 prompt、model 和可选的 input_image_url
+            tool_parameters: 工具参数字典，包含 prompt、model 和可选的 input_image_url、input_image_urls
             
         Yields:
-            ToolInvokeMessage: 工具调用消息，包括进度反馈和最终图像结果
+            ToolInvokeMessage: 工具调用消息。quiet 只返回图像和错误信息，normal（默认）
+            额外返回一条 JSON 汇总（耗时、大小、Token 用量），debug 还会返回逐步的进度信息
+        """
+        self._verbosity = resolve_verbosity(tool_parameters.get("verbosity"))
+        self._served_usage = []
+        # 记录各阶段耗时，调用结束时导出指标并生成汇总
+        trace = Trace(model=tool_parameters.get("model", DEFAULT_MODEL))
+        try:
+            yield from self._generate(tool_parameters, trace)
+        finally:
+            summary = trace.finish()
+            self._record_usage(trace)
+        if self._verbosity != "quiet":
+            yield self.create_json_message(summary)
+
+    def _generate(
+        self, tool_parameters: dict, trace: Trace
+    ) -> Generator[ToolInvokeMessage, None, None]:
+        """
+        执行一次工具调用，各阶段耗时记录到 trace
         """
         # 1. 获取 API 配置
         api_key = self.runtime.credentials.get("api_key")
-        api_url = "https://openrouter.ai/api/v1/chat/completions"
         
         # 2. 获取和验证参数
         prompt = tool_parameters.get("prompt", "")
         if not prompt:
+            trace.status = "invalid_params"
             yield self.create_text_message("❌ 请输入图像生成提示词")
             return
             
-        model = tool_parameters.get("model", "google/gemini-2.5-flash-image-preview")
-        input_image_url = tool_parameters.get("input_image_url", "")
-        
-        # 调试信息：显示接收到的参数
-        yield self.create_text_message(f"🔍 调试信息 - 接收到的模型参数: {model}")
-        yield self.create_text_message(f"🔍 调试信息 - 所有参数: {tool_parameters}")
-        
-        # 3. 构建请求头（完全按照 zz.py 的格式）
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
+        model = tool_parameters.get("model", DEFAULT_MODEL)
+        input_image_urls = parse_image_urls(
+            tool_parameters.get("input_image_url") or "", tool_parameters.get("input_image_urls") or ""
+        )
+        bypass_cache = bool(tool_parameters.get("bypass_cache", False))
+        result_cache = None if bypass_cache else get_result_cache()
+        input_image_bytes = None
+        batch_prompts = parse_batch_prompts(tool_parameters.get("batch_prompts") or "")
+        variations = int(tool_parameters.get("variations") or 1)
+        batch_concurrency = int(tool_parameters.get("batch_concurrency") or env_int("BATCH_CONCURRENCY", 4))
+        stream = bool(tool_parameters.get("stream", False))
+        output_options = {
+            "output_format": tool_parameters.get("output_format") or "png",
+            "quality": int(tool_parameters.get("output_quality") or 90),
         }
+        fallback_models = [
+            m for m in parse_model_list(tool_parameters.get("fallback_models") or env_str("FALLBACK_MODELS", ""))
+            if m != model
+        ]
+        hedge_after = float(tool_parameters.get("hedge_after_ms") or env_int("HEDGE_AFTER_MS", 0)) / 1000
+        try:
+            self._renditions = parse_renditions(tool_parameters.get("renditions") or "", output_options["quality"])
+        except ValueError as e:
+            trace.status = "invalid_params"
+            yield self.create_text_message(f"❌ {str(e)}")
+            return
+        
+        # 调试信息：显示接收到的参数（仅在 debug 级别输出）
+        yield from self._progress(f"🔍 调试信息 - 接收到的模型参数: {model}")
+        yield from self._progress(f"🔍 调试信息 - 所有参数: {tool_parameters}")
         
         try:
-            yield self.create_text_message("🍌 Nano Banana 正在启动图像生成...")
-            yield self.create_text_message("🚀 正在连接 OpenRouter API...")
-            yield self.create_text_message(f"🤖 使用模型: {model}")
-            yield self.create_text_message(f"📝 提示词: {prompt[:100]}{'...' if len(prompt) > 100 else ''}")
+            yield from self._progress("🍌 Nano Banana 正在启动图像生成...")
+            yield from self._progress("🚀 正在连接 OpenRouter API...")
+            yield from self._progress(f"🤖 使用模型: {model}")
+            if fallback_models:
+                hedge_note = f"，{hedge_after * 1000:.0f}ms 未返回时对冲" if hedge_after > 0 else ""
+                yield from self._progress(f"🔀 回退模型: {' → '.join(fallback_models)}{hedge_note}")
+            yield from self._progress(f"📝 提示词: {prompt[:100]}{'...' if len(prompt) > 100 else ''}")
             
-            # 4. 构建消息内容（基于 zz.py 的结构）
+            # 3. 构建消息内容（基于 zz.py 的结构）
             content = [
                 {
                     "type": "text",
@@ -58,54 +626,56 @@ class Text2ImageTool(Tool):
                 }
             ]
             
-            # 如果有输入图像，添加到内容中
-            if input_image_url:
-                yield self.create_text_message(f"🖼️ 输入图像: {input_image_url}")
-                yield self.create_text_message("🔍 正在处理输入图像...")
+            # 如果有输入图像，添加到内容中（多张图像并发下载、预处理并去重）
+            if input_image_urls:
+                yield from self._progress(f"🖼️ 输入图像: {', '.join(input_image_urls)}")
+                yield from self._progress("🔍 正在处理输入图像...")
                 
                 try:
-                    # 下载图像并转换为base64格式
-                    yield self.create_text_message("📥 正在下载图像...")
-                    img_response = requests.get(input_image_url, timeout=30)
-                    img_response.raise_for_status()
-                    
-                    # 验证图像数据
-                    image = Image.open(BytesIO(img_response.content))
-                    yield self.create_text_message(f"✅ 图像下载成功，尺寸: {image.size}")
-                    
-                    # 检查图像大小，如果太大则压缩
-                    max_size = 1024  # 最大尺寸
-                    if max(image.size) > max_size:
-                        yield self.create_text_message(f"🔧 图像过大，正在压缩到 {max_size}px...")
-                        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                        yield self.create_text_message(f"✅ 压缩完成，新尺寸: {image.size}")
-                    
-                    # 转换为RGB格式（确保兼容性）
-                    if image.mode != 'RGB':
-                        yield self.create_text_message(f"🔧 转换图像格式: {image.mode} -> RGB")
-                        image = image.convert('RGB')
-                    
-                    # 转换为base64格式
-                    yield self.create_text_message("🔄 正在转换为base64格式...")
-                    img_byte_arr = BytesIO()
-                    image.save(img_byte_arr, format='JPEG', quality=85)
-                    img_byte_arr = img_byte_arr.getvalue()
-                    
-                    # 编码为base64
-                    img_base64 = base64.b64encode(img_byte_arr).decode('utf-8')
-                    data_url = f"data:image/jpeg;base64,{img_base64}"
-                    
-                    yield self.create_text_message(f"✅ 图像处理完成，大小: {len(img_byte_arr)} 字节")
+                    # 下载（或复用缓存的）图像，按模型的输入分辨率预处理为 data URL
+                    image_set = prepare_input_images(
+                        input_image_urls, timeout=30, encoding=upload_encoding_for(model)
+                    )
+                    input_image_bytes = image_set.encoded
+                    for prepared in image_set.fetched:
+                        if "download" in prepared.timings:
+                            trace.add(
+                                "input_download", prepared.timings["download"], nbytes=prepared.downloaded_bytes,
+                                cache_status=prepared.cache_status,
+                            )
+                        if "preprocess" in prepared.timings:
+                            trace.add("input_preprocess", prepared.timings["preprocess"], nbytes=len(prepared.encoded))
+                        
+                        if prepared.cache_status == "miss":
+                            yield from self._progress(
+                                f"✅ 图像处理完成，尺寸: {prepared.original_size} -> {prepared.size}，"
+                                f"大小: {len(prepared.encoded)} 字节"
+                            )
+                        else:
+                            yield from self._progress(
+                                f"⚡ 输入图像命中预处理缓存（{prepared.cache_status}），尺寸: {prepared.size}"
+                            )
+                    if image_set.duplicates:
+                        yield from self._progress(f"♻️ 跳过 {image_set.duplicates} 张内容重复的输入图像")
+                    if image_set.budget_step:
+                        max_size, quality = image_set.budget_step
+                        trace.add("input_budget", image_set.budget_seconds, nbytes=image_set.payload_bytes)
+                        yield from self._progress(
+                            f"📉 输入图像总大小超出预算，已缩小到 {max_size} 像素、质量 {quality}"
+                            f"（共 {image_set.payload_bytes} 字节）"
+                        )
                     
-                    content.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": data_url
-                        }
-                    })
-                    yield self.create_text_message("🔄 将进行图像到图像转换...")
+                    for prepared in image_set.images:
+                        content.append({
+                            "type": "image_url",
+                            "image_url": {
+                                "url": prepared.data_url
+                            }
+                        })
+                    yield from self._progress("🔄 将进行图像到图像转换...")
                     
                 except Exception as e:
+                    trace.status = "input_error"
                     yield self.create_text_message(f"❌ 图像处理失败: {str(e)}")
                     yield self.create_text_message("💡 建议:")
                     yield self.create_text_message("1. 检查图像URL是否正确")
@@ -113,142 +683,85 @@ class Text2ImageTool(Tool):
                     yield self.create_text_message("3. 尝试使用其他图像URL")
                     return
             
-            # 5. 构建请求载荷（完全按照 zz.py 的格式）
-            payload = {
-                "model": model,
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": content
-                    }
-                ]
-            }
-            
-            yield self.create_text_message("⏳ 正在生成图像，请稍候...")
-            yield self.create_text_message("🎨 AI 正在发挥创意...")
+            # 批量模式：多个提示词或多个变体并发生成
+            if batch_prompts or variations > 1:
+                items = build_batch_items(batch_prompts or [prompt], variations)
+                trace.labels["mode"] = "batch"
+                yield from self._invoke_batch(
+                    api_key, model, items, content[1:], input_image_bytes, result_cache, batch_concurrency,
+                    output_options, fallback_models, hedge_after, trace,
+                )
+                return
             
-            # 6. 发送请求（完全按照 zz.py 的方式）
-            response = requests.post(
-                api_url,
-                headers=headers,
-                data=json.dumps(payload),  # 使用 data 参数，与 zz.py 保持一致
-                timeout=60
-            )
+            # 如果启用了结果缓存，命中时直接返回，无需请求 API
+            owner = key_fingerprint(api_key)
+            cache_key = make_cache_key(model, prompt, input_image_bytes, output_options, owner=owner)
+            if result_cache is not None:
+                cached = result_cache.get(cache_key)
+                if cached:
+                    trace.labels["mode"] = "cache"
+                    trace.status = "ok"
+                    self._record_output(trace, cached)
+                    yield from self._progress(f"⚡ 命中结果缓存，直接返回 {len(cached)} 张图像")
+                    for item in cached:
+                        yield from self._emit_image(item.blob, item.mime_type, trace)
+                    yield from self._progress("🍌 Nano Banana 图像生成任务完成！")
+                    return
             
-            # 7. 检查响应状态
-            if response.status_code != 200:
-                yield self.create_text_message(f"🔧 API 响应状态码: {response.status_code}")
-                yield self.create_text_message(f"🔧 响应内容: {response.text[:300]}")
+            # 未命中缓存、需要请求 API 时才检查花费预算（降级后按免费模型写入缓存）
+            budget_model = yield from self._check_budget(api_key, model, 1, trace)
+            if budget_model is None:
+                return
+            if budget_model != model:
+                model, fallback_models = budget_model, []
+                cache_key = make_cache_key(model, prompt, input_image_bytes, output_options, owner=owner)
             
-            response.raise_for_status()
+            # 4. 构建请求载荷（完全按照 zz.py 的格式）
+            payload = build_payload(model, content)
             
-            # 8. 解析响应数据（按照 zz.py 的响应格式）
-            response_data = response.json()
+            yield from self._progress("⏳ 正在生成图像，请稍候...")
+            yield from self._progress("🎨 AI 正在发挥创意...")
             
-            # 检查响应结构
-            choices = response_data.get("choices", [])
-            if not choices:
-                yield self.create_text_message("❌ API 响应中没有找到生成结果")
+            # 流式模式：边生成边返回（流式输出无法撤回，只使用主模型）
+            if stream:
+                trace.labels["mode"] = "stream"
+                yield from self._invoke_stream(api_key, payload, output_options, result_cache, cache_key, trace)
                 return
             
-            message = choices[0].get("message", {})
-            images = message.get("images", [])
+            # 5. 发送请求：配置了回退模型时沿回退链（可选对冲）生成，
+            #    相同的并发请求合并为一次生成（single-flight），共享生成结果
+            trace.labels["mode"] = "fallback" if fallback_models else "single"
             
-            if not images:
-                yield self.create_text_message("❌ 没有生成图像数据")
-                # 输出描述文本（如果有）
-                content = message.get("content", "")
-                if content:
-                    yield self.create_text_message(f"📝 模型响应: {content}")
-                return
+            def run() -> GenerationResult:
+                if fallback_models:
+                    return run_sync(generate_with_fallback(
+                        api_key, [model] + fallback_models, content, hedge_after=hedge_after, timeout=60,
+                        trace=trace, **output_options
+                    ))
+                return self._generate_single(api_key, payload, output_options, trace)
             
-            yield self.create_text_message(f"🎉 成功生成 {len(images)} 张图像！")
-            
-            # 9. 处理生成的图像（按照 zz.py 的响应格式）
-            for i, image_data in enumerate(images):
-                image_url = image_data.get("image_url", {}).get("url", "")
-                
-                if not image_url:
-                    yield self.create_text_message(f"❌ 第 {i+1} 张图像数据无效")
-                    continue
-                
-                # 检查是否是 Base64 格式（data:image/png;base64,xxx）
-                if image_url.startswith("data:image/"):
-                    yield self.create_text_message(f"🎨 正在处理第 {i+1} 张图像...")
-                    
-                    # 提取 Base64 数据
-                    try:
-                        # 分离 MIME 类型和 Base64 数据
-                        header, base64_data = image_url.split(",", 1)
-                        
-                        # 解码 Base64 数据
-                        image_bytes = base64.b64decode(base64_data)
-                        
-                        # 验证图像数据
-                        image = Image.open(BytesIO(image_bytes))
-                        
-                        # 转换为 PNG 格式（统一格式）
-                        img_byte_arr = BytesIO()
-                        image.save(img_byte_arr, format='PNG')
-                        img_byte_arr = img_byte_arr.getvalue()
-                        
-                        # 返回图像
-                        yield self.create_blob_message(
-                            blob=img_byte_arr,
-                            meta={"mime_type": "image/png"}
-                        )
-                        
-                        yield self.create_text_message(f"✅ 第 {i+1} 张图像生成完成！")
-                        yield self.create_text_message(f"📊 图像大小: {len(img_byte_arr)} 字节")
-                        
-                    except Exception as e:
-                        yield self.create_text_message(f"❌ 处理第 {i+1} 张图像时出错: {str(e)}")
-                        continue
-                        
-                else:
-                    # 如果是 URL 格式，下载图像
-                    yield self.create_text_message(f"🌐 正在下载第 {i+1} 张图像...")
-                    try:
-                        img_response = requests.get(image_url, timeout=30)
-                        img_response.raise_for_status()
-                        
-                        # 验证图像数据
-                        image = Image.open(BytesIO(img_response.content))
-                        
-                        # 转换为 PNG 格式
-                        img_byte_arr = BytesIO()
-                        image.save(img_byte_arr, format='PNG')
-                        img_byte_arr = img_byte_arr.getvalue()
-                        
-                        # 返回图像
-                        yield self.create_blob_message(
-                            blob=img_byte_arr,
-                            meta={"mime_type": "image/png"}
-                        )
-                        
-                        yield self.create_text_message(f"✅ 第 {i+1} 张图像下载完成！")
-                        yield self.create_text_message(f"📊 图像大小: {len(img_byte_arr)} 字节")
-                        
-                    except Exception as e:
-                        yield self.create_text_message(f"❌ 下载第 {i+1} 张图像时出错: {str(e)}")
-                        continue
-            
-            # 10. 输出使用统计信息（如果有）
-            usage = response_data.get("usage", {})
-            if usage:
-                total_tokens = usage.get("total_tokens", 0)
-                prompt_tokens = usage.get("prompt_tokens", 0)
-                completion_tokens = usage.get("completion_tokens", 0)
-                yield self.create_text_message(
-                    f"📊 Token 使用统计: 总计 {total_tokens} (提示 {prompt_tokens} + 完成 {completion_tokens})"
+            flight = get_generation_flight()
+            if flight is None:
+                result, shared = run(), False
+            else:
+                flight_key = make_cache_key(
+                    model, prompt, input_image_bytes,
+                    dict(output_options, api_key=key_fingerprint(api_key), fallback_models=fallback_models),
                 )
+                result, shared = flight.do(flight_key, run)
+            if shared:
+                trace.labels["coalesced"] = True
+                yield from self._progress("🔗 已有相同的请求正在生成，共享其生成结果")
             
-            yield self.create_text_message("🍌 Nano Banana 图像生成任务完成！")
-            yield self.create_text_message("🎉 感谢使用 Nano Banana 文生图服务！")
+            # 6. 返回图像（共享结果时由发起请求的调用写入缓存）
+            yield from self._emit_result(result, model, trace, None if shared else result_cache, cache_key)
         
-        except requests.exceptions.HTTPError as e:
+        except (requests.exceptions.HTTPError, httpx.HTTPStatusError) as e:
             # HTTP 错误处理（基于 OpenRouter 的错误码）
+            trace.status = f"http_{e.response.status_code}"
             if e.response.status_code == 401:
+                # key 已失效，下次凭据校验时重新请求 OpenRouter
+                get_credential_validator().invalidate(api_key)
                 yield self.create_text_message("❌ OpenRouter API Key 无效，请检查您的 API Key")
                 yield self.create_text_message("💡 请前往 https://openrouter.ai/keys 获取有效的 API Key")
             elif e.response.status_code == 402:
@@ -268,24 +781,37 @@ class Text2ImageTool(Tool):
                 if hasattr(e.response, 'text'):
                     yield self.create_text_message(f"🔧 错误详情: {e.response.text[:200]}")
                     
-        except requests.exceptions.Timeout:
+        except RateLimitExceeded as e:
+            trace.status = "rate_limited"
+            yield self.create_text_message(f"❌ 请求过于密集，{str(e)}")
+            yield self.create_text_message("💡 建议降低并发或稍后重试")
+            
+        except (requests.exceptions.Timeout, httpx.TimeoutException):
+            trace.status = "timeout"
             yield self.create_text_message("❌ 请求超时，请检查网络连接或稍后重试")
             yield self.create_text_message("💡 建议检查网络连接状态")
             
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, httpx.RequestError) as e:
+            trace.status = "network_error"
             yield self.create_text_message(f"❌ 网络请求错误: {str(e)}")
             yield self.create_text_message("💡 请检查网络连接是否正常")
             
         except json.JSONDecodeError as e:
+            trace.status = "parse_error"
             yield self.create_text_message(f"❌ API 响应解析错误: {str(e)}")
             yield self.create_text_message("🔧 这可能是 OpenRouter API 返回了非 JSON 格式的响应")
             
         except KeyError as e:
             yield self.create_text_message(f"❌ API 响应格式错误，缺少字段: {str(e)}")
             
+        except ValueError as e:
+            # 响应中没有生成结果，或回退链上的所有模型都没有生成图像
+            trace.status = "no_image"
+            yield self.create_text_message(f"❌ {str(e)}")
+            
         except Exception as e:
             yield self.create_text_message(f"❌ 生成图像时出现未知错误: {str(e)}")
             yield self.create_text_message("🔧 请联系技术支持或查看详细日志")
             # 在开发环境中可以添加详细的错误信息
             import traceback
-            yield self.create_text_message(f"🔧 调试信息: {traceback.format_exc()}")
\ No newline at end of file
+            yield from self._progress(f"🔧 调试信息: {traceback.format_exc()}")
\ No newline at end of file
@@ -0,0 +1 @@
+# Nano Banana 公共组件模块
@@ -0,0 +1,270 @@
+"""
+OpenRouter 调用链路的异步引擎
+
+基于 httpx.AsyncClient 实现，所有协程都运行在一个进程级的后台事件循环
+线程中，一个插件进程即可同时保持大量生成请求在途，而不需要为每个请求
+占用一个线程。run_sync() 是同步适配器，供基于生成器的 _invoke 调用。
+
+- HTTP_ENGINE: 单次生成使用的引擎，sync（requests，默认）或 async（httpx）
+- ASYNC_MAX_CONNECTIONS: 异步客户端的最大连接数（默认 100）
+
+安装了 h2 时自动启用 HTTP/2。
+
+事件循环线程只负责网络 I/O：响应中数 MB 的 Base64 图像数据按批交给线程池
+解码，多个在途请求之间不会互相阻塞。
+"""
+
+import asyncio
+import threading
+from collections.abc import AsyncIterator, Awaitable, Iterator
+from typing import Any, Optional, TypeVar
+
+import httpx
+
+from utils.buffer_pool import PooledBuffer, get_buffer_pool
+from utils.config import env_int, env_str
+from utils.http_pool import OPENROUTER_API_BASE
+from utils.retry import call_with_retry_async
+from utils.stream_parse import (
+    STREAM_CHUNK_SIZE,
+    CompletionStreamParser,
+    ParsedCompletion,
+    streaming_parse_enabled,
+)
+
+T = TypeVar("T")
+
+# 响应数据积累到这个大小后交给线程池解析（Base64 解码），减少线程切换次数
+PARSE_BATCH_BYTES = 1024 * 1024
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_client: Optional[httpx.AsyncClient] = None
+_lock = threading.Lock()
+
+
+def use_async_engine() -> bool:
+    """是否为单次生成启用异步引擎"""
+    return env_str("HTTP_ENGINE", "sync").lower() == "async"
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """获取（必要时启动）后台事件循环线程"""
+    global _loop
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(
+                target=loop.run_forever,
+                name="nano-banana-async-engine",
+                daemon=True,
+            )
+            thread.start()
+            _loop = loop
+    return _loop
+
+
+def run_sync(coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+    """
+    在后台事件循环中执行协程并同步等待结果
+
+    Args:
+        coro: 需要执行的协程
+        timeout: 等待结果的最长时间（秒），None 表示一直等待
+
+    Returns:
+        协程的返回值；协程抛出的异常会原样重新抛出
+    """
+    future = asyncio.run_coroutine_threadsafe(coro, _get_loop())
+    try:
+        return future.result(timeout)
+    except BaseException:
+        future.cancel()
+        raise
+
+
+def iterate_sync(agen: AsyncIterator[T]) -> Iterator[T]:
+    """把异步迭代器适配为同步迭代器，每取一项都在后台事件循环中执行"""
+    try:
+        while True:
+            try:
+                yield run_sync(agen.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_sync(agen.aclose())
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """获取绑定在后台事件循环上的共享 httpx.AsyncClient"""
+    global _client
+    _get_loop()
+    with _lock:
+        if _client is None:
+            max_connections = env_int("ASYNC_MAX_CONNECTIONS", 100)
+            _client = httpx.AsyncClient(
+                http2=_http2_available(),
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                ),
+                follow_redirects=True,
+            )
+    return _client
+
+
+async def fetch_bytes(url: str, timeout: float = 30) -> httpx.Response:
+    """异步下载 URL 内容，非 2xx 状态码抛出 httpx.HTTPStatusError"""
+    response = await call_with_retry_async(
+        lambda: get_async_client().get(url, timeout=timeout),
+        operation="image_download",
+    )
+    response.raise_for_status()
+    return response
+
+
+async def fetch_into_buffer(url: str, timeout: float = 30) -> PooledBuffer:
+    """
+    异步下载 URL 内容到缓冲池借出的缓冲区（按 Content-Length 预分配），调用方负责归还
+
+    非 2xx 状态码抛出 httpx.HTTPStatusError
+    """
+    client = get_async_client()
+
+    def send() -> Awaitable[httpx.Response]:
+        return client.send(client.build_request("GET", url, timeout=timeout), stream=True)
+
+    response = await call_with_retry_async(send, operation="image_download")
+    try:
+        if response.is_error:
+            await response.aread()
+            response.raise_for_status()
+        buffer = get_buffer_pool().acquire(int(response.headers.get("Content-Length") or 0))
+        try:
+            async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+                buffer.write(chunk)
+        except BaseException:
+            buffer.release()
+            raise
+        return buffer
+    finally:
+        await response.aclose()
+
+
+async def post_chat_completion(
+    api_key: str,
+    payload: dict[str, Any],
+    timeout: float = 60,
+) -> tuple[httpx.Response, Optional[ParsedCompletion]]:
+    """
+    异步调用 OpenRouter chat/completions 接口
+
+    Returns:
+        (响应对象, 解析结果)。状态码为 4xx/5xx 时解析结果为 None，响应体已读取，
+        调用方可以像处理 requests.Response 一样读取 status_code、text 并调用
+        raise_for_status()。
+    """
+    client = get_async_client()
+
+    def send() -> Awaitable[httpx.Response]:
+        request = client.build_request(
+            "POST",
+            f"{OPENROUTER_API_BASE}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+            },
+            json=payload,
+            timeout=timeout,
+        )
+        return client.send(request, stream=True)
+
+    # 生成请求是付费的非幂等调用，只在请求确定未被处理时重试
+    response = await call_with_retry_async(send, operation="generation", idempotent=False)
+    try:
+        if response.status_code >= 400 or not streaming_parse_enabled():
+            await response.aread()
+            if response.status_code >= 400:
+                return response, None
+            # 内嵌图像的 JSON 有数 MB，在线程池中解析
+            data = await asyncio.to_thread(response.json)
+            return response, ParsedCompletion(data=data, response_bytes=len(response.content))
+        parser = CompletionStreamParser()
+
+        def feed(chunks: list[bytes]) -> None:
+            for chunk in chunks:
+                parser.feed(chunk)
+
+        # 事件循环只接收数据，Base64 解码按批在线程池中执行（同一时刻只有一个线程使用 parser）
+        pending: list[bytes] = []
+        pending_bytes = 0
+        async for chunk in response.aiter_bytes(STREAM_CHUNK_SIZE):
+            pending.append(chunk)
+            pending_bytes += len(chunk)
+            if pending_bytes >= PARSE_BATCH_BYTES:
+                await asyncio.to_thread(feed, pending)
+                pending, pending_bytes = [], 0
+
+        def finish() -> ParsedCompletion:
+            feed(pending)
+            return parser.close()
+
+        return response, await asyncio.to_thread(finish)
+    finally:
+        await response.aclose()
+
+
+async def stream_chat_completion_lines(
+    api_key: str,
+    payload: dict[str, Any],
+    timeout: float = 60,
+) -> AsyncIterator[str]:
+    """
+    以 SSE 流式模式调用 chat/completions，逐行产出响应
+
+    timeout 是相邻两次收到数据之间的最长间隔，而不是整个生成的总时长。
+
+    Raises:
+        httpx.HTTPStatusError: API 返回 4xx/5xx 状态码
+    """
+    client = get_async_client()
+
+    def send() -> Awaitable[httpx.Response]:
+        request = client.build_request(
+            "POST",
+            f"{OPENROUTER_API_BASE}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json",
+                "Accept": "text/event-stream",
+            },
+            json=dict(payload, stream=True),
+            timeout=timeout,
+        )
+        return client.send(request, stream=True)
+
+    response = await call_with_retry_async(send, operation="generation_stream", idempotent=False)
+    try:
+        if response.status_code >= 400:
+            await response.aread()
+            response.raise_for_status()
+        async for line in response.aiter_lines():
+            yield line
+    finally:
+        await response.aclose()
+
+
+def close_async_client() -> None:
+    """关闭共享异步客户端（主要用于测试和进程退出）"""
+    global _client
+    with _lock:
+        client, _client = _client, None
+    if client is not None:
+        run_sync(client.aclose())
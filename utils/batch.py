@@ -0,0 +1,96 @@
+"""
+批量生成：多个提示词在一次工具调用中并发执行
+
+run_batch() 用信号量限制同时在途的请求数，并按完成顺序逐个产出结果，
+单个条目失败不会中断整个批次。
+"""
+
+import asyncio
+import json
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable
+from dataclasses import dataclass
+from typing import Optional
+
+from utils.generation import GenerationResult
+
+
+@dataclass
+class BatchItem:
+    """批次中的一个生成任务"""
+    index: int
+    prompt: str
+    variation: int = 0
+
+
+@dataclass
+class BatchResult:
+    """批次中单个任务的执行结果"""
+    item: BatchItem
+    result: Optional[GenerationResult]
+    error: Optional[str]
+    latency: float
+
+
+def parse_batch_prompts(text: str) -> list[str]:
+    """
+    解析批量提示词
+
+    支持 JSON 字符串数组，或每行一个提示词的纯文本（忽略空行）。
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+    if text.startswith("["):
+        try:
+            items = json.loads(text)
+        except json.JSONDecodeError:
+            items = None
+        if isinstance(items, list):
+            return [str(item).strip() for item in items if str(item).strip()]
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def build_batch_items(prompts: list[str], variations: int) -> list[BatchItem]:
+    """把提示词列表按变体数展开为批次任务"""
+    items = []
+    for prompt in prompts:
+        for variation in range(max(1, variations)):
+            items.append(BatchItem(index=len(items), prompt=prompt, variation=variation))
+    return items
+
+
+async def run_batch(
+    items: list[BatchItem],
+    worker: Callable[[BatchItem], Awaitable[GenerationResult]],
+    concurrency: int,
+) -> AsyncIterator[BatchResult]:
+    """
+    以有限并发执行批次任务，按完成顺序产出结果
+
+    Args:
+        items: 批次任务
+        worker: 执行单个任务的协程函数
+        concurrency: 同时在途的最大任务数
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(item: BatchItem) -> BatchResult:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await worker(item)
+                error = None
+            except Exception as e:
+                result = None
+                error = str(e) or type(e).__name__
+            return BatchResult(item=item, result=result, error=error, latency=time.perf_counter() - start)
+
+    tasks = [asyncio.create_task(run_one(item)) for item in items]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # 调用方提前结束迭代时取消剩余任务
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,108 @@
+"""
+费用预算守卫
+
+按 API Key 限制一段时间内的花费。发送请求前，用用量台账中该 key 在窗口内
+的已花费加上本次请求的预估费用与预算比较：
+
+- 预估费用取该模型最近调用的平均实际费用，没有记录时按价格表和一张图像的
+  典型 Token 数估算；
+- 超出预算时，BUDGET_ACTION=reject 直接拒绝，downgrade 改用免费模型生成；
+  预估费用为 0 的请求（免费模型）始终放行。
+
+- BUDGET_USD: 每个 API Key 在窗口内的花费上限（美元，0 表示不限制，默认 0）
+- BUDGET_WINDOW_HOURS: 统计窗口（默认 24 小时）
+- BUDGET_ACTION: 超出预算时的处理方式 reject / downgrade（默认 reject）
+- BUDGET_FREE_MODEL: 降级使用的免费模型（默认 google/gemini-2.5-flash-image-preview:free）
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from utils.config import env_float, env_str
+from utils.credentials import key_fingerprint
+from utils.usage_ledger import UsageLedger, estimate_cost, get_usage_ledger
+
+FREE_MODEL = "google/gemini-2.5-flash-image-preview:free"
+# 没有历史记录时用于估算费用的一张图像的典型用量
+TYPICAL_USAGE = {"prompt_tokens": 300, "completion_tokens": 1290}
+
+
+class BudgetExceeded(Exception):
+    """本次请求会使花费超出预算"""
+
+
+@dataclass
+class BudgetDecision:
+    """预算检查的结果"""
+    model: str  # 实际使用的模型（降级时为免费模型）
+    downgraded: bool
+    spent: float
+    estimate: float
+    limit: float
+
+
+class BudgetGuard:
+    """按 API Key 的滑动窗口花费上限"""
+
+    def __init__(
+        self,
+        ledger: UsageLedger,
+        limit_usd: float,
+        window_seconds: float = 24 * 3600,
+        action: str = "reject",
+        free_model: str = FREE_MODEL,
+    ):
+        self.ledger = ledger
+        self.limit_usd = limit_usd
+        self.window_seconds = window_seconds
+        self.action = action
+        self.free_model = free_model
+
+    def estimate(self, model: str, calls: int = 1) -> float:
+        """预估 calls 次调用的费用（美元）"""
+        if model.endswith(":free"):
+            return 0.0
+        average = self.ledger.average_cost(model)
+        if average is None:
+            average = estimate_cost(model, TYPICAL_USAGE)
+        return average * calls
+
+    def check(self, api_key: str, model: str, calls: int = 1) -> BudgetDecision:
+        """
+        检查 calls 次调用是否会超出预算
+
+        Returns:
+            BudgetDecision，downgraded 为 True 时应改用 decision.model
+
+        Raises:
+            BudgetExceeded: 超出预算且处理方式为 reject
+        """
+        spent = self.ledger.spent(key_fingerprint(api_key), time.time() - self.window_seconds)
+        estimate = self.estimate(model, calls)
+        decision = BudgetDecision(model=model, downgraded=False, spent=spent, estimate=estimate, limit=self.limit_usd)
+        if estimate <= 0 or spent + estimate <= self.limit_usd:
+            return decision
+        if self.action == "downgrade" and model != self.free_model:
+            decision.model = self.free_model
+            decision.downgraded = True
+            return decision
+        window_hours = self.window_seconds / 3600
+        raise BudgetExceeded(
+            f"{window_hours:g} 小时内已花费 ${spent:.4f}，本次预计 ${estimate:.4f}，超出预算 ${self.limit_usd:.2f}"
+        )
+
+
+def get_budget_guard() -> Optional[BudgetGuard]:
+    """获取预算守卫，未设置预算或未启用用量台账时返回 None"""
+    limit = env_float("BUDGET_USD", 0)
+    ledger = get_usage_ledger()
+    if limit <= 0 or ledger is None:
+        return None
+    return BudgetGuard(
+        ledger,
+        limit_usd=limit,
+        window_seconds=env_float("BUDGET_WINDOW_HOURS", 24) * 3600,
+        action=env_str("BUDGET_ACTION", "reject").lower(),
+        free_model=env_str("BUDGET_FREE_MODEL", FREE_MODEL),
+    )
@@ -0,0 +1,244 @@
+"""
+可复用的字节缓冲池
+
+下载响应体、Base64 解码和格式转换的输出都需要几 MB 的临时缓冲区。
+每次调用都新建 BytesIO 时，大块内存反复分配、扩容、释放，长期运行的
+插件进程在并发下容易产生堆碎片，常驻内存持续上涨。这里按大小分级
+缓存 bytearray，借出的缓冲区写满时换用更大一级的缓冲区，用完归还后
+供下一次调用直接复用；池中缓存的总大小有上限，超出部分直接交还给分配器。
+
+- BUFFER_POOL_MAX_MB: 池中缓存的缓冲区总大小上限（默认 64 MB，0 表示不缓存）
+- BUFFER_POOL_MAX_BUFFER_MB: 单个缓冲区的缓存上限（默认 32 MB），更大的缓冲区用完即释放
+
+借出的缓冲区归还后会被其他调用复用，view() / reader() 返回的视图只在
+归还之前有效，需要长期保存的数据应先用 getvalue() 拷贝出来。
+"""
+
+import io
+import threading
+from collections.abc import Iterable
+from typing import Optional
+
+from utils.config import env_int
+
+# 最小的缓冲区（字节），小于它的请求也按这一级分配
+MIN_BUFFER_SIZE = 64 * 1024
+
+
+def _size_class(size: int) -> int:
+    """向上取整到分级大小：每个 2 的幂区间再分 8 级，浪费不超过 12.5%，最小为 MIN_BUFFER_SIZE"""
+    if size <= MIN_BUFFER_SIZE:
+        return MIN_BUFFER_SIZE
+    step = 1 << (size.bit_length() - 4)
+    return -(-size // step) * step
+
+
+class BufferReader(io.RawIOBase):
+    """只读、可定位的 memoryview 文件对象，供 Pillow 直接读取缓冲区内容而不拷贝"""
+
+    def __init__(self, view: memoryview):
+        super().__init__()
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = min(len(buffer), len(self._view) - self._pos)
+        if n <= 0:
+            return 0
+        buffer[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class PooledBuffer:
+    """
+    从缓冲池借出的可增长缓冲区
+
+    实现了 write() / tell() / flush()，可以直接作为 Image.save() 的目标文件；
+    作为上下文管理器使用时退出即归还。
+    """
+
+    def __init__(self, pool: "BufferPool", data: bytearray):
+        self._pool = pool
+        self._data: Optional[bytearray] = data
+        self.length = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._data) if self._data is not None else 0
+
+    def write(self, chunk) -> int:
+        """追加数据，容量不足时换用更大一级的缓冲区"""
+        n = len(chunk)
+        end = self.length + n
+        if end > len(self._data):
+            self._grow(end)
+        # 等长切片赋值只拷贝数据，不会改变 bytearray 的大小
+        self._data[self.length:end] = chunk
+        self.length = end
+        return n
+
+    def _grow(self, needed: int) -> None:
+        larger = self._pool._take(max(needed, len(self._data) * 2))
+        with memoryview(larger) as dst, memoryview(self._data) as src:
+            dst[:self.length] = src[:self.length]
+        # 被换下的小缓冲区不放回池中，否则一次扩容会在池里留下整条扩容链
+        self._pool._give(self._data, keep=False)
+        self._data = larger
+
+    def extend(self, chunks: Iterable[bytes]) -> "PooledBuffer":
+        """依次写入所有数据块（例如 response.iter_content()）"""
+        for chunk in chunks:
+            if chunk:
+                self.write(chunk)
+        return self
+
+    def tell(self) -> int:
+        return self.length
+
+    def flush(self) -> None:
+        pass
+
+    def view(self) -> memoryview:
+        """已写入数据的只读视图（不拷贝）"""
+        return memoryview(self._data).toreadonly()[:self.length]
+
+    def reader(self) -> BufferReader:
+        """已写入数据的文件对象视图（不拷贝）"""
+        return BufferReader(self.view())
+
+    def getvalue(self) -> bytes:
+        """拷贝出已写入的数据，之后即可归还缓冲区"""
+        with memoryview(self._data) as view:
+            return view[:self.length].tobytes()
+
+    def __len__(self) -> int:
+        return self.length
+
+    def release(self) -> None:
+        """归还缓冲区，重复调用无效"""
+        if self._data is not None:
+            self._pool._give(self._data)
+            self._data = None
+            self.length = 0
+
+    def __enter__(self) -> "PooledBuffer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class BufferPool:
+    """按大小分级缓存 bytearray 的缓冲池（线程安全）"""
+
+    def __init__(self, max_bytes: int, max_buffer_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_buffer_bytes = max_buffer_bytes
+        self._lock = threading.Lock()
+        self._free: dict[int, list[bytearray]] = {}
+        self.pooled_bytes = 0
+        self.in_use_bytes = 0
+        self.peak_in_use_bytes = 0
+        self.acquired = 0
+        self.reused = 0
+        self.allocated = 0
+        self.discarded = 0
+
+    def acquire(self, size_hint: int = 0) -> PooledBuffer:
+        """
+        借出一个缓冲区
+
+        Args:
+            size_hint: 预计写入的字节数（例如 Content-Length），用于一次分配到位；
+                为 0 表示大小未知
+        """
+        with self._lock:
+            self.acquired += 1
+        return PooledBuffer(self, self._take(size_hint))
+
+    def _take(self, size: int) -> bytearray:
+        size_class = _size_class(size)
+        with self._lock:
+            if size:
+                # 复用不小于所需大小、且不超过两倍的最小缓冲区
+                candidates = [c for c in self._free if size_class <= c <= 2 * size_class and self._free[c]]
+                chosen = min(candidates) if candidates else None
+            else:
+                # 大小未知（例如边读边解码）时复用最大的缓冲区，尽量避免扩容
+                chosen = max((c for c in self._free if self._free[c]), default=None)
+            if chosen is not None:
+                size_class = chosen
+                data = self._free[size_class].pop()
+                self.pooled_bytes -= size_class
+                self.reused += 1
+            else:
+                data = None
+                self.allocated += 1
+            self.in_use_bytes += size_class
+            self.peak_in_use_bytes = max(self.peak_in_use_bytes, self.in_use_bytes)
+        # 大块内存的分配放在锁外
+        return data if data is not None else bytearray(size_class)
+
+    def _give(self, data: bytearray, keep: bool = True) -> None:
+        size = len(data)
+        with self._lock:
+            self.in_use_bytes -= size
+            if not keep or size > self.max_buffer_bytes or self.pooled_bytes + size > self.max_bytes:
+                self.discarded += 1
+                return
+            self._free.setdefault(size, []).append(data)
+            self.pooled_bytes += size
+
+    def clear(self) -> None:
+        """释放池中缓存的所有缓冲区"""
+        with self._lock:
+            self._free.clear()
+            self.pooled_bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        """返回借出、复用、新分配、丢弃次数以及缓存和在用的字节数"""
+        with self._lock:
+            return {
+                "acquired": self.acquired,
+                "reused": self.reused,
+                "allocated": self.allocated,
+                "discarded": self.discarded,
+                "pooled_buffers": sum(len(free) for free in self._free.values()),
+                "pooled_bytes": self.pooled_bytes,
+                "in_use_bytes": self.in_use_bytes,
+                "peak_in_use_bytes": self.peak_in_use_bytes,
+            }
+
+
+_pool: Optional[BufferPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_buffer_pool() -> BufferPool:
+    """获取进程级缓冲池"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BufferPool(
+                max_bytes=max(0, env_int("BUFFER_POOL_MAX_MB", 64)) * 1024 * 1024,
+                max_buffer_bytes=max(0, env_int("BUFFER_POOL_MAX_BUFFER_MB", 32)) * 1024 * 1024,
+            )
+    return _pool
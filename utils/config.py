@@ -0,0 +1,40 @@
+"""
+环境变量配置读取
+
+插件的运行参数（连接池大小、缓存目录等）统一从环境变量读取，
+解析失败时回退到默认值，保证插件在缺省配置下也能正常启动。
+"""
+
+import os
+
+
+def env_str(name: str, default: str = "") -> str:
+    """读取字符串类型的环境变量"""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip()
+
+
+def env_int(name: str, default: int) -> int:
+    """读取整数类型的环境变量"""
+    try:
+        return int(env_str(name, str(default)))
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """读取浮点类型的环境变量"""
+    try:
+        return float(env_str(name, str(default)))
+    except ValueError:
+        return default
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    """读取布尔类型的环境变量（支持 1/true/yes/on）"""
+    value = env_str(name, "")
+    if not value:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
@@ -0,0 +1,194 @@
+"""
+OpenRouter API Key 校验与缓存
+
+校验优先使用免费的 GET /key 接口（返回 key 的额度信息，不消耗 token），
+接口不可用（404）时才退回到 1 token 的 chat/completions 探测请求。
+校验结果按 key 的 SHA-256 指纹缓存，明确的失败（401、402、额度用尽）
+使用较短的 TTL，网络错误、429 和 5xx 不缓存。同一 key 的并发校验通过
+single-flight 合并为一次请求。
+
+- CREDENTIAL_CACHE_TTL: 校验通过的缓存时间（默认 600 秒，0 表示不缓存）
+- CREDENTIAL_NEGATIVE_TTL: 校验失败的缓存时间（默认 60 秒）
+"""
+
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Any, Optional
+
+from utils.config import env_int
+from utils.http_pool import OPENROUTER_API_BASE, get_session
+from utils.retry import call_with_retry
+from utils.single_flight import SingleFlight
+
+# GET /key 不可用时的探测模型
+PROBE_MODEL = "deepseek/deepseek-chat-v3.1:free"
+
+
+@dataclass
+class KeyCheck:
+    """一次 API Key 校验的结果"""
+    valid: bool
+    message: str = ""  # 校验失败的原因
+    info: dict[str, Any] = field(default_factory=dict)  # GET /key 返回的额度信息
+    cacheable: bool = True  # 临时性失败（429、5xx）不缓存
+    cache_status: str = "miss"  # miss / hit / shared
+
+
+def key_fingerprint(api_key: str) -> str:
+    """API Key 的指纹，缓存中不保存明文 key"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _check_status(status_code: int) -> Optional[KeyCheck]:
+    """把失败的状态码转换为校验结果，成功时返回 None"""
+    if status_code == 401:
+        return KeyCheck(valid=False, message="OpenRouter API key 无效或已过期")
+    if status_code == 402:
+        return KeyCheck(valid=False, message="OpenRouter 账户余额不足")
+    if status_code == 429:
+        return KeyCheck(valid=False, message="OpenRouter API 调用频率过高", cacheable=False)
+    if status_code >= 500:
+        return KeyCheck(valid=False, message="OpenRouter 服务器暂时不可用", cacheable=False)
+    return None
+
+
+def _probe_chat_completion(api_key: str, timeout: float) -> KeyCheck:
+    """发送 1 token 的 chat/completions 请求校验 key"""
+    response = call_with_retry(
+        lambda: get_session().post(
+            f"{OPENROUTER_API_BASE}/chat/completions",
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            json={
+                "model": PROBE_MODEL,
+                "messages": [{"role": "user", "content": "test"}],
+                "max_tokens": 1
+            },
+            timeout=timeout
+        ),
+        operation="credential_validation",
+    )
+    failed = _check_status(response.status_code)
+    if failed is not None:
+        return failed
+    if response.status_code not in [200, 400]:  # 400 可能是因为测试请求格式
+        return KeyCheck(
+            valid=False,
+            message=f"OpenRouter API 连接测试失败，状态码: {response.status_code}",
+            cacheable=False,
+        )
+    return KeyCheck(valid=True)
+
+
+def probe_key(api_key: str, timeout: float = 10) -> KeyCheck:
+    """
+    向 OpenRouter 校验 API Key
+
+    Raises:
+        requests.exceptions.RequestException: 网络错误
+    """
+    response = call_with_retry(
+        lambda: get_session().get(
+            f"{OPENROUTER_API_BASE}/key",
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=timeout
+        ),
+        operation="credential_validation",
+    )
+    if response.status_code == 404:
+        return _probe_chat_completion(api_key, timeout)
+    failed = _check_status(response.status_code)
+    if failed is not None:
+        return failed
+    if response.status_code != 200:
+        return KeyCheck(
+            valid=False,
+            message=f"OpenRouter API 连接测试失败，状态码: {response.status_code}",
+            cacheable=False,
+        )
+
+    info = response.json().get("data") or {}
+    remaining = info.get("limit_remaining")
+    if remaining is not None and remaining <= 0:
+        return KeyCheck(valid=False, message="OpenRouter API key 额度已用尽", info=info)
+    return KeyCheck(valid=True, info=info)
+
+
+class CredentialValidator:
+    """带缓存和请求合并的 API Key 校验（线程安全）"""
+
+    def __init__(self, ttl: float, negative_ttl: float):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._cache: dict[str, tuple[KeyCheck, float]] = {}
+        self._flight = SingleFlight()
+        self.hits = 0
+        self.probes = 0
+
+    def check(self, api_key: str, timeout: float = 10) -> KeyCheck:
+        """
+        校验 API Key，优先使用缓存
+
+        Raises:
+            requests.exceptions.RequestException: 网络错误（不缓存）
+        """
+        fingerprint = key_fingerprint(api_key)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(fingerprint)
+            if cached is not None and cached[1] > now:
+                self.hits += 1
+                return replace(cached[0], cache_status="hit")
+
+        def probe() -> KeyCheck:
+            with self._lock:
+                self.probes += 1
+            result = probe_key(api_key, timeout=timeout)
+            ttl = self.ttl if result.valid else self.negative_ttl
+            if result.cacheable and ttl > 0:
+                with self._lock:
+                    self._cache[fingerprint] = (result, time.monotonic() + ttl)
+                    # 顺便清理过期条目，避免缓存无限增长
+                    expired = [k for k, (_, expires) in self._cache.items() if expires <= now]
+                    for k in expired:
+                        del self._cache[k]
+            return result
+
+        result, shared = self._flight.do(fingerprint, probe)
+        return replace(result, cache_status="shared") if shared else result
+
+    def invalidate(self, api_key: str) -> None:
+        """移除某个 key 的缓存结果（例如调用时收到 401 后）"""
+        with self._lock:
+            self._cache.pop(key_fingerprint(api_key), None)
+
+    def stats(self) -> dict[str, int]:
+        """返回缓存命中次数、实际探测次数、合并次数和缓存条目数"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "probes": self.probes,
+                "shared": self._flight.shared,
+                "entries": len(self._cache),
+            }
+
+
+_validator: Optional[CredentialValidator] = None
+_validator_lock = threading.Lock()
+
+
+def get_credential_validator() -> CredentialValidator:
+    """获取进程级 API Key 校验器"""
+    global _validator
+    with _validator_lock:
+        if _validator is None:
+            _validator = CredentialValidator(
+                ttl=env_int("CREDENTIAL_CACHE_TTL", 600),
+                negative_ttl=env_int("CREDENTIAL_NEGATIVE_TTL", 60),
+            )
+    return _validator
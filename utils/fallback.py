@@ -0,0 +1,149 @@
+"""
+模型回退链与对冲请求
+
+回退：按顺序尝试多个模型，前一个失败（HTTP 错误、超时或没有生成图像）
+时使用下一个。
+
+对冲：主模型在 hedge_after 秒内还没有返回时，向链上的下一个模型再发一个
+请求，采用先成功的结果并取消另一个。每次调用由哪个模型完成、是否触发了
+对冲以及各模型的耗时都会被记录，用于调整对冲阈值（建议取主模型 p95）。
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import Optional, TypeVar
+
+T = TypeVar("T")
+
+# 每个模型保留的最近耗时样本数
+LATENCY_SAMPLES = 200
+
+
+def parse_model_list(text: str) -> list[str]:
+    """解析以逗号或换行分隔的模型列表"""
+    models = []
+    for part in (text or "").replace("\n", ",").split(","):
+        part = part.strip()
+        if part and part not in models:
+            models.append(part)
+    return models
+
+
+class ModelRoutingStats:
+    """记录各模型的服务次数、失败次数、对冲情况和耗时分布（线程安全）"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._models: dict[str, dict[str, float]] = {}
+        self._latencies: dict[str, deque] = {}
+
+    def _entry(self, model: str) -> dict[str, float]:
+        return self._models.setdefault(model, {
+            "served": 0, "failures": 0, "cancelled": 0,
+            "fallback_served": 0, "hedges_fired": 0, "hedge_wins": 0,
+        })
+
+    def record(self, model: str, outcome: str, latency: Optional[float] = None) -> None:
+        with self._lock:
+            self._entry(model)[outcome] += 1
+            if latency is not None:
+                self._latencies.setdefault(model, deque(maxlen=LATENCY_SAMPLES)).append(latency)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """返回各模型的计数以及最近成功请求耗时的 p50/p95"""
+        with self._lock:
+            result = {}
+            for model, counters in self._models.items():
+                entry = dict(counters)
+                samples = sorted(self._latencies.get(model, ()))
+                if samples:
+                    entry["p50_seconds"] = samples[int(0.50 * (len(samples) - 1))]
+                    entry["p95_seconds"] = samples[int(0.95 * (len(samples) - 1))]
+                result[model] = entry
+            return result
+
+
+_stats = ModelRoutingStats()
+
+
+def model_routing_stats() -> dict[str, dict[str, float]]:
+    """返回模型回退/对冲统计"""
+    return _stats.snapshot()
+
+
+async def call_with_fallback(
+    models: list[str],
+    call: Callable[[str], Awaitable[T]],
+    is_success: Callable[[T], bool],
+    hedge_after: float = 0,
+) -> tuple[T, str]:
+    """
+    沿回退链调用模型，可选对冲
+
+    Args:
+        models: 回退链，第一个为主模型
+        call: 使用指定模型执行一次生成的协程函数
+        is_success: 判断结果是否可用
+        hedge_after: 对冲阈值（秒），0 表示不对冲
+
+    Returns:
+        (结果, 实际完成请求的模型)
+
+    Raises:
+        所有模型都失败时，抛出最后一个请求的异常；若最后一个失败的请求
+        返回的是不可用结果，则抛出 ValueError
+    """
+    remaining = list(models)
+    pending: dict[asyncio.Task, tuple[str, float]] = {}
+    last_error: Optional[BaseException] = None
+
+    def launch(kind: Optional[str]) -> None:
+        model = remaining.pop(0)
+        if kind is not None:
+            _stats.record(model, kind)
+        pending[asyncio.create_task(call(model))] = (model, time.perf_counter())
+
+    launch(None)
+    hedged = False
+    try:
+        while pending:
+            # 只有一个请求在途且链上还有模型时，才等待对冲阈值
+            timeout = hedge_after if hedge_after > 0 and remaining and len(pending) == 1 else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                launch("hedges_fired")
+                continue
+
+            for task in done:
+                model, started = pending.pop(task)
+                latency = time.perf_counter() - started
+                try:
+                    result = task.result()
+                except Exception as e:
+                    last_error = e
+                    _stats.record(model, "failures")
+                    continue
+                if not is_success(result):
+                    last_error = None
+                    _stats.record(model, "failures")
+                    continue
+
+                _stats.record(model, "served", latency)
+                if model != models[0]:
+                    _stats.record(model, "hedge_wins" if hedged else "fallback_served")
+                return result, model
+
+            if not pending and remaining:
+                launch(None)
+    finally:
+        for task, (model, _) in pending.items():
+            task.cancel()
+            _stats.record(model, "cancelled")
+
+    if last_error is not None:
+        raise last_error
+    raise ValueError(f"所有模型都没有生成图像数据: {', '.join(models)}")
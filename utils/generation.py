@@ -0,0 +1,179 @@
+"""
+基于异步引擎的单次生成流程
+
+封装 "发送请求 -> 解析响应 -> 解码/下载图像 -> 转 PNG" 的完整链路，
+供批量生成等需要在同一事件循环中并发执行多次生成的场景使用。
+
+- COALESCE_ENABLED: 是否合并相同的并发生成请求（默认 true）
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional, Union
+
+from utils.async_client import fetch_into_buffer, post_chat_completion
+from utils.buffer_pool import PooledBuffer
+from utils.config import env_bool
+from utils.fallback import call_with_fallback
+from utils.images import decode_data_url, encode_output, image_workers
+from utils.metrics import Trace
+from utils.rate_limit import get_rate_limiter
+from utils.result_cache import CachedBlob
+from utils.single_flight import SingleFlight
+from utils.stream_parse import resolve_blob
+
+_generation_flight = SingleFlight()
+
+
+@dataclass
+class GenerationResult:
+    """一次生成的结果"""
+    blobs: list[CachedBlob] = field(default_factory=list)
+    text: str = ""
+    usage: dict[str, Any] = field(default_factory=dict)
+    errors: list[str] = field(default_factory=list)
+    # 实际完成生成的模型（启用回退/对冲时可能不是请求的主模型）
+    model: str = ""
+
+
+def get_generation_flight() -> Optional[SingleFlight]:
+    """
+    获取进程级的生成请求合并器，未启用时返回 None
+
+    多个工作流分支同时发起相同的请求（同一 key、模型、提示词、输入图像和
+    输出参数）时，只向 OpenRouter 发送一次，所有调用方共享生成结果。
+    """
+    if not env_bool("COALESCE_ENABLED", True):
+        return None
+    return _generation_flight
+
+
+def build_payload(model: str, content: list[dict[str, Any]]) -> dict[str, Any]:
+    """构建 chat/completions 请求载荷"""
+    return {
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+    }
+
+
+async def generate_async(
+    api_key: str,
+    payload: dict[str, Any],
+    timeout: float = 60,
+    output_format: str = "png",
+    quality: int = 90,
+    trace: Optional[Trace] = None,
+) -> GenerationResult:
+    """
+    异步执行一次完整的图像生成
+
+    Args:
+        output_format: 输出格式，见 utils.images.encode_output()
+        quality: JPEG/WebP 的编码质量
+        trace: 记录各阶段耗时的 Trace（可选）
+
+    Raises:
+        httpx.HTTPStatusError: API 返回非 2xx 状态码
+        ValueError: 响应中没有生成结果
+    """
+    trace = trace or Trace()
+    model = payload["model"]
+    limiter = get_rate_limiter()
+    if limiter is not None:
+        with trace.span("rate_limit_wait", model=model):
+            await limiter.acquire_async(api_key, model)
+    with trace.span("api_request", model=model) as span:
+        response, parsed = await post_chat_completion(api_key, payload, timeout=timeout)
+        span["http_status"] = response.status_code
+        response.raise_for_status()
+        span["bytes"] = parsed.response_bytes
+    if parsed.blobs:
+        trace.add("base64_decode", parsed.decode_seconds, nbytes=sum(len(b) for b in parsed.blobs), model=model)
+    response_data = parsed.data
+
+    choices = response_data.get("choices", [])
+    if not choices:
+        raise ValueError("API 响应中没有找到生成结果")
+    message = choices[0].get("message", {})
+
+    result = GenerationResult(
+        text=message.get("content") or "",
+        usage=response_data.get("usage", {}),
+        model=payload["model"],
+    )
+    images = message.get("images", [])
+    # 所有图像并发下载/解码，并行度与同步路径一致
+    semaphore = asyncio.Semaphore(image_workers())
+
+    async def load(image_url: str) -> tuple[bytes, str]:
+        async with semaphore:
+            raw = resolve_blob(image_url, parsed.blobs)
+            if raw is None and image_url.startswith("data:image/"):
+                # Base64 解码和格式转换一起在线程池中执行
+                return await asyncio.to_thread(lambda: encode(decode_data_url(image_url)[1]))
+            if raw is None:
+                with trace.span("image_fetch", model=model) as span:
+                    raw = await fetch_into_buffer(image_url)
+                    span["bytes"] = len(raw)
+            # 格式转换在线程池中执行，不阻塞事件循环
+            return await asyncio.to_thread(encode, raw)
+
+    def encode(raw: Union[bytes, PooledBuffer]) -> tuple[bytes, str]:
+        if isinstance(raw, PooledBuffer):
+            # 直接从下载缓冲区转码，完成后归还
+            with raw:
+                return encode(raw.view())
+        started = time.perf_counter()
+        encoded = encode_output(raw, output_format, quality)
+        trace.add("encode", time.perf_counter() - started, nbytes=len(encoded[0]), model=model)
+        return encoded
+
+    urls = [image_data.get("image_url", {}).get("url", "") for image_data in images]
+    outcomes = await asyncio.gather(
+        *[load(url) for url in urls if url],
+        return_exceptions=True,
+    )
+    outcomes = iter(outcomes)
+    for i, url in enumerate(urls):
+        if not url:
+            result.errors.append(f"第 {i+1} 张图像数据无效")
+            continue
+        outcome = next(outcomes)
+        if isinstance(outcome, BaseException):
+            result.errors.append(f"处理第 {i+1} 张图像时出错: {str(outcome)}")
+        else:
+            blob, mime_type = outcome
+            result.blobs.append(CachedBlob(blob=blob, mime_type=mime_type))
+    return result
+
+
+async def generate_with_fallback(
+    api_key: str,
+    models: list[str],
+    content: list[dict[str, Any]],
+    hedge_after: float = 0,
+    timeout: float = 60,
+    output_format: str = "png",
+    quality: int = 90,
+    trace: Optional[Trace] = None,
+) -> GenerationResult:
+    """
+    沿模型回退链生成图像，见 utils.fallback.call_with_fallback()
+
+    只有至少生成了一张图像的结果才算成功，否则继续尝试链上的下一个模型。
+    返回结果的 model 字段为实际完成生成的模型。
+    """
+    async def call(model: str) -> GenerationResult:
+        return await generate_async(
+            api_key, build_payload(model, content), timeout=timeout,
+            output_format=output_format, quality=quality, trace=trace,
+        )
+
+    result, _ = await call_with_fallback(models, call, lambda r: bool(r.blobs), hedge_after=hedge_after)
+    return result
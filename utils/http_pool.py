@@ -0,0 +1,132 @@
+"""
+进程级共享的 HTTP 连接池
+
+Text2ImageTool 和 NanaBananaProvider 的所有 HTTP 请求都通过同一个
+requests.Session 发送，复用 keep-alive 连接，避免每次调用都重新进行
+TCP + TLS 握手。连接池大小可通过环境变量配置：
+
+- HTTP_POOL_CONNECTIONS: 缓存的主机连接池数量（默认 10）
+- HTTP_POOL_MAXSIZE: 每个主机保留的最大连接数（默认 20）
+- HTTP_POOL_BLOCK: 连接耗尽时是否阻塞等待（默认 false）
+- OPENROUTER_API_BASE: API 地址（默认 https://openrouter.ai/api/v1，基准测试时指向本地模拟服务）
+"""
+
+import socket
+import threading
+from typing import Any, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+from utils.config import env_bool, env_int, env_str
+
+OPENROUTER_API_BASE = env_str("OPENROUTER_API_BASE", "https://openrouter.ai/api/v1")
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """带 TCP keep-alive 和按主机统计的连接池适配器"""
+
+    def __init__(self, pool_connections: int, pool_maxsize: int, pool_block: bool):
+        self._stats_lock = threading.Lock()
+        self._host_requests: dict[str, int] = {}
+        self._host_errors: dict[str, int] = {}
+        super().__init__(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+        )
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        # 开启 TCP keep-alive，防止空闲连接被中间设备静默断开
+        kwargs["socket_options"] = HTTPConnection.default_socket_options + [
+            (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+        ]
+        super().init_poolmanager(*args, **kwargs)
+
+    def send(self, request: requests.PreparedRequest, *args: Any, **kwargs: Any) -> requests.Response:
+        host = urlsplit(request.url).netloc
+        try:
+            response = super().send(request, *args, **kwargs)
+        except Exception:
+            with self._stats_lock:
+                self._host_errors[host] = self._host_errors.get(host, 0) + 1
+            raise
+        with self._stats_lock:
+            self._host_requests[host] = self._host_requests.get(host, 0) + 1
+        return response
+
+    def host_stats(self) -> dict[str, dict[str, int]]:
+        """
+        返回每个主机的连接池统计
+
+        Returns:
+            以 "host:port" 为键的字典，包含请求数、错误数、
+            已建立的连接数和当前空闲连接数
+        """
+        stats: dict[str, dict[str, int]] = {}
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{key.key_host}:{key.key_port}" if key.key_port else key.key_host
+            # urllib3 用 None 占位预填充连接队列，只统计真实的空闲连接
+            idle = list(pool.pool.queue) if pool.pool is not None else []
+            stats[host] = {
+                "connections_opened": pool.num_connections,
+                "pool_requests": pool.num_requests,
+                "idle_connections": sum(1 for conn in idle if conn is not None),
+            }
+
+        with self._stats_lock:
+            for netloc in set(self._host_requests) | set(self._host_errors):
+                entry = stats.setdefault(netloc, {})
+                entry["requests"] = self._host_requests.get(netloc, 0)
+                entry["errors"] = self._host_errors.get(netloc, 0)
+        return stats
+
+
+_session: Optional[requests.Session] = None
+_adapter: Optional[PooledHTTPAdapter] = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """获取进程级共享的 requests.Session（线程安全的懒加载）"""
+    global _session, _adapter
+    if _session is not None:
+        return _session
+
+    with _session_lock:
+        if _session is None:
+            adapter = PooledHTTPAdapter(
+                pool_connections=env_int("HTTP_POOL_CONNECTIONS", 10),
+                pool_maxsize=env_int("HTTP_POOL_MAXSIZE", 20),
+                pool_block=env_bool("HTTP_POOL_BLOCK", False),
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _adapter = adapter
+            _session = session
+    return _session
+
+
+def pool_stats() -> dict[str, dict[str, int]]:
+    """返回共享连接池的按主机统计，尚未创建连接池时返回空字典"""
+    adapter = _adapter
+    if adapter is None:
+        return {}
+    return adapter.host_stats()
+
+
+def close_session() -> None:
+    """关闭共享会话并释放所有连接（主要用于测试和进程退出）"""
+    global _session, _adapter
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+        _adapter = None
@@ -0,0 +1,158 @@
+"""
+生成图像的解码与转码
+
+OpenRouter 返回的图像可能是 data URL（Base64）或普通 URL，
+这里提供统一的解码和 PNG 转码函数，供单次生成和批量生成共用。
+"""
+
+import base64
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import Optional, TypeVar, Union
+
+from utils.buffer_pool import BufferReader, PooledBuffer, get_buffer_pool
+from utils.config import env_int
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def decode_data_url(data_url: str) -> tuple[str, bytes]:
+    """
+    解析 data:image/xxx;base64,... 格式的图像
+
+    Returns:
+        (MIME 类型, 解码后的原始字节)
+    """
+    header, base64_data = data_url.split(",", 1)
+    mime_type = header[len("data:"):].split(";", 1)[0] or "application/octet-stream"
+    return mime_type, base64.b64decode(base64_data)
+
+
+# 输出格式 -> (Pillow 格式名, MIME 类型)
+OUTPUT_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+
+def sniff_mime(raw: bytes) -> Optional[str]:
+    """根据文件头魔数判断图像 MIME 类型，无法识别时返回 None"""
+    raw = bytes(raw[:12])
+    if raw.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if raw.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if raw[:4] == b"RIFF" and raw[8:12] == b"WEBP":
+        return "image/webp"
+    if raw[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+
+def encode_output(
+    raw: Union[bytes, memoryview], output_format: str = "png", quality: int = 90
+) -> tuple[bytes, str]:
+    """
+    按目标格式输出图像
+
+    数据本身已经是目标格式（或 output_format 为 original）时，只做不解码
+    像素的轻量校验，直接返回原始字节；否则解码后重新编码。
+
+    Args:
+        raw: 原始图像字节，也可以是缓冲池中缓冲区的视图（不会被保留）
+        output_format: png / jpeg / webp / original
+        quality: JPEG/WebP 的编码质量（1-100）
+
+    Returns:
+        (图像字节, MIME 类型)
+    """
+    # Pillow 延迟到第一次处理图像时导入，缩短插件进程的启动时间
+    from PIL import Image
+
+    source = BytesIO(raw) if isinstance(raw, bytes) else BufferReader(raw)
+    image = Image.open(source)  # 只解析文件头，不解码像素
+    source_mime = sniff_mime(raw) or Image.MIME.get(image.format or "", "application/octet-stream")
+
+    if output_format == "original":
+        return bytes(raw), source_mime
+    pil_format, mime_type = OUTPUT_FORMATS.get(output_format, OUTPUT_FORMATS["png"])
+    if source_mime == mime_type:
+        return bytes(raw), mime_type
+
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    # 编码到复用的缓冲区，按输入大小预分配，避免输出缓冲区逐步扩容
+    with get_buffer_pool().acquire(len(raw)) as buffer:
+        if pil_format == "PNG":
+            image.save(buffer, format=pil_format)
+        else:
+            image.save(buffer, format=pil_format, quality=max(1, min(100, quality)))
+        return buffer.getvalue(), mime_type
+
+
+def load_generated_image(
+    image_url: str,
+    fetch: Callable[[str], Union[bytes, PooledBuffer]],
+    output_format: str = "png",
+    quality: int = 90,
+) -> tuple[bytes, str]:
+    """
+    把 API 返回的单张图像（data URL 或普通 URL）转换为目标输出格式
+
+    Args:
+        image_url: data:image/...;base64,... 或可下载的图像 URL
+        fetch: 下载普通 URL 的函数，返回响应体字节或缓冲池中的缓冲区（用完后归还）
+        output_format: 输出格式，见 encode_output()
+        quality: JPEG/WebP 的编码质量
+
+    Returns:
+        (图像字节, MIME 类型)
+    """
+    if image_url.startswith("data:image/"):
+        _, raw = decode_data_url(image_url)
+        return encode_output(raw, output_format, quality)
+    body = fetch(image_url)
+    if isinstance(body, PooledBuffer):
+        with body:
+            return encode_output(body.view(), output_format, quality)
+    return encode_output(body, output_format, quality)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def image_workers() -> int:
+    """图像下载/解码的并行度（IMAGE_WORKERS，默认 4）"""
+    return max(1, env_int("IMAGE_WORKERS", 4))
+
+
+def get_image_executor() -> ThreadPoolExecutor:
+    """
+    获取进程级图像处理线程池
+
+    Pillow 的解码和编码会释放 GIL，下载则是 IO 密集，
+    因此多张图像可以在线程池中真正并行处理。
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=image_workers(),
+                thread_name_prefix="nano-banana-image",
+            )
+    return _executor
+
+
+def map_ordered(func: Callable[[T], R], items: Iterable[T]) -> Iterator[Future]:
+    """
+    在图像线程池中并发执行 func，并按输入顺序逐个返回 Future
+
+    调用方按顺序等待每个 Future，从而在并行处理的同时保持确定的输出顺序。
+    """
+    executor = get_image_executor()
+    return iter([executor.submit(func, item) for item in items])
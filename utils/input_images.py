@@ -0,0 +1,543 @@
+"""
+输入图像（图生图）的下载、预处理与缓存
+
+同一张参考图常在一个工作流里被反复使用。这里按 URL 缓存预处理后的
+data URL，并记录 ETag / Last-Modified：
+
+- 在 INPUT_IMAGE_FRESH_SECONDS 内再次使用时直接命中，不访问网络；
+- 超过该时间后发送条件 GET，服务器返回 304 时复用缓存结果；
+- 没有校验头的图像重新下载后按内容哈希复用预处理结果，省去 CPU 开销。
+
+下载按块流式读取到缓冲池的缓冲区中：Content-Length 或已读取的字节数
+超过上限时立即中止；根据开头的魔数判断格式，不支持的类型不再继续下载；
+图像头部一到达就交给 ImageFile.Parser 解析出尺寸，像素数超限同样提前中止。
+
+预处理使用 JPEG 的 draft() 在解码阶段直接缩小，再配合 reducing_gap
+先整数倍缩小后重采样；原图已是合适尺寸的 RGB JPEG 时直接透传。
+
+上传编码可配置：格式可选 JPEG / WebP / AVIF（Pillow 不支持时退回 JPEG），
+最长边按模型实际使用的输入分辨率查表（MODEL_MAX_INPUT_SIZE）；设置目标
+大小时在同一次解码的图像上二分搜索编码质量，取不超过目标大小的最高质量。
+
+多张输入图像（合成、编辑）在图像线程池中并发下载和预处理，按内容哈希
+去重后作为多个 image_url 附加到请求中；所有 data URL 的总大小超过
+INPUT_PAYLOAD_MAX_MB 时逐级降低分辨率和编码质量重新编码，使上传量有界。
+
+- INPUT_IMAGE_CACHE_ENTRIES: 缓存的图像数量（默认 64）
+- INPUT_IMAGE_FRESH_SECONDS: 免验证直接复用的时间（默认 60 秒）
+- INPUT_IMAGE_MAX_MB: 输入图像的最大下载大小（默认 20 MB）
+- INPUT_IMAGE_MAX_PIXELS: 输入图像的最大像素数（默认 4000 万）
+- INPUT_PAYLOAD_MAX_MB: 所有输入图像 data URL 的总大小预算（默认 8 MB）
+- INPUT_IMAGE_FORMAT: 上传编码格式 jpeg / webp / avif（默认 jpeg）
+- INPUT_IMAGE_QUALITY: 上传编码质量（默认 85）
+- INPUT_IMAGE_MAX_SIZE: 上传图像的最长边，0 表示按模型查表（默认 0）
+- INPUT_IMAGE_TARGET_KB: 单张图像的目标大小，0 表示不限制（默认 0）
+"""
+
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field, replace
+from io import BytesIO
+from typing import TYPE_CHECKING, Optional, Union
+
+from utils.buffer_pool import BufferReader, PooledBuffer, get_buffer_pool
+from utils.config import env_int, env_str
+from utils.http_pool import get_session
+from utils.images import map_ordered, sniff_mime
+from utils.retry import call_with_retry
+from utils.stream_parse import STREAM_CHUNK_SIZE
+
+if TYPE_CHECKING:
+    from PIL import Image, ImageFile
+
+MAX_INPUT_SIZE = 1024
+JPEG_QUALITY = 85
+
+# 支持的输入图像格式
+SUPPORTED_INPUT_TYPES = ("image/jpeg", "image/png", "image/webp", "image/gif")
+# 判断格式所需的文件头字节数（WebP 的魔数位于第 8-12 字节）
+SNIFF_BYTES = 12
+# 在开头多少字节内解析图像头部（JPEG 的 EXIF 等元数据可能较大）
+HEADER_PROBE_BYTES = 256 * 1024
+# 总大小超出预算时依次尝试的 (最长边, 编码质量)
+PAYLOAD_BUDGET_STEPS = ((768, 80), (512, 75), (384, 70), (256, 60))
+
+# 上传编码格式：(PIL 格式, MIME 类型)
+UPLOAD_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg"),
+    "webp": ("WEBP", "image/webp"),
+    "avif": ("AVIF", "image/avif"),
+}
+# 目标大小模式下搜索编码质量的下限
+MIN_UPLOAD_QUALITY = 30
+# 各模型实际使用的输入图像最长边，按模型 ID 前缀匹配（取最长的前缀）
+MODEL_MAX_INPUT_SIZE = {
+    "google/gemini-2.5-flash-image": 1024,  # 输出为 1024 像素，参考图保持同等分辨率
+    "google/": 768,  # Gemini 按 768x768 切块计费，更大的图像只会增加切块数
+    "openai/": 1024,  # 先缩放到 2048 以内再把短边缩到 768，常见宽高比下最长边约 1024
+    "anthropic/": 1568,  # 超过约 1568 像素的图像会被服务端缩小
+}
+
+
+@dataclass(frozen=True)
+class UploadEncoding:
+    """输入图像的上传编码参数（同时作为预处理缓存键的一部分）"""
+    format: str = "jpeg"
+    quality: int = JPEG_QUALITY
+    max_size: int = MAX_INPUT_SIZE
+    # 大于 0 时二分搜索编码质量，使单张图像不超过该字节数
+    target_bytes: int = 0
+
+
+def upload_format_supported(upload_format: str) -> bool:
+    """当前 Pillow 是否支持该上传编码格式"""
+    if upload_format == "jpeg":
+        return True
+    from PIL import features
+
+    return upload_format in UPLOAD_FORMATS and bool(features.check(upload_format))
+
+
+def model_max_input_size(model: str) -> int:
+    """按模型 ID 前缀查表得到输入图像的最长边，未匹配时使用 MAX_INPUT_SIZE"""
+    matches = [prefix for prefix in MODEL_MAX_INPUT_SIZE if model.startswith(prefix)]
+    return MODEL_MAX_INPUT_SIZE[max(matches, key=len)] if matches else MAX_INPUT_SIZE
+
+
+def upload_encoding_for(model: str) -> UploadEncoding:
+    """根据环境变量和模型的输入分辨率确定上传编码参数"""
+    upload_format = env_str("INPUT_IMAGE_FORMAT", "jpeg").lower()
+    if not upload_format_supported(upload_format):
+        upload_format = "jpeg"
+    return UploadEncoding(
+        format=upload_format,
+        quality=max(1, min(100, env_int("INPUT_IMAGE_QUALITY", JPEG_QUALITY))),
+        max_size=env_int("INPUT_IMAGE_MAX_SIZE", 0) or model_max_input_size(model),
+        target_bytes=env_int("INPUT_IMAGE_TARGET_KB", 0) * 1024,
+    )
+
+
+class InputImageError(ValueError):
+    """输入图像不符合要求：过大、格式不支持或不是有效的图像"""
+
+
+@dataclass
+class PreparedImage:
+    """预处理后的输入图像"""
+    data_url: str
+    encoded: bytes
+    original_size: tuple[int, int]
+    size: tuple[int, int]
+    cache_status: str = "miss"  # miss / fresh / revalidated / content
+    # 本次获取各阶段的耗时（秒）：download、preprocess
+    timings: dict[str, float] = field(default_factory=dict)
+    downloaded_bytes: int = 0
+    # 原始图像内容的 SHA-256，用于多图去重
+    content_hash: str = ""
+    mime_type: str = "image/jpeg"
+
+
+@dataclass
+class _CacheEntry:
+    prepared: PreparedImage
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: str
+    validated_at: float
+
+
+def _encode_upload(image: "Image.Image", pil_format: str, quality: int, target_bytes: int) -> bytes:
+    """
+    编码已解码的图像；target_bytes 大于 0 且超出时，在 [MIN_UPLOAD_QUALITY, quality)
+    内二分搜索不超过目标大小的最高质量，始终无法满足时返回最低质量的结果
+    """
+    def encode(q: int) -> bytes:
+        buffer = BytesIO()
+        image.save(buffer, format=pil_format, quality=q)
+        return buffer.getvalue()
+
+    encoded = encode(quality)
+    if target_bytes <= 0 or len(encoded) <= target_bytes:
+        return encoded
+
+    best, smallest = None, encoded
+    low, high = MIN_UPLOAD_QUALITY, quality - 1
+    while low <= high:
+        mid = (low + high) // 2
+        candidate = encode(mid)
+        if len(candidate) <= target_bytes:
+            best, low = candidate, mid + 1
+        else:
+            smallest, high = candidate, mid - 1
+    return best if best is not None else smallest
+
+
+def preprocess_image(
+    raw: Union[bytes, memoryview], max_size: int = MAX_INPUT_SIZE, quality: int = JPEG_QUALITY,
+    reencode: bool = False, upload_format: str = "jpeg", target_bytes: int = 0,
+) -> PreparedImage:
+    """
+    把原始图像缩放到 max_size 以内并编码为上传用的 data URL
+
+    Args:
+        raw: 下载得到的原始图像字节，也可以是缓冲池中缓冲区的视图（不会被保留）
+        max_size: 最长边上限
+        quality: 编码质量
+        reencode: 为 True 时即使已是合适尺寸的 JPEG 也按 quality 重新编码
+        upload_format: 上传编码格式 jpeg / webp / avif
+        target_bytes: 大于 0 时编码结果尽量不超过该字节数
+    """
+    from PIL import Image
+
+    pil_format, mime_type = UPLOAD_FORMATS.get(upload_format, UPLOAD_FORMATS["jpeg"])
+    image = Image.open(BytesIO(raw) if isinstance(raw, bytes) else BufferReader(raw))
+    original_size = image.size
+
+    # 已经是合适尺寸（且不超过目标大小）的 RGB JPEG：无需解码和重新编码
+    if (
+        not reencode and pil_format == "JPEG" and image.format == "JPEG" and image.mode == "RGB"
+        and max(original_size) <= max_size and not (target_bytes and len(raw) > target_bytes)
+    ):
+        encoded = raw if isinstance(raw, bytes) else bytes(raw)
+        size = original_size
+    else:
+        if image.format == "JPEG" and max(original_size) > max_size:
+            # 在解码时按 1/2、1/4、1/8 缩小，直接输出 RGB
+            image.draft("RGB", (max_size, max_size))
+        if max(image.size) > max_size:
+            # 先用 reduce() 整数倍缩小，再用 LANCZOS 做最后的重采样
+            image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        encoded = _encode_upload(image, pil_format, quality, target_bytes)
+        size = image.size
+
+    data_url = f"data:{mime_type};base64,{base64.b64encode(encoded).decode('utf-8')}"
+    return PreparedImage(
+        data_url=data_url, encoded=encoded, original_size=original_size, size=size, mime_type=mime_type
+    )
+
+
+def _check_input_format(buffer: PooledBuffer) -> None:
+    """根据已读取内容的文件头检查输入图像格式"""
+    mime_type = sniff_mime(buffer.view()[:SNIFF_BYTES])
+    if mime_type not in SUPPORTED_INPUT_TYPES:
+        raise InputImageError(f"不支持的输入图像格式: {mime_type or '未知'}")
+
+
+def read_image_body(response, max_bytes: int, max_pixels: int) -> tuple[PooledBuffer, str]:
+    """
+    流式读取图像响应体到缓冲池借出的缓冲区（调用方负责归还）
+
+    Args:
+        response: 以 stream=True 发出的 requests 响应
+        max_bytes: 最大下载字节数
+        max_pixels: 最大像素数
+
+    Returns:
+        (缓冲区, 内容的 SHA-256)
+
+    Raises:
+        InputImageError: 超过大小或像素上限、格式不支持
+    """
+    from PIL import Image, ImageFile
+
+    content_length = int(response.headers.get("Content-Length") or 0)
+    if content_length > max_bytes:
+        raise InputImageError(f"输入图像过大: {content_length} 字节，上限为 {max_bytes} 字节")
+
+    buffer = get_buffer_pool().acquire(content_length)
+    digest = hashlib.sha256()
+    # 只用 Parser 解析头部：JPEG/PNG/WebP 不支持增量解码，Parser 会把后续数据反复拼接
+    parser: Optional["ImageFile.Parser"] = ImageFile.Parser()
+    sniffed = False
+    try:
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            if len(buffer) + len(chunk) > max_bytes:
+                raise InputImageError(f"输入图像过大: 超过 {max_bytes} 字节的上限")
+            buffer.write(chunk)
+            digest.update(chunk)
+            # chunked 响应的第一块可能不足文件头长度，累积到足够字节后再判断格式
+            if not sniffed and len(buffer) >= SNIFF_BYTES:
+                _check_input_format(buffer)
+                sniffed = True
+            if parser is not None:
+                try:
+                    parser.feed(chunk)
+                except Image.DecompressionBombError as e:
+                    raise InputImageError(f"输入图像尺寸过大: {e}") from e
+                if parser.image is not None:
+                    width, height = parser.image.size
+                    if width * height > max_pixels:
+                        raise InputImageError(f"输入图像尺寸过大: {width}x{height}，上限为 {max_pixels} 像素")
+                    parser = None
+                elif len(buffer) >= HEADER_PROBE_BYTES:
+                    parser = None
+        if not len(buffer):
+            raise InputImageError("输入图像为空")
+        if not sniffed:
+            _check_input_format(buffer)
+    except BaseException:
+        buffer.release()
+        raise
+    return buffer, digest.hexdigest()
+
+
+class InputImageCache:
+    """按 URL 缓存预处理结果，支持条件 GET 重新验证（线程安全）"""
+
+    def __init__(
+        self,
+        max_entries: int,
+        fresh_seconds: float,
+        max_bytes: int = 20 * 1024 * 1024,
+        max_pixels: int = 40_000_000,
+    ):
+        self.max_entries = max_entries
+        self.fresh_seconds = fresh_seconds
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key: tuple[str, UploadEncoding]) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key: tuple[str, UploadEncoding], entry: _CacheEntry) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _find_by_content(self, content_hash: str, encoding: UploadEncoding) -> Optional[PreparedImage]:
+        with self._lock:
+            for (_, entry_encoding), entry in self._entries.items():
+                if entry.content_hash == content_hash and entry_encoding == encoding:
+                    return entry.prepared
+        return None
+
+    def get(self, url: str, timeout: float = 30, encoding: Optional[UploadEncoding] = None) -> PreparedImage:
+        """
+        获取 URL 对应的预处理结果，必要时下载或重新验证
+
+        同一 URL 按不同的上传编码参数分别缓存。
+
+        Raises:
+            requests.exceptions.RequestException: 下载失败
+            InputImageError: 图像过大或格式不支持
+            PIL.UnidentifiedImageError: 不是有效的图像
+        """
+        encoding = encoding or UploadEncoding()
+        key = (url, encoding)
+        entry = self._lookup(key)
+        now = time.time()
+        if entry is not None and now - entry.validated_at < self.fresh_seconds:
+            self._count(hit=True)
+            return replace(entry.prepared, cache_status="fresh")
+
+        headers = {}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        started = time.perf_counter()
+        response = call_with_retry(
+            lambda: get_session().get(url, headers=headers, timeout=timeout, stream=True),
+            operation="input_image_download",
+        )
+        with response:
+            if response.status_code == 304 and entry is not None:
+                entry.validated_at = now
+                self._count(hit=True)
+                return replace(
+                    entry.prepared, cache_status="revalidated", timings={"download": time.perf_counter() - started}
+                )
+            response.raise_for_status()
+            body, content_hash = read_image_body(response, self.max_bytes, self.max_pixels)
+
+        with body:
+            timings = {"download": time.perf_counter() - started}
+            prepared = self._find_by_content(content_hash, encoding)
+            if prepared is not None:
+                self._count(hit=True)
+                prepared = replace(prepared, cache_status="content")
+            else:
+                self._count(hit=False)
+                started = time.perf_counter()
+                prepared = preprocess_image(
+                    body.view(), max_size=encoding.max_size, quality=encoding.quality,
+                    upload_format=encoding.format, target_bytes=encoding.target_bytes,
+                )
+                timings["preprocess"] = time.perf_counter() - started
+            prepared = replace(prepared, content_hash=content_hash)
+            downloaded_bytes = len(body)
+
+        self._store(key, _CacheEntry(
+            prepared=replace(prepared, cache_status="miss", timings={}, downloaded_bytes=0),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            content_hash=content_hash,
+            validated_at=now,
+        ))
+        return replace(prepared, timings=timings, downloaded_bytes=downloaded_bytes)
+
+    def stats(self) -> dict[str, int]:
+        """返回命中、未命中计数及当前条目数"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+_cache: Optional[InputImageCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_input_image_cache() -> InputImageCache:
+    """获取进程级输入图像缓存"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = InputImageCache(
+                max_entries=env_int("INPUT_IMAGE_CACHE_ENTRIES", 64),
+                fresh_seconds=env_int("INPUT_IMAGE_FRESH_SECONDS", 60),
+                max_bytes=env_int("INPUT_IMAGE_MAX_MB", 20) * 1024 * 1024,
+                max_pixels=env_int("INPUT_IMAGE_MAX_PIXELS", 40_000_000),
+            )
+    return _cache
+
+
+@dataclass
+class InputImageSet:
+    """一次调用的全部输入图像"""
+    # 去重并满足总大小预算后的图像，保持输入顺序
+    images: list[PreparedImage]
+    # 每个 URL 的获取结果（含各阶段耗时，用于记录指标）
+    fetched: list[PreparedImage]
+    # 因内容重复而跳过的图像数
+    duplicates: int = 0
+    # 为满足预算采用的 (最长边, JPEG 质量)，None 表示未调整
+    budget_step: Optional[tuple[int, int]] = None
+    budget_seconds: float = 0.0
+
+    @property
+    def payload_bytes(self) -> int:
+        return sum(len(image.data_url) for image in self.images)
+
+    @property
+    def encoded(self) -> Optional[bytes]:
+        """所有输入图像的编码结果，用作缓存键的一部分；单张图像时与其编码结果相同"""
+        if not self.images:
+            return None
+        return b"".join(image.encoded for image in self.images)
+
+
+def parse_image_urls(*values: str) -> list[str]:
+    """
+    解析输入图像 URL：每行一个（空白分隔），或 JSON 字符串数组；多个参数合并后按顺序去重
+    """
+    urls: list[str] = []
+    for value in values:
+        text = (value or "").strip()
+        if not text:
+            continue
+        if text.startswith("["):
+            try:
+                parsed = json.loads(text)
+            except ValueError:
+                parsed = None
+            if isinstance(parsed, list):
+                urls.extend(str(item).strip() for item in parsed if str(item).strip())
+                continue
+        urls.extend(text.split())
+    return list(dict.fromkeys(urls))
+
+
+def fit_payload_budget(
+    images: list[PreparedImage], budget_bytes: int
+) -> tuple[list[PreparedImage], Optional[tuple[int, int]]]:
+    """
+    所有 data URL 的总大小超过 budget_bytes 时，按 PAYLOAD_BUDGET_STEPS 逐级缩小并重新编码
+
+    每一级都从已预处理的图像出发，在图像线程池中并发编码；最后一级仍然超出时
+    返回该级的结果，交给 API 决定是否接受。
+    """
+    if budget_bytes <= 0 or sum(len(image.data_url) for image in images) <= budget_bytes:
+        return images, None
+
+    formats = {mime_type: name for name, (_, mime_type) in UPLOAD_FORMATS.items()}
+
+    def shrink(image: PreparedImage, max_size: int, quality: int) -> PreparedImage:
+        smaller = preprocess_image(
+            image.encoded, max_size=max_size, quality=quality, reencode=True,
+            upload_format=formats.get(image.mime_type, "jpeg"),
+        )
+        return replace(image, data_url=smaller.data_url, encoded=smaller.encoded, size=smaller.size)
+
+    fitted = images
+    step = None
+    for step in PAYLOAD_BUDGET_STEPS:
+        max_size, quality = step
+        futures = map_ordered(lambda image: shrink(image, max_size, quality), images)
+        fitted = [future.result() for future in futures]
+        if sum(len(image.data_url) for image in fitted) <= budget_bytes:
+            break
+    return fitted, step
+
+
+def prepare_input_images(
+    urls: list[str], timeout: float = 30, budget_bytes: Optional[int] = None,
+    encoding: Optional[UploadEncoding] = None,
+) -> InputImageSet:
+    """
+    并发下载并预处理多张输入图像，按内容哈希去重，并使总大小不超过预算
+
+    任意一张图像失败时抛出该异常（与单张输入图像的行为一致）。
+
+    Args:
+        urls: 输入图像 URL，按附加到请求中的顺序
+        timeout: 单张图像的下载超时（秒）
+        budget_bytes: 所有 data URL 的总大小上限，默认读取 INPUT_PAYLOAD_MAX_MB
+        encoding: 上传编码参数，通常由 upload_encoding_for(model) 得到
+    """
+    if budget_bytes is None:
+        budget_bytes = env_int("INPUT_PAYLOAD_MAX_MB", 8) * 1024 * 1024
+    cache = get_input_image_cache()
+    futures = map_ordered(lambda url: cache.get(url, timeout=timeout, encoding=encoding), urls)
+    fetched = [future.result() for future in futures]
+
+    unique: list[PreparedImage] = []
+    seen: set[str] = set()
+    for prepared in fetched:
+        if prepared.content_hash in seen:
+            continue
+        seen.add(prepared.content_hash)
+        unique.append(prepared)
+
+    started = time.perf_counter()
+    images, step = fit_payload_budget(unique, budget_bytes)
+    return InputImageSet(
+        images=images,
+        fetched=fetched,
+        duplicates=len(fetched) - len(unique),
+        budget_step=step,
+        budget_seconds=time.perf_counter() - started if step else 0.0,
+    )
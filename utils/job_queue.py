@@ -0,0 +1,470 @@
+"""
+持久化的后台生成任务队列
+
+生成时间可能超过插件的单次请求超时（MAX_REQUEST_TIMEOUT）。submit_job
+工具把生成任务写入本地 SQLite 队列后立即返回任务 ID，由进程内的后台工作
+线程执行；job_result 工具按 ID 查询进度并取回生成的图像。
+
+- 每个任务可以包含多个提示词（及变体），每完成一项立即写入数据库，
+  查询时可以看到部分结果；
+- 任务被领取时写入租约，工作进程退出后，租约过期的任务会被重新排队，
+  已完成的条目不会重复生成；插件启动时自动恢复未完成的任务；
+- 为了在重启后继续执行，任务结束前会在数据库中保存提交者的 API Key，
+  任务成功、失败或多次中断被放弃时立即清除；查询结果时按 API Key 的指纹
+  校验任务归属。数据库默认位于当前用户专用的私有目录（权限 0700）中，
+  数据库文件的权限为 0600。
+
+- JOB_QUEUE_DB: SQLite 数据库路径（默认为系统临时目录下 nano_banana-<uid>/jobs.sqlite3）
+- JOB_WORKERS: 后台工作线程数（默认 2）
+- JOB_TIMEOUT: 任务中单次生成的超时时间（默认 300 秒）
+- JOB_MAX_ATTEMPTS: 任务被中断后的最多尝试次数（默认 3）
+- JOB_RETENTION_HOURS: 已结束任务及其图像的保留时间（默认 24 小时）
+"""
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional
+
+from utils.async_client import run_sync
+from utils.batch import BatchItem, build_batch_items, run_batch
+from utils.config import env_int, env_str
+from utils.credentials import key_fingerprint
+from utils.generation import GenerationResult, build_payload, generate_async, generate_with_fallback
+from utils.input_images import parse_image_urls, prepare_input_images, upload_encoding_for
+from utils.metrics import Trace
+from utils.private_files import private_dir, secure_db_file
+from utils.result_cache import CachedBlob
+from utils.usage_ledger import UsageRecord, get_usage_ledger
+
+logger = logging.getLogger("nano_banana.jobs")
+
+# 任务状态
+QUEUED, RUNNING, SUCCEEDED, PARTIAL, FAILED = "queued", "running", "succeeded", "partial", "failed"
+FINISHED_STATUSES = (SUCCEEDED, PARTIAL, FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    api_key TEXT,
+    owner TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    lease_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    item INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    model TEXT,
+    error TEXT,
+    usage TEXT,
+    PRIMARY KEY (job_id, item)
+);
+CREATE TABLE IF NOT EXISTS job_outputs (
+    job_id TEXT NOT NULL,
+    item INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    mime_type TEXT NOT NULL,
+    blob BLOB NOT NULL,
+    PRIMARY KEY (job_id, item, seq)
+);
+"""
+
+
+@dataclass
+class JobSpec:
+    """一个生成任务的参数"""
+    prompts: list[str]
+    model: str
+    variations: int = 1
+    fallback_models: list[str] = field(default_factory=list)
+    hedge_after: float = 0.0
+    input_image_url: str = ""
+    input_image_urls: list[str] = field(default_factory=list)
+    output_format: str = "png"
+    quality: int = 90
+    concurrency: int = 4
+    # 提交任务的工作流（Dify 应用 ID），用于用量台账
+    workflow: str = ""
+
+    def items(self) -> list[BatchItem]:
+        return build_batch_items(self.prompts, self.variations)
+
+
+@dataclass
+class JobStatus:
+    """任务的当前状态（不含图像数据）"""
+    id: str
+    status: str
+    total: int
+    completed: int
+    failed: int
+    attempts: int
+    created_at: float
+    started_at: Optional[float]
+    finished_at: Optional[float]
+    error: Optional[str]
+    errors: list[str]
+    usage: dict[str, Any]
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+def default_db_path() -> str:
+    return os.path.join(private_dir(), "jobs.sqlite3")
+
+
+class JobQueue:
+    """基于 SQLite 的任务队列和后台工作线程池（线程安全，可被多个进程共享）"""
+
+    def __init__(
+        self,
+        path: str,
+        workers: int = 2,
+        timeout: float = 300,
+        max_attempts: int = 3,
+        retention_seconds: float = 24 * 3600,
+    ):
+        self.path = path
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.retention_seconds = retention_seconds
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+        # 数据库中保存着未完成任务的 API Key，只允许当前用户读写
+        secure_db_file(path)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    @property
+    def lease_seconds(self) -> float:
+        """租约时长：两倍单次生成超时，每完成一个条目续约一次"""
+        return self.timeout * 2
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- 提交与查询 ----
+
+    def submit(self, api_key: str, spec: JobSpec) -> str:
+        """写入一个新任务并唤醒工作线程，返回任务 ID"""
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, spec, api_key, owner, total, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(asdict(spec), ensure_ascii=False), api_key,
+                 key_fingerprint(api_key), len(spec.items()), time.time()),
+            )
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def status(self, job_id: str, api_key: Optional[str] = None) -> Optional[JobStatus]:
+        """
+        查询任务状态
+
+        Args:
+            api_key: 指定时只返回该 key 提交的任务
+        """
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT id, status, owner, total, attempts, created_at, started_at, finished_at, error "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None or (api_key is not None and row[2] != key_fingerprint(api_key)):
+            return None
+        completed, failed, errors, usage = 0, 0, [], {}
+        for item, status, error, item_usage in conn.execute(
+            "SELECT item, status, error, usage FROM job_items WHERE job_id = ? ORDER BY item", (job_id,)
+        ):
+            if status == "ok":
+                completed += 1
+            else:
+                failed += 1
+                errors.append(f"[{item + 1}] {error}")
+            for name, value in json.loads(item_usage or "{}").items():
+                if isinstance(value, (int, float)):
+                    usage[name] = usage.get(name, 0) + value
+        return JobStatus(
+            id=row[0], status=row[1], total=row[3], completed=completed, failed=failed, attempts=row[4],
+            created_at=row[5], started_at=row[6], finished_at=row[7], error=row[8], errors=errors, usage=usage,
+        )
+
+    def outputs(self, job_id: str) -> list[CachedBlob]:
+        """按条目顺序返回任务已生成的图像"""
+        rows = self._connect().execute(
+            "SELECT mime_type, blob FROM job_outputs WHERE job_id = ? ORDER BY item, seq", (job_id,)
+        ).fetchall()
+        return [CachedBlob(blob=bytes(blob), mime_type=mime_type) for mime_type, blob in rows]
+
+    def wait(self, job_id: str, timeout: float, api_key: Optional[str] = None) -> Optional[JobStatus]:
+        """等待任务结束，最多等待 timeout 秒，返回最新状态"""
+        deadline = time.monotonic() + timeout
+        while True:
+            status = self.status(job_id, api_key)
+            if status is None or status.finished or time.monotonic() >= deadline:
+                return status
+            time.sleep(min(0.5, max(deadline - time.monotonic(), 0)))
+
+    def pending(self) -> int:
+        """排队中和执行中的任务数"""
+        row = self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+        ).fetchone()
+        return row[0]
+
+    # ---- 工作线程 ----
+
+    def start(self) -> None:
+        """启动后台工作线程（重复调用无效）"""
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(
+                    target=self._worker_loop,
+                    name=f"nano-banana-job-{len(self._threads)}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """通知工作线程在当前任务结束后退出"""
+        self._stopping.set()
+        self._wakeup.set()
+        with self._lock:
+            threads = list(self._threads)
+            self._threads = []
+        for thread in threads:
+            thread.join(timeout)
+        self._stopping.clear()
+
+    def _worker_loop(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                claimed = self._claim()
+                if claimed is None:
+                    self._purge()
+                    # 其他进程也可能写入任务，因此定期轮询
+                    self._wakeup.wait(2)
+                    self._wakeup.clear()
+                    continue
+                self._run(*claimed)
+            except Exception:
+                logger.exception("后台任务执行失败")
+                time.sleep(1)
+
+    def _claim(self) -> Optional[tuple[str, JobSpec, str]]:
+        """领取一个排队中（或租约已过期）的任务"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # 多次中断的任务不再重试
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, api_key = NULL, finished_at = ? "
+                "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, "任务多次中断，已放弃", now, RUNNING, now, self.max_attempts),
+            )
+            row = conn.execute(
+                "SELECT id, spec, api_key FROM jobs "
+                "WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY created_at LIMIT 1",
+                (QUEUED, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, "
+                    "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                    (RUNNING, now + self.lease_seconds, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        try:
+            spec = JobSpec(**json.loads(row[1]))
+        except (TypeError, ValueError) as e:
+            self._finish(row[0], FAILED, f"任务参数无效: {e}")
+            return None
+        return row[0], spec, row[2]
+
+    def _run(self, job_id: str, spec: JobSpec, api_key: str) -> None:
+        """执行任务中尚未完成的条目，结束后写入最终状态"""
+        conn = self._connect()
+        done = {item for (item,) in conn.execute("SELECT item FROM job_items WHERE job_id = ?", (job_id,))}
+        items = [item for item in spec.items() if item.index not in done]
+        trace = Trace(operation="job", model=spec.model, mode="job")
+
+        try:
+            extra_content = []
+            input_image_urls = parse_image_urls(spec.input_image_url, *spec.input_image_urls)
+            if input_image_urls:
+                image_set = prepare_input_images(
+                    input_image_urls, timeout=30, encoding=upload_encoding_for(spec.model)
+                )
+                extra_content = [
+                    {"type": "image_url", "image_url": {"url": prepared.data_url}} for prepared in image_set.images
+                ]
+
+            async def worker(item: BatchItem) -> GenerationResult:
+                content = [{"type": "text", "text": item.prompt}] + extra_content
+                options = {"output_format": spec.output_format, "quality": spec.quality}
+                if spec.fallback_models:
+                    return await generate_with_fallback(
+                        api_key, [spec.model] + spec.fallback_models, content, hedge_after=spec.hedge_after,
+                        timeout=self.timeout, trace=trace, **options,
+                    )
+                return await generate_async(
+                    api_key, build_payload(spec.model, content), timeout=self.timeout, trace=trace, **options
+                )
+
+            ledger = get_usage_ledger()
+            owner = key_fingerprint(api_key)
+
+            async def run_all() -> None:
+                async for done_item in run_batch(items, worker, spec.concurrency):
+                    # 数据库写入放到线程池中，不阻塞共享的事件循环
+                    await asyncio.to_thread(
+                        self._record_item, job_id, done_item.item.index, done_item.result, done_item.error
+                    )
+                    result = done_item.result
+                    if ledger is not None and result is not None and result.usage:
+                        ledger.record(UsageRecord.from_usage(
+                            owner, result.model or spec.model, result.usage, images=len(result.blobs),
+                            workflow=spec.workflow, mode="job",
+                        ))
+
+            run_sync(run_all())
+        except Exception as e:
+            self._finish(job_id, FAILED, str(e) or type(e).__name__)
+            trace.finish("error")
+            return
+
+        status = self.status(job_id)
+        if status.completed == status.total:
+            final = SUCCEEDED
+        elif status.completed:
+            final = PARTIAL
+        else:
+            final = FAILED
+        self._finish(job_id, final, None if final != FAILED else "所有条目都没有生成图像")
+        trace.labels["batch_size"] = status.total
+        trace.finish("ok" if final == SUCCEEDED else final)
+
+    def _record_item(
+        self, job_id: str, index: int, result: Optional[GenerationResult], error: Optional[str]
+    ) -> None:
+        """写入一个条目的结果并续约"""
+        ok = error is None and result is not None and bool(result.blobs)
+        if not ok and error is None:
+            error = "；".join(result.errors) if result is not None and result.errors else "没有生成图像数据"
+        conn = self._connect()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT OR REPLACE INTO job_items (job_id, item, status, model, error, usage) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, index, "ok" if ok else "failed", result.model if result else None, error,
+                 json.dumps(result.usage if result else {})),
+            )
+            if ok:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO job_outputs (job_id, item, seq, mime_type, blob) VALUES (?, ?, ?, ?, ?)",
+                    [(job_id, index, seq, blob.mime_type, blob.blob) for seq, blob in enumerate(result.blobs)],
+                )
+            conn.execute("UPDATE jobs SET lease_until = ? WHERE id = ?", (time.time() + self.lease_seconds, job_id))
+
+    def _finish(self, job_id: str, status: str, error: Optional[str]) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, api_key = NULL, finished_at = ?, lease_until = NULL WHERE id = ?",
+                (status, error, time.time(), job_id),
+            )
+
+    def _purge(self) -> None:
+        """删除超过保留时间的已结束任务"""
+        cutoff = time.time() - self.retention_seconds
+        conn = self._connect()
+        # 已结束的任务不应再保存 API Key（兼容旧版本写入的数据）
+        conn.execute(
+            "UPDATE jobs SET api_key = NULL WHERE status IN (?, ?, ?) AND api_key IS NOT NULL", FINISHED_STATUSES
+        )
+        expired = [job_id for (job_id,) in conn.execute(
+            "SELECT id FROM jobs WHERE status IN (?, ?, ?) AND finished_at < ?", FINISHED_STATUSES + (cutoff,)
+        )]
+        if not expired:
+            return
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for table, column in (("job_outputs", "job_id"), ("job_items", "job_id"), ("jobs", "id")):
+                conn.executemany(f"DELETE FROM {table} WHERE {column} = ?", [(job_id,) for job_id in expired])
+
+
+_queue: Optional[JobQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """获取进程级任务队列（首次调用时创建数据库）"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue(
+                path=env_str("JOB_QUEUE_DB", "") or default_db_path(),
+                workers=env_int("JOB_WORKERS", 2),
+                timeout=env_int("JOB_TIMEOUT", 300),
+                max_attempts=env_int("JOB_MAX_ATTEMPTS", 3),
+                retention_seconds=env_int("JOB_RETENTION_HOURS", 24) * 3600,
+            )
+    return _queue
+
+
+def resume_pending_jobs() -> int:
+    """
+    插件启动时调用：数据库中有未完成的任务时启动工作线程
+
+    Returns:
+        未完成的任务数；数据库不存在时不创建，返回 0
+    """
+    path = env_str("JOB_QUEUE_DB", "") or default_db_path()
+    if not os.path.exists(path):
+        return 0
+    queue = get_job_queue()
+    pending = queue.pending()
+    if pending:
+        queue.start()
+    return pending
@@ -0,0 +1,343 @@
+"""
+生成流程的分阶段耗时与字节数统计
+
+每次工具调用创建一个 Trace，各阶段（输入图像下载、预处理、OpenRouter
+请求、Base64 解码、图像下载、格式转换）的耗时、字节数和状态记录为
+span。调用结束时汇总到进程级的 MetricsRegistry，并按配置导出：
+
+- Prometheus 文本格式：prometheus_text()；设置 METRICS_PROM_FILE 时每次调用
+  结束后原子地写入该文件，可由 node_exporter 的 textfile collector 采集
+- JSON 日志：METRICS_LOG=true 时每次调用输出一行 JSON（logger 为
+  nano_banana.metrics）
+- JSON 快照：metrics_json()；设置 METRICS_JSON_FILE 时每次调用结束后原子地
+  写入该文件
+
+除了调用和各阶段的直方图，导出内容还包括各组件的运行状态（component_stats()）：
+连接池、重试、模型回退/对冲、限流排队、结果缓存、输入图像缓存、凭据缓存、
+缓冲池和请求合并。
+- OpenTelemetry：METRICS_OTEL=true 且安装了 opentelemetry-api 时，
+  每次调用生成一个根 span，各阶段作为子 span
+
+DEBUG=true 时才在返回给用户的消息中包含调试信息。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from utils.config import env_bool, env_str
+
+logger = logging.getLogger("nano_banana.metrics")
+
+# 耗时直方图的桶边界（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# 组件统计中表示当前状态的字段，导出为 gauge；其余字段是累计值，导出为 counter
+GAUGE_STATS = frozenset({
+    "idle_connections", "queue_depth", "local_waiting", "max_wait", "entries", "bytes",
+    "pooled_buffers", "pooled_bytes", "in_use_bytes", "peak_in_use_bytes", "in_flight",
+    "p50_seconds", "p95_seconds",
+})
+
+
+def debug_messages_enabled() -> bool:
+    """是否在用户可见的消息中输出调试信息（DEBUG，默认 false）"""
+    return env_bool("DEBUG", False)
+
+
+class _Histogram:
+    """累积直方图，格式与 Prometheus histogram 一致"""
+
+    def __init__(self) -> None:
+        self.counts = [0] * len(DURATION_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    parts = []
+    for name, value in labels:
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def component_stats() -> dict[str, dict[str, Any]]:
+    """
+    收集各组件的统计
+
+    按维度区分的组件（连接池按主机、重试按操作、回退按模型、限流按令牌桶）返回
+    {"label": 维度名, "series": {维度值: 统计}}，其余组件返回 {"stats": 统计}。
+    只读取已经创建的实例，不会因为导出指标而创建缓存目录等资源。
+    """
+    # 延迟导入：这些模块（间接）依赖本模块
+    import utils.buffer_pool as buffer_pool
+    import utils.credentials as credentials
+    import utils.generation as generation
+    import utils.input_images as input_images
+    import utils.rate_limit as rate_limit
+    import utils.result_cache as result_cache
+    from utils.fallback import model_routing_stats
+    from utils.http_pool import pool_stats
+    from utils.retry import retry_metrics
+
+    components: dict[str, dict[str, Any]] = {
+        "http_pool": {"label": "host", "series": pool_stats()},
+        "retry": {"label": "operation", "series": retry_metrics()},
+        "model_routing": {"label": "model", "series": model_routing_stats()},
+        "coalescing": {"stats": generation._generation_flight.stats()},
+    }
+    if rate_limit._limiter is not None:
+        components["rate_limit"] = {"label": "bucket", "series": rate_limit._limiter.stats()}
+    for name, instance in (
+        ("result_cache", result_cache._cache),
+        ("input_image_cache", input_images._cache),
+        ("credential_cache", credentials._validator),
+        ("buffer_pool", buffer_pool._pool),
+    ):
+        if instance is not None:
+            components[name] = {"stats": instance.stats()}
+    return components
+
+
+def _format_value(value: Any) -> str:
+    return str(value) if isinstance(value, int) else f"{float(value):.6f}"
+
+
+class MetricsRegistry:
+    """进程级指标汇总（线程安全）"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._stage_durations: dict[tuple, _Histogram] = {}
+        self._stage_bytes: dict[tuple, int] = {}
+        self._call_durations: dict[tuple, _Histogram] = {}
+
+    def record(self, summary: dict[str, Any]) -> None:
+        """记录一次调用的汇总（Trace.finish() 的返回值）"""
+        model = summary.get("model", "")
+        with self._lock:
+            call_key = (("model", model), ("status", summary["status"]))
+            self._call_durations.setdefault(call_key, _Histogram()).observe(summary["duration_ms"] / 1000)
+            for span in summary["stages"]:
+                key = (("stage", span["stage"]), ("model", model), ("status", span["status"]))
+                self._stage_durations.setdefault(key, _Histogram()).observe(span["ms"] / 1000)
+                if span.get("bytes"):
+                    bytes_key = (("stage", span["stage"]), ("model", model))
+                    self._stage_bytes[bytes_key] = self._stage_bytes.get(bytes_key, 0) + span["bytes"]
+
+    def prometheus_text(self) -> str:
+        """导出 Prometheus 文本格式"""
+        lines: list[str] = []
+
+        def histogram(name: str, help_text: str, series: dict[tuple, _Histogram]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in sorted(series.items()):
+                for bound, count in zip(DURATION_BUCKETS, hist.counts):
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {hist.count}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {hist.sum:.6f}")
+                lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+
+        with self._lock:
+            histogram("nano_banana_call_duration_seconds", "Total duration of tool invocations.", self._call_durations)
+            histogram("nano_banana_stage_duration_seconds", "Duration of each generation stage.", self._stage_durations)
+            lines.append("# HELP nano_banana_stage_bytes_total Bytes processed by each generation stage.")
+            lines.append("# TYPE nano_banana_stage_bytes_total counter")
+            for labels, value in sorted(self._stage_bytes.items()):
+                lines.append(f"nano_banana_stage_bytes_total{_format_labels(labels)} {value}")
+
+        # 组件统计：每个字段一个指标，按维度区分的组件带上维度标签
+        series: dict[str, list[tuple[tuple, Any]]] = {}
+        for component, data in sorted(component_stats().items()):
+            if "series" in data:
+                rows = [(((data["label"], key),), stats) for key, stats in sorted(data["series"].items())]
+            else:
+                rows = [((), data["stats"])]
+            for labels, stats in rows:
+                for stat, value in stats.items():
+                    if not isinstance(value, (int, float)):
+                        continue
+                    kind = "gauge" if stat in GAUGE_STATS else "counter"
+                    name = f"nano_banana_{component}_{stat}" + ("_total" if kind == "counter" else "")
+                    series.setdefault(f"{name} {kind}", []).append((labels, value))
+        for key, values in series.items():
+            name, kind = key.split(" ")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in values:
+                lines.append(f"{name}{_format_labels(labels) if labels else ''} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def json_snapshot(self) -> dict[str, Any]:
+        """导出调用与阶段的计数、总耗时、字节数以及各组件统计"""
+        def flatten(histograms: dict[tuple, _Histogram]) -> list[dict[str, Any]]:
+            return [
+                {**dict(labels), "count": hist.count, "seconds": round(hist.sum, 6)}
+                for labels, hist in sorted(histograms.items())
+            ]
+
+        with self._lock:
+            snapshot = {
+                "calls": flatten(self._call_durations),
+                "stages": flatten(self._stage_durations),
+                "stage_bytes": [
+                    {**dict(labels), "bytes": value} for labels, value in sorted(self._stage_bytes.items())
+                ],
+            }
+        snapshot["components"] = component_stats()
+        return snapshot
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """获取进程级指标汇总"""
+    return _registry
+
+
+def metrics_json() -> str:
+    """导出 JSON 格式的指标快照"""
+    return json.dumps(_registry.json_snapshot(), ensure_ascii=False, sort_keys=True)
+
+
+def _write_prom_file(path: str, text: str) -> None:
+    """先写临时文件再替换，避免采集方读到写了一半的文件"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".nano_banana_metrics.")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _otel_tracer():
+    """启用 METRICS_OTEL 且安装了 opentelemetry-api 时返回 tracer"""
+    if not env_bool("METRICS_OTEL", False):
+        return None
+    try:
+        from opentelemetry import trace as otel_trace
+    except ImportError:
+        return None
+    return otel_trace.get_tracer("nano_banana")
+
+
+class Trace:
+    """一次工具调用的分阶段计时（线程安全，span 可以在线程池中记录）"""
+
+    def __init__(self, operation: str = "text2image", **labels: Any):
+        self.operation = operation
+        self.labels: dict[str, Any] = dict(labels)
+        self.status = "error"
+        self.spans: list[dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._started_ns = time.time_ns()
+        self._finished: Optional[dict[str, Any]] = None
+
+    def add(self, stage: str, seconds: float, nbytes: int = 0, status: str = "ok", **attrs: Any) -> None:
+        """记录一个已经完成的阶段"""
+        end_ns = time.time_ns()
+        span = {"stage": stage, "ms": round(seconds * 1000, 3), "status": status, **attrs}
+        if nbytes:
+            span["bytes"] = nbytes
+        span["_start_ns"] = end_ns - int(seconds * 1e9)
+        span["_end_ns"] = end_ns
+        with self._lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, stage: str, **attrs: Any) -> Iterator[dict[str, Any]]:
+        """
+        计时一个阶段
+
+        调用方可以在 with 块内向返回的字典写入 bytes 等属性；
+        块内抛出异常时该阶段状态记为 error，被取消时记为 cancelled。
+        """
+        extra: dict[str, Any] = dict(attrs)
+        status = "ok"
+        started = time.perf_counter()
+        try:
+            yield extra
+        except (asyncio.CancelledError, GeneratorExit):
+            status = "cancelled"
+            raise
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            nbytes = extra.pop("bytes", 0)
+            self.add(stage, time.perf_counter() - started, nbytes=nbytes, status=status, **extra)
+
+    def finish(self, status: Optional[str] = None) -> dict[str, Any]:
+        """结束计时并导出指标，重复调用时返回第一次的汇总"""
+        if self._finished is not None:
+            return self._finished
+        if status is not None:
+            self.status = status
+        with self._lock:
+            spans = list(self.spans)
+        summary = {
+            "operation": self.operation,
+            "status": self.status,
+            "duration_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            **self.labels,
+            "stages": [{k: v for k, v in span.items() if not k.startswith("_")} for span in spans],
+        }
+        self._finished = summary
+
+        _registry.record(summary)
+        if env_bool("METRICS_LOG", False):
+            logger.info(json.dumps(summary, ensure_ascii=False))
+        prom_file = env_str("METRICS_PROM_FILE", "")
+        if prom_file:
+            try:
+                _write_prom_file(prom_file, _registry.prometheus_text())
+            except OSError as e:
+                logger.warning("写入指标文件失败: %s", e)
+        json_file = env_str("METRICS_JSON_FILE", "")
+        if json_file:
+            try:
+                _write_prom_file(json_file, metrics_json())
+            except OSError as e:
+                logger.warning("写入指标文件失败: %s", e)
+        tracer = _otel_tracer()
+        if tracer is not None:
+            self._export_otel(tracer, spans)
+        return summary
+
+    def _export_otel(self, tracer, spans: list[dict[str, Any]]) -> None:
+        from opentelemetry import trace as otel_trace
+
+        root = tracer.start_span(self.operation, start_time=self._started_ns)
+        root.set_attribute("status", self.status)
+        for name, value in self.labels.items():
+            if isinstance(value, (str, int, float, bool)):
+                root.set_attribute(name, value)
+        context = otel_trace.set_span_in_context(root)
+        for span in spans:
+            child = tracer.start_span(span["stage"], context=context, start_time=span["_start_ns"])
+            for name, value in span.items():
+                if not name.startswith("_") and isinstance(value, (str, int, float, bool)):
+                    child.set_attribute(name, value)
+            child.end(end_time=span["_end_ns"])
+        root.end()
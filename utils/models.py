@@ -0,0 +1,9 @@
+"""
+模型相关的常量
+
+生成工具和任务提交工具共用，单独放在不依赖其他模块的轻量模块中，
+导入时不会加载生成工具及其依赖。
+"""
+
+# 未指定 model 参数时使用的模型
+DEFAULT_MODEL = "google/gemini-2.5-flash-image-preview"
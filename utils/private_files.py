@@ -0,0 +1,44 @@
+"""
+当前用户私有的本地文件
+
+任务队列、用量台账和结果缓存会把 API Key、费用或生成的图像写入本地磁盘。
+默认位置在系统临时目录中当前用户专用的目录（权限 0700）下，文件权限为
+0600，避免同一台机器上的其他用户读取。
+"""
+
+import os
+import stat
+import tempfile
+
+
+def private_dir(*parts: str) -> str:
+    """
+    系统临时目录下当前用户专用的目录（权限 0700），parts 为其中的子目录
+
+    Raises:
+        RuntimeError: 目录已存在但属于其他用户或是符号链接
+    """
+    uid = os.getuid() if hasattr(os, "getuid") else None
+    directory = os.path.join(tempfile.gettempdir(), "nano_banana" if uid is None else f"nano_banana-{uid}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if uid is not None:
+        if stat.S_ISLNK(info.st_mode) or info.st_uid != uid:
+            raise RuntimeError(f"私有目录 {directory} 不属于当前用户，拒绝使用")
+        if stat.S_IMODE(info.st_mode) != 0o700:
+            os.chmod(directory, 0o700)
+    if parts:
+        directory = os.path.join(directory, *parts)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    return directory
+
+
+def secure_db_file(path: str) -> None:
+    """以 0600 权限创建 SQLite 数据库文件；已存在的数据库文件（及 WAL 文件）收紧为 0600"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+    for name in (path, f"{path}-wal", f"{path}-shm"):
+        try:
+            os.chmod(name, 0o600)
+        except OSError:
+            pass
@@ -0,0 +1,280 @@
+"""
+客户端令牌桶限流
+
+多个插件 worker 共用一个 OpenRouter key 时，需要在客户端协调请求速率，
+否则会一起触发 429。这里为每个 API key（以及可选的每个 key + 模型）
+维护一个令牌桶，采用 "预约" 方式取令牌：在锁内补充令牌并扣减一个
+（允许为负），负数部分换算成需要等待的时间。调用方按获取锁的先后顺序
+排队，天然是公平的 FIFO 队列，且等待期间不需要轮询。
+
+令牌桶状态可以保存在进程内存中，也可以保存在本地文件中并用文件锁保护，
+这样同一台机器上的多个进程共享同一份额度。
+
+- RATE_LIMIT_ENABLED: 是否启用（默认 false）
+- RATE_LIMIT_KEY_RPM: 每个 API key 每分钟的请求数（默认 20，0 表示不限制）
+- RATE_LIMIT_MODEL_RPM: 每个 key + 模型每分钟的请求数（默认 0，不限制）
+- RATE_LIMIT_BURST: 允许的突发请求数（默认 5）
+- RATE_LIMIT_MAX_WAIT: 最长排队时间，超过则放弃（默认 60 秒）
+- RATE_LIMIT_BACKEND: memory 或 file（默认 memory）
+- RATE_LIMIT_DIR: file 后端的状态目录（默认系统临时目录下的 nano_banana/ratelimit）
+"""
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from utils.config import env_bool, env_float, env_int, env_str
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl，只能使用内存后端
+    fcntl = None
+
+
+class RateLimitExceeded(Exception):
+    """排队时间超过上限"""
+
+
+@dataclass
+class BucketConfig:
+    """令牌桶参数"""
+    rate: float   # 每秒补充的令牌数
+    burst: float  # 桶容量
+
+
+@dataclass
+class _BucketStats:
+    waits: int = 0
+    wait_seconds: float = 0.0
+    max_wait: float = 0.0
+    rejected: int = 0
+
+
+def _refill(tokens: float, updated: float, now: float, config: BucketConfig) -> float:
+    return min(config.burst, tokens + (now - updated) * config.rate)
+
+
+class MemoryBucketStore:
+    """进程内的令牌桶状态"""
+
+    blocking = False
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._state: dict[str, tuple[float, float]] = {}
+
+    def reserve(self, bucket: str, config: BucketConfig, now: float) -> tuple[float, float]:
+        """预约一个令牌，返回 (需要等待的秒数, 预约后的令牌数)"""
+        with self._lock:
+            tokens, updated = self._state.get(bucket, (config.burst, now))
+            tokens = _refill(tokens, updated, now, config) - 1
+            self._state[bucket] = (tokens, now)
+        return max(0.0, -tokens / config.rate), tokens
+
+    def cancel(self, bucket: str) -> None:
+        """归还一个已预约的令牌"""
+        with self._lock:
+            tokens, updated = self._state[bucket]
+            self._state[bucket] = (tokens + 1, updated)
+
+    def tokens(self, bucket: str, config: BucketConfig, now: float) -> float:
+        with self._lock:
+            tokens, updated = self._state.get(bucket, (config.burst, now))
+        return _refill(tokens, updated, now, config)
+
+
+class FileBucketStore:
+    """保存在本地文件中的令牌桶状态，同一主机的多个进程共享"""
+
+    # 预约时持有文件锁并读写文件，异步调用方需要放到线程中执行
+    blocking = True
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _update(self, bucket: str, config: Optional[BucketConfig], now: float, delta: float) -> float:
+        """在文件锁内更新令牌数；config 为 None 时只加减令牌，不做补充"""
+        path = os.path.join(self.directory, f"{bucket}.json")
+        with open(path, "a+", encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    state = json.loads(f.read() or "{}")
+                except ValueError:
+                    state = {}
+                if config is None:
+                    tokens = state.get("tokens", 0.0) + delta
+                    updated = state.get("updated", now)
+                else:
+                    tokens = _refill(state.get("tokens", config.burst), state.get("updated", now), now, config)
+                    tokens += delta
+                    updated = now
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"tokens": tokens, "updated": updated}))
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return tokens
+
+    def reserve(self, bucket: str, config: BucketConfig, now: float) -> tuple[float, float]:
+        tokens = self._update(bucket, config, now, -1)
+        return max(0.0, -tokens / config.rate), tokens
+
+    def cancel(self, bucket: str) -> None:
+        self._update(bucket, None, time.time(), 1)
+
+    def tokens(self, bucket: str, config: BucketConfig, now: float) -> float:
+        return self._update(bucket, config, now, 0)
+
+
+class RateLimiter:
+    """按 API key 和模型限流的调度器"""
+
+    def __init__(
+        self,
+        store,
+        key_config: Optional[BucketConfig],
+        model_config: Optional[BucketConfig] = None,
+        max_wait: float = 60.0,
+    ) -> None:
+        self.store = store
+        self.key_config = key_config
+        self.model_config = model_config
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._stats: dict[str, _BucketStats] = {}
+        self._waiting: dict[str, int] = {}
+
+    def _buckets(self, api_key: str, model: str) -> list[tuple[str, BucketConfig]]:
+        key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        buckets = []
+        if self.key_config is not None:
+            buckets.append((f"key-{key_hash}", self.key_config))
+        if self.model_config is not None:
+            model_hash = hashlib.sha256(model.encode("utf-8")).hexdigest()[:16]
+            buckets.append((f"model-{key_hash}-{model_hash}", self.model_config))
+        return buckets
+
+    def _reserve(self, api_key: str, model: str) -> tuple[float, list[str]]:
+        """在所有相关的桶中预约令牌，返回需要等待的时间"""
+        now = time.time()
+        buckets = self._buckets(api_key, model)
+        wait = 0.0
+        for name, config in buckets:
+            bucket_wait, _ = self.store.reserve(name, config, now)
+            wait = max(wait, bucket_wait)
+        names = [name for name, _ in buckets]
+
+        if wait > self.max_wait:
+            for name in names:
+                self.store.cancel(name)
+            with self._lock:
+                for name in names:
+                    self._stats.setdefault(name, _BucketStats()).rejected += 1
+            raise RateLimitExceeded(f"本地限流排队时间 {wait:.1f}s 超过上限 {self.max_wait:.0f}s")
+
+        with self._lock:
+            for name in names:
+                stats = self._stats.setdefault(name, _BucketStats())
+                stats.waits += 1
+                stats.wait_seconds += wait
+                stats.max_wait = max(stats.max_wait, wait)
+                self._waiting[name] = self._waiting.get(name, 0) + 1
+        return wait, names
+
+    def _release(self, names: list[str]) -> None:
+        with self._lock:
+            for name in names:
+                self._waiting[name] -= 1
+
+    def acquire(self, api_key: str, model: str) -> float:
+        """
+        等待直到可以发送请求
+
+        Returns:
+            实际等待的秒数
+
+        Raises:
+            RateLimitExceeded: 需要等待的时间超过 max_wait
+        """
+        wait, names = self._reserve(api_key, model)
+        try:
+            if wait > 0:
+                time.sleep(wait)
+        finally:
+            self._release(names)
+        return wait
+
+    async def acquire_async(self, api_key: str, model: str) -> float:
+        """acquire() 的异步版本"""
+        if self.store.blocking:
+            wait, names = await asyncio.to_thread(self._reserve, api_key, model)
+        else:
+            wait, names = self._reserve(api_key, model)
+        try:
+            if wait > 0:
+                await asyncio.sleep(wait)
+        finally:
+            self._release(names)
+        return wait
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        返回每个桶的统计
+
+        queue_depth 是所有共享该桶的调用方中已预约但尚未轮到的请求数，
+        local_waiting 是本进程中正在等待的请求数。
+        """
+        now = time.time()
+        result = {}
+        with self._lock:
+            items = [(name, vars(stats).copy(), self._waiting.get(name, 0)) for name, stats in self._stats.items()]
+        for name, stats, waiting in items:
+            config = self.key_config if name.startswith("key-") else self.model_config
+            tokens = self.store.tokens(name, config, now)
+            stats["queue_depth"] = max(0, math.ceil(-tokens))
+            stats["local_waiting"] = waiting
+            result[name] = stats
+        return result
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """获取进程级限流器，未启用时返回 None"""
+    global _limiter
+    if not env_bool("RATE_LIMIT_ENABLED", False):
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            burst = max(1, env_int("RATE_LIMIT_BURST", 5))
+            key_rpm = env_float("RATE_LIMIT_KEY_RPM", 20)
+            model_rpm = env_float("RATE_LIMIT_MODEL_RPM", 0)
+            if key_rpm <= 0 and model_rpm <= 0:
+                return None
+            if env_str("RATE_LIMIT_BACKEND", "memory") == "file" and fcntl is not None:
+                store = FileBucketStore(env_str(
+                    "RATE_LIMIT_DIR",
+                    os.path.join(tempfile.gettempdir(), "nano_banana", "ratelimit"),
+                ))
+            else:
+                store = MemoryBucketStore()
+            _limiter = RateLimiter(
+                store=store,
+                key_config=BucketConfig(rate=key_rpm / 60, burst=burst) if key_rpm > 0 else None,
+                model_config=BucketConfig(rate=model_rpm / 60, burst=burst) if model_rpm > 0 else None,
+                max_wait=env_float("RATE_LIMIT_MAX_WAIT", 60),
+            )
+    return _limiter
@@ -0,0 +1,121 @@
+"""
+生成图像的派生版本（缩略图、WebP/JPEG 等）
+
+工作流的下游节点常把生成的图像再缩放成预览图或转成适合网页的格式，
+每个节点都要重新解码一次。这里把图像只解码一次，再在图像线程池中
+并发地缩放和编码各个派生版本，与原图一起返回。
+
+派生版本的写法（逗号或换行分隔）：
+
+- 256：最长边缩小到 256 的缩略图，格式与原图相同
+- webp：原尺寸的 WebP
+- jpeg:1024：最长边缩小到 1024 的 JPEG
+
+不会放大图像；与原图尺寸、格式都相同的派生版本会被跳过。
+"""
+
+from dataclasses import dataclass
+from io import BytesIO
+
+from utils.buffer_pool import get_buffer_pool
+from utils.images import OUTPUT_FORMATS, map_ordered, sniff_mime
+
+# 派生版本最长边的下限
+MIN_RENDITION_SIZE = 16
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """一个派生版本的参数"""
+    format: str = "original"  # original / png / jpeg / webp
+    max_size: int = 0  # 0 表示保持原尺寸
+    quality: int = 90
+
+    @property
+    def name(self) -> str:
+        if not self.max_size:
+            return self.format
+        if self.format == "original":
+            return str(self.max_size)
+        return f"{self.format}:{self.max_size}"
+
+
+@dataclass
+class RenderedImage:
+    """编码完成的派生版本"""
+    rendition: Rendition
+    blob: bytes
+    mime_type: str
+    size: tuple[int, int]
+
+
+def parse_renditions(text: str, quality: int = 90) -> list[Rendition]:
+    """
+    解析派生版本参数，按出现顺序去重
+
+    Raises:
+        ValueError: 格式或尺寸无效
+    """
+    renditions: list[Rendition] = []
+    for token in text.replace("\n", ",").split(","):
+        token = token.strip().lower()
+        if not token:
+            continue
+        if token.isdigit():
+            fmt, size = "original", token
+        else:
+            fmt, _, size = token.partition(":")
+        if fmt not in OUTPUT_FORMATS and fmt != "original":
+            raise ValueError(f"无效的派生版本格式: {token}（可选 png / jpeg / webp）")
+        if size and (not size.isdigit() or int(size) < MIN_RENDITION_SIZE):
+            raise ValueError(f"无效的派生版本尺寸: {token}（最长边至少 {MIN_RENDITION_SIZE} 像素）")
+        rendition = Rendition(format=fmt, max_size=int(size or 0), quality=max(1, min(100, quality)))
+        if rendition not in renditions:
+            renditions.append(rendition)
+    return renditions
+
+
+def render_renditions(raw: bytes, renditions: list[Rendition]) -> list[RenderedImage]:
+    """
+    解码一次原图，在图像线程池中并发生成各派生版本
+
+    Args:
+        raw: 原图字节
+        renditions: 派生版本列表
+
+    Returns:
+        按 renditions 顺序排列的派生版本（跳过与原图相同的版本）
+    """
+    from PIL import Image
+
+    image = Image.open(BytesIO(raw))
+    source_mime = sniff_mime(raw) or Image.MIME.get(image.format or "", "image/png")
+    # 先在当前线程完成解码，各工作线程只读共享的像素数据
+    image.load()
+
+    def render(rendition: Rendition) -> RenderedImage:
+        output = image
+        if rendition.max_size and max(image.size) > rendition.max_size:
+            scale = rendition.max_size / max(image.size)
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            output = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        if rendition.format == "original":
+            pil_format = image.format or "PNG"
+            mime_type = source_mime
+        else:
+            pil_format, mime_type = OUTPUT_FORMATS[rendition.format]
+        if pil_format == "JPEG" and output.mode not in ("RGB", "L"):
+            output = output.convert("RGB")
+        with get_buffer_pool().acquire() as buffer:
+            if pil_format == "PNG":
+                output.save(buffer, format=pil_format)
+            else:
+                output.save(buffer, format=pil_format, quality=rendition.quality)
+            return RenderedImage(rendition=rendition, blob=buffer.getvalue(), mime_type=mime_type, size=output.size)
+
+    needed = [
+        rendition for rendition in renditions
+        if (rendition.max_size and max(image.size) > rendition.max_size)
+        or (rendition.format != "original" and OUTPUT_FORMATS[rendition.format][1] != source_mime)
+    ]
+    return [future.result() for future in map_ordered(render, needed)]
@@ -0,0 +1,215 @@
+"""
+基于内容寻址的生成结果磁盘缓存
+
+以 (API Key 指纹, 模型, 提示词, 规范化后的输入图像字节, 生成参数) 的哈希
+作为键，将最终输出的图像 blob 保存到本地磁盘；不同 API Key 的结果互不共享。
+缓存按总大小和 TTL 做 LRU 淘汰，命中时无需访问网络即可直接返回结果。
+缓存目录的权限为 0700，文件的权限为 0600。默认关闭，通过环境变量开启：
+
+- RESULT_CACHE_ENABLED: 是否启用结果缓存（默认 false）
+- RESULT_CACHE_DIR: 缓存目录（默认系统临时目录下 nano_banana-<uid>/results）
+- RESULT_CACHE_MAX_MB: 缓存总大小上限，单位 MB（默认 512）
+- RESULT_CACHE_TTL: 缓存有效期，单位秒（默认 86400）
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from utils.config import env_bool, env_int, env_str
+from utils.private_files import private_dir
+
+META_FILE = "meta.json"
+
+
+@dataclass
+class CachedBlob:
+    """缓存中的单张图像"""
+    blob: bytes
+    mime_type: str
+
+
+def make_cache_key(
+    model: str,
+    prompt: str,
+    input_image: Optional[bytes] = None,
+    params: Optional[dict[str, Any]] = None,
+    owner: str = "",
+) -> str:
+    """
+    计算生成请求的缓存键
+
+    Args:
+        model: 模型名称
+        prompt: 提示词
+        input_image: 规范化（压缩、转码）后的输入图像字节
+        params: 其他影响输出的生成参数
+        owner: 调用方 API Key 的指纹，不同调用方的缓存互不可见
+
+    Returns:
+        十六进制 SHA-256 摘要
+    """
+    digest = hashlib.sha256()
+    header = {
+        "owner": owner,
+        "model": model,
+        "prompt": prompt,
+        "input_image": hashlib.sha256(input_image).hexdigest() if input_image else None,
+        "params": params or {},
+    }
+    digest.update(json.dumps(header, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _write_private(path: str, data: bytes) -> None:
+    """以 0600 权限写入文件"""
+    with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+        f.write(data)
+
+
+class ResultCache:
+    """按大小和 TTL 做 LRU 淘汰的结果缓存（线程安全）"""
+
+    def __init__(self, directory: str, max_bytes: int, ttl_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # key -> (占用字节数, 创建时间)，按最近访问顺序排列
+        self._index: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._load_index()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _load_index(self) -> None:
+        """从磁盘重建索引，按上次访问时间排序"""
+        entries = []
+        for key in os.listdir(self.directory):
+            if key.startswith(".tmp-"):
+                continue
+            meta_path = os.path.join(self._entry_dir(key), META_FILE)
+            try:
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                entries.append((os.path.getmtime(meta_path), key, meta["size"], meta["created_at"]))
+            except (OSError, ValueError, KeyError):
+                # 不完整的条目（例如写入中途进程退出）直接清理
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+        for _, key, size, created_at in sorted(entries):
+            self._index[key] = (size, created_at)
+            self._total_bytes += size
+
+    def _remove(self, key: str) -> None:
+        size, _ = self._index.pop(key)
+        self._total_bytes -= size
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def get(self, key: str) -> Optional[list[CachedBlob]]:
+        """读取缓存，未命中或已过期时返回 None"""
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() - entry[1] > self.ttl_seconds:
+                self._remove(key)
+                self.evictions += 1
+                self.misses += 1
+                return None
+
+            entry_dir = self._entry_dir(key)
+            try:
+                with open(os.path.join(entry_dir, META_FILE), "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                blobs = []
+                for i, mime_type in enumerate(meta["mime_types"]):
+                    with open(os.path.join(entry_dir, f"{i}.bin"), "rb") as f:
+                        blobs.append(CachedBlob(blob=f.read(), mime_type=mime_type))
+                # 更新访问时间，供重启后重建 LRU 顺序
+                os.utime(os.path.join(entry_dir, META_FILE))
+            except (OSError, ValueError, KeyError):
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._index.move_to_end(key)
+            self.hits += 1
+            return blobs
+
+    def put(self, key: str, blobs: list[CachedBlob]) -> None:
+        """写入缓存，必要时按 LRU 顺序淘汰旧条目"""
+        size = sum(len(item.blob) for item in blobs)
+        if not blobs or size > self.max_bytes:
+            return
+
+        # 先写入临时目录再原子替换，避免并发读到半成品
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        created_at = time.time()
+        try:
+            for i, item in enumerate(blobs):
+                _write_private(os.path.join(tmp_dir, f"{i}.bin"), item.blob)
+            _write_private(os.path.join(tmp_dir, META_FILE), json.dumps({
+                "mime_types": [item.mime_type for item in blobs],
+                "size": size,
+                "created_at": created_at,
+            }).encode("utf-8"))
+
+            with self._lock:
+                if key in self._index:
+                    self._remove(key)
+                try:
+                    os.replace(tmp_dir, self._entry_dir(key))
+                except OSError:
+                    # 其他进程已写入相同条目，保留对方的结果
+                    return
+                self._index[key] = (size, created_at)
+                self._total_bytes += size
+                while self._total_bytes > self.max_bytes and self._index:
+                    self._remove(next(iter(self._index)))
+                    self.evictions += 1
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def stats(self) -> dict[str, int]:
+        """返回命中、未命中、淘汰计数及当前占用"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._total_bytes,
+            }
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> Optional[ResultCache]:
+    """获取进程级结果缓存，未启用时返回 None"""
+    global _cache
+    if not env_bool("RESULT_CACHE_ENABLED", False):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            directory = env_str("RESULT_CACHE_DIR", "") or private_dir("results")
+            _cache = ResultCache(
+                directory=directory,
+                max_bytes=env_int("RESULT_CACHE_MAX_MB", 512) * 1024 * 1024,
+                ttl_seconds=env_int("RESULT_CACHE_TTL", 86400),
+            )
+    return _cache
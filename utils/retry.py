@@ -0,0 +1,227 @@
+"""
+带指数退避、全抖动和 Retry-After 支持的重试策略
+
+生成请求、图像下载和凭据验证共用同一套策略：
+
+- 退避时间采用 "full jitter"：random(0, min(max_delay, base_delay * 2^n))；
+- 服务端返回 Retry-After 时至少等待该时长；
+- 所有尝试共享一个总时间预算（deadline），预算不足时立即放弃；
+  默认等于插件的单次请求超时 MAX_REQUEST_TIMEOUT，重试不会超过它；
+- 非幂等请求（付费的生成调用）只在请求确定未被处理时重试：
+  连接建立失败，或 429 / 503。502 可能在上游已经接受并计费之后由网关
+  返回，重试会重复扣费，因此只对幂等请求重试。
+
+配置（环境变量）：MAX_RETRIES、RETRY_BASE_DELAY、RETRY_MAX_DELAY、RETRY_DEADLINE
+"""
+
+import asyncio
+import email.utils
+import random
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+from typing import Any, Optional, TypeVar
+
+import httpx
+import requests
+
+from utils.config import env_float, env_int
+
+T = TypeVar("T")
+
+# 请求一定没有被服务端处理的状态码
+SAFE_RETRY_STATUSES = frozenset({429, 503})
+# 幂等请求额外可以重试的状态码
+IDEMPOTENT_RETRY_STATUSES = SAFE_RETRY_STATUSES | {408, 425, 500, 502, 504}
+
+# 连接尚未建立，请求一定没有发出
+SAFE_RETRY_EXCEPTIONS = (
+    requests.exceptions.ConnectTimeout,
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+)
+# 幂等请求额外可以重试的网络错误
+IDEMPOTENT_RETRY_EXCEPTIONS = SAFE_RETRY_EXCEPTIONS + (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    httpx.TransportError,
+)
+
+
+@dataclass
+class RetryPolicy:
+    """重试策略"""
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 20.0
+    deadline: float = 60.0
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """从环境变量读取重试配置（MAX_RETRIES 为最大尝试次数）"""
+        return cls(
+            max_attempts=max(1, env_int("MAX_RETRIES", 3)),
+            base_delay=env_float("RETRY_BASE_DELAY", 0.5),
+            max_delay=env_float("RETRY_MAX_DELAY", 20.0),
+            deadline=env_float("RETRY_DEADLINE", env_float("MAX_REQUEST_TIMEOUT", 60.0)),
+        )
+
+    def backoff(self, attempt: int) -> float:
+        """第 attempt 次失败后的退避时间（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def retry_after_seconds(response: Any) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），不存在时返回 None"""
+    value = response.headers.get("Retry-After") if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+@dataclass
+class _OperationStats:
+    calls: int = 0
+    attempts: int = 0
+    retries: int = 0
+    giveups: int = 0
+    backoff_seconds: float = 0.0
+
+
+class RetryMetrics:
+    """按操作名统计的重试指标（线程安全）"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._operations: dict[str, _OperationStats] = {}
+
+    def record(self, operation: str, attempts: int, backoff: float, gave_up: bool) -> None:
+        with self._lock:
+            stats = self._operations.setdefault(operation, _OperationStats())
+            stats.calls += 1
+            stats.attempts += attempts
+            stats.retries += attempts - 1
+            stats.giveups += int(gave_up)
+            stats.backoff_seconds += backoff
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        with self._lock:
+            return {name: dict(vars(stats)) for name, stats in self._operations.items()}
+
+
+_metrics = RetryMetrics()
+
+
+def retry_metrics() -> dict[str, dict[str, float]]:
+    """返回各操作的调用次数、尝试次数、重试次数、放弃次数和退避总时长"""
+    return _metrics.snapshot()
+
+
+def _retriable_status(result: Any, idempotent: bool) -> bool:
+    statuses = IDEMPOTENT_RETRY_STATUSES if idempotent else SAFE_RETRY_STATUSES
+    return getattr(result, "status_code", None) in statuses
+
+
+def _retriable_error(error: BaseException, idempotent: bool) -> bool:
+    return isinstance(error, IDEMPOTENT_RETRY_EXCEPTIONS if idempotent else SAFE_RETRY_EXCEPTIONS)
+
+
+def _next_delay(policy: RetryPolicy, attempt: int, result: Any, started: float) -> Optional[float]:
+    """计算下一次重试前的等待时间，超出次数或时间预算时返回 None"""
+    if attempt + 1 >= policy.max_attempts:
+        return None
+    delay = policy.backoff(attempt)
+    retry_after = retry_after_seconds(result) if result is not None else None
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    if time.monotonic() - started + delay > policy.deadline:
+        return None
+    return delay
+
+
+def _close(result: Any) -> None:
+    close = getattr(result, "close", None)
+    if callable(close):
+        close()
+
+
+def call_with_retry(
+    func: Callable[[], T],
+    operation: str,
+    idempotent: bool = True,
+    policy: Optional[RetryPolicy] = None,
+) -> T:
+    """
+    按重试策略执行同步请求
+
+    Args:
+        func: 发送请求的函数，返回 requests/httpx 响应对象
+        operation: 用于统计的操作名
+        idempotent: 请求是否幂等；非幂等请求只在安全的失败模式下重试
+        policy: 重试策略，默认从环境变量读取
+
+    Returns:
+        最后一次尝试的响应（状态码可能仍是错误码，由调用方处理）
+    """
+    policy = policy or RetryPolicy.from_env()
+    started = time.monotonic()
+    backoff_total = 0.0
+    attempt = 0
+    while True:
+        try:
+            result = func()
+        except Exception as e:
+            delay = _next_delay(policy, attempt, None, started) if _retriable_error(e, idempotent) else None
+            if delay is None:
+                _metrics.record(operation, attempt + 1, backoff_total, gave_up=_retriable_error(e, idempotent))
+                raise
+        else:
+            delay = _next_delay(policy, attempt, result, started) if _retriable_status(result, idempotent) else None
+            if delay is None:
+                _metrics.record(operation, attempt + 1, backoff_total, gave_up=_retriable_status(result, idempotent))
+                return result
+            _close(result)
+        time.sleep(delay)
+        backoff_total += delay
+        attempt += 1
+
+
+async def call_with_retry_async(
+    func: Callable[[], Awaitable[T]],
+    operation: str,
+    idempotent: bool = True,
+    policy: Optional[RetryPolicy] = None,
+) -> T:
+    """call_with_retry() 的异步版本，func 每次调用返回一个新的协程"""
+    policy = policy or RetryPolicy.from_env()
+    started = time.monotonic()
+    backoff_total = 0.0
+    attempt = 0
+    while True:
+        try:
+            result = await func()
+        except Exception as e:
+            delay = _next_delay(policy, attempt, None, started) if _retriable_error(e, idempotent) else None
+            if delay is None:
+                _metrics.record(operation, attempt + 1, backoff_total, gave_up=_retriable_error(e, idempotent))
+                raise
+        else:
+            delay = _next_delay(policy, attempt, result, started) if _retriable_status(result, idempotent) else None
+            if delay is None:
+                _metrics.record(operation, attempt + 1, backoff_total, gave_up=_retriable_status(result, idempotent))
+                return result
+            aclose = getattr(result, "aclose", None)
+            if callable(aclose):
+                await aclose()
+        await asyncio.sleep(delay)
+        backoff_total += delay
+        attempt += 1
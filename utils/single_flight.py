@@ -0,0 +1,80 @@
+"""
+进程内请求合并（single-flight）
+
+同一个 key 同时只执行一次调用：第一个调用方真正执行，其余调用方等待
+并共享它的结果（或异常）。调用完成后立即从在途表中移除，之后的调用
+会重新执行，缓存由调用方自行负责。
+"""
+
+import threading
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """按 key 合并并发调用（线程安全）"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: str, func: Callable[[], T], timeout: Optional[float] = None) -> tuple[T, bool]:
+        """
+        执行 func，同一 key 的并发调用只执行一次
+
+        Args:
+            key: 合并的键
+            func: 实际执行的调用
+            timeout: 等待在途调用的最长时间（秒），超时抛出 TimeoutError
+
+        Returns:
+            (结果, 是否共享了其他调用方的结果)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+                self.executed += 1
+            else:
+                leader = False
+                self.shared += 1
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"等待在途请求超时: {key[:16]}")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self) -> int:
+        """当前在途的 key 数量"""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self) -> dict[str, int]:
+        """返回实际执行次数、共享次数和在途数量"""
+        with self._lock:
+            return {"executed": self.executed, "shared": self.shared, "in_flight": len(self._calls)}
@@ -0,0 +1,102 @@
+"""
+OpenRouter 流式（SSE）响应解析
+
+stream: true 时 OpenRouter 以 server-sent events 返回增量结果：
+每个 "data: {...}" 事件包含 choices[0].delta，其中 content 是文本增量，
+images 是已经完整生成的图像；以 ":" 开头的注释行是保活心跳，
+"data: [DONE]" 表示结束。
+"""
+
+import json
+from collections.abc import Callable, Iterable, Iterator
+from dataclasses import dataclass, field
+from typing import Any, Optional, Union
+
+
+@dataclass
+class StreamEvent:
+    """从 SSE 流中解析出的事件"""
+    kind: str  # text / image / usage / error
+    text: str = ""
+    image_url: str = ""
+    usage: dict[str, Any] = field(default_factory=dict)
+
+
+def iter_stream_lines(read: Callable[[int], bytes], chunk_size: int) -> Iterator[bytes]:
+    """
+    把原始响应流切分为行，每行在换行符到达后立即产出
+
+    read(n) 返回当前已到达的数据（最多 n 字节，流结束时返回空字节串），
+    不会为凑满 n 字节而等待，因此不带 Content-Length、也不分块的响应
+    （例如经过去掉 chunked 编码的代理）中的文本增量同样能及时转发。
+    数 MB 的 Base64 图像行在 bytearray 中累积，只扫描新到达的部分。
+    """
+    buffer = bytearray()
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+        scanned = len(buffer)
+        buffer += chunk
+        start = 0
+        end = buffer.find(b"\n", scanned)
+        while end != -1:
+            yield bytes(buffer[start:end])
+            start = end + 1
+            end = buffer.find(b"\n", start)
+        del buffer[:start]
+    if buffer:
+        yield bytes(buffer)
+
+
+def iter_sse_data(lines: Iterable[Union[bytes, str]]) -> Iterator[str]:
+    """
+    把按行读取的 SSE 流组装为事件数据
+
+    多行 data 按换行拼接，注释行和其他字段被忽略，空行表示一个事件结束。
+    """
+    buffer: list[str] = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.rstrip("\r\n")
+        if not line:
+            if buffer:
+                yield "\n".join(buffer)
+                buffer = []
+            continue
+        if line.startswith(":"):
+            continue
+        name, _, value = line.partition(":")
+        if name == "data":
+            buffer.append(value[1:] if value.startswith(" ") else value)
+    if buffer:
+        yield "\n".join(buffer)
+
+
+def iter_completion_events(lines: Iterable[Union[bytes, str]]) -> Iterator[StreamEvent]:
+    """
+    解析 chat/completions 的 SSE 流，按到达顺序产出文本、图像、用量和错误事件
+    """
+    for data in iter_sse_data(lines):
+        if data == "[DONE]":
+            return
+        chunk = json.loads(data)
+
+        error = chunk.get("error")
+        if error:
+            message: Optional[str] = error.get("message") if isinstance(error, dict) else str(error)
+            yield StreamEvent(kind="error", text=message or "未知错误")
+            return
+
+        for choice in chunk.get("choices", [])[:1]:
+            delta = choice.get("delta") or {}
+            if delta.get("content"):
+                yield StreamEvent(kind="text", text=delta["content"])
+            for image in delta.get("images") or []:
+                url = (image.get("image_url") or {}).get("url", "")
+                if url:
+                    yield StreamEvent(kind="image", image_url=url)
+
+        if chunk.get("usage"):
+            yield StreamEvent(kind="usage", usage=chunk["usage"])
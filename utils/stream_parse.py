@@ -0,0 +1,206 @@
+"""
+chat/completions 响应的流式解析
+
+OpenRouter 把生成的图像以 data:image/...;base64,... 字符串内嵌在 JSON 中，
+单张图像往往有数 MB。直接 response.json() 再 base64.b64decode 会在内存中
+同时保留响应文本、解码字节等多份完整拷贝。
+
+CompletionStreamParser 按块读取响应：遇到 data:image 字符串时，把 Base64
+内容增量解码到从缓冲池借出的缓冲区（见 utils.buffer_pool），并在 JSON 骨架中用 "nb-blob:<序号>" 占位；
+其余的小体积 JSON 骨架最后再交给 json.loads 解析。这样每张图像的峰值内存
+基本等于解码后的图像大小。
+"""
+
+import binascii
+import json
+import re
+import time
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from utils.buffer_pool import PooledBuffer, get_buffer_pool
+from utils.config import env_bool
+
+BLOB_PLACEHOLDER = "nb-blob:"
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 部分 JSON 编码器会把 "/" 转义为 "\/"
+_DATA_IMAGE_PREFIXES = (b"data:image/", b"data:image\\/")
+# data URL 头部（data:image/xxx;base64,）的最大长度
+_MAX_HEADER = 128
+_STRING_SPECIAL = re.compile(rb'["\\]')
+
+_SKELETON, _STRING_START, _STRING, _BASE64 = range(4)
+
+
+def streaming_parse_enabled() -> bool:
+    """是否启用流式解析（STREAMING_PARSE，默认开启）"""
+    return env_bool("STREAMING_PARSE", True)
+
+
+@dataclass
+class ParsedCompletion:
+    """流式解析结果：JSON 数据及从中提取出的图像字节"""
+    data: dict[str, Any]
+    blobs: list[bytes] = field(default_factory=list)
+    mime_types: list[str] = field(default_factory=list)
+    response_bytes: int = 0  # 响应体字节数
+    decode_seconds: float = 0.0  # Base64 解码累计耗时
+
+
+def resolve_blob(url: str, blobs: list[bytes]) -> Optional[bytes]:
+    """把 nb-blob:<序号> 占位符还原为图像字节，不是占位符时返回 None"""
+    if not url.startswith(BLOB_PLACEHOLDER):
+        return None
+    return blobs[int(url[len(BLOB_PLACEHOLDER):])]
+
+
+class CompletionStreamParser:
+    """增量解析 chat/completions 响应体，边读边解码内嵌的 Base64 图像"""
+
+    def __init__(self) -> None:
+        self._skeleton = bytearray()
+        self._blobs: list[bytes] = []
+        self._mime_types: list[str] = []
+        self._pending = b""
+        self._state = _SKELETON
+        self._sink: Optional[PooledBuffer] = None
+        self._b64_carry = b""
+        self._bytes_read = 0
+        self._decode_seconds = 0.0
+
+    def feed(self, chunk: bytes) -> None:
+        """输入下一块响应数据"""
+        self._bytes_read += len(chunk)
+        data = self._pending + chunk if self._pending else chunk
+        self._pending = b""
+        pos, end = 0, len(data)
+
+        while pos < end:
+            if self._state == _SKELETON:
+                quote = data.find(b'"', pos)
+                if quote == -1:
+                    self._skeleton += data[pos:]
+                    break
+                self._skeleton += data[pos:quote + 1]
+                pos = quote + 1
+                self._state = _STRING_START
+
+            elif self._state == _STRING_START:
+                available = end - pos
+                if any(available < len(prefix) and prefix.startswith(data[pos:])
+                       for prefix in _DATA_IMAGE_PREFIXES):
+                    # 不足以判断是否为图像字符串，等待下一块
+                    self._pending = data[pos:]
+                    break
+                self._state = _STRING
+                if not data.startswith(_DATA_IMAGE_PREFIXES, pos):
+                    continue
+                comma = data.find(b",", pos, pos + _MAX_HEADER)
+                if comma == -1:
+                    if end - pos < _MAX_HEADER:
+                        self._state = _STRING_START
+                        self._pending = data[pos:]
+                        break
+                    continue
+                header = data[pos:comma].replace(b"\\/", b"/")
+                if not header.endswith(b";base64"):
+                    continue
+                self._start_blob(header)
+                pos = comma + 1
+
+            elif self._state == _STRING:
+                match = _STRING_SPECIAL.search(data, pos)
+                if match is None:
+                    self._skeleton += data[pos:]
+                    break
+                index = match.start()
+                if data[index:index + 1] == b'"':
+                    self._skeleton += data[pos:index + 1]
+                    pos = index + 1
+                    self._state = _SKELETON
+                elif index + 1 < end:
+                    # 转义字符：连同下一个字节一起原样保留
+                    self._skeleton += data[pos:index + 2]
+                    pos = index + 2
+                else:
+                    self._skeleton += data[pos:index]
+                    self._pending = data[index:]
+                    break
+
+            else:  # _BASE64
+                quote = data.find(b'"', pos)
+                stop = end if quote == -1 else quote
+                segment = data[pos:stop]
+                if quote == -1 and segment.endswith(b"\\"):
+                    # 转义序列被切断，留到下一块处理
+                    self._pending = b"\\"
+                    segment = segment[:-1]
+                if b"\\" in segment:
+                    # Base64 字母表中只有 "/" 可能被 JSON 转义
+                    segment = segment.replace(b"\\/", b"/").replace(b"\\n", b"").replace(b"\\r", b"")
+                self._decode(segment)
+                if quote == -1:
+                    break
+                self._finish_blob()
+                pos = quote + 1
+
+    def _start_blob(self, header: bytes) -> None:
+        mime_type = header[len(b"data:"):].split(b";", 1)[0].decode("ascii", "replace")
+        self._mime_types.append(mime_type)
+        self._skeleton += f"{BLOB_PLACEHOLDER}{len(self._blobs)}".encode("ascii")
+        self._sink = get_buffer_pool().acquire()
+        self._b64_carry = b""
+        self._state = _BASE64
+
+    def _decode(self, segment: bytes) -> None:
+        data = self._b64_carry + segment if self._b64_carry else segment
+        usable = len(data) - len(data) % 4
+        if usable:
+            started = time.perf_counter()
+            self._sink.write(binascii.a2b_base64(data[:usable]))
+            self._decode_seconds += time.perf_counter() - started
+        self._b64_carry = data[usable:]
+
+    def _finish_blob(self) -> None:
+        if self._b64_carry:
+            padded = self._b64_carry + b"=" * (-len(self._b64_carry) % 4)
+            self._sink.write(binascii.a2b_base64(padded))
+            self._b64_carry = b""
+        # 解码写入复用的缓冲区，避免每张图像都从零开始扩容；拷贝出结果后立即归还
+        self._blobs.append(self._sink.getvalue())
+        self._sink.release()
+        self._sink = None
+        self._skeleton += b'"'
+        self._state = _SKELETON
+
+    def close(self) -> ParsedCompletion:
+        """
+        结束解析并返回结果
+
+        Raises:
+            json.JSONDecodeError: 响应不是合法 JSON 或被截断
+        """
+        if self._state == _BASE64:
+            self._sink.release()
+            raise json.JSONDecodeError("响应在图像数据中间被截断", self._skeleton.decode("utf-8", "replace"), len(self._skeleton))
+        self._skeleton += self._pending
+        self._pending = b""
+        data = json.loads(self._skeleton.decode("utf-8"))
+        return ParsedCompletion(
+            data=data,
+            blobs=self._blobs,
+            mime_types=self._mime_types,
+            response_bytes=self._bytes_read,
+            decode_seconds=self._decode_seconds,
+        )
+
+
+def parse_completion_stream(chunks: Iterable[bytes]) -> ParsedCompletion:
+    """按块解析完整的响应体"""
+    parser = CompletionStreamParser()
+    for chunk in chunks:
+        if chunk:
+            parser.feed(chunk)
+    return parser.close()
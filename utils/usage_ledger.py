@@ -0,0 +1,296 @@
+"""
+Token 用量与费用台账
+
+每次生成的 Token 数、费用和图像数按 API Key 指纹、模型、工作流（Dify
+应用 ID）和调用方式记录到本地 SQLite 数据库，可按任意维度汇总。
+
+record() 只把记录追加到内存队列，开销可以忽略；后台线程每隔
+USAGE_FLUSH_SECONDS 秒（或积累到 USAGE_FLUSH_BATCH 条时）在一个事务中
+批量写入，进程退出时写入剩余记录。查询已花费金额时把尚未写入的记录一并计入。
+
+费用优先使用 OpenRouter 在 usage.cost 中返回的实际费用（美元），没有时按
+价格表（每百万 Token 的美元价格）估算；模型 ID 以 :free 结尾时为 0，
+价格表中没有的模型记为 0。
+
+台账包含 API Key 指纹、费用和工作流 ID，默认关闭；数据库默认位于当前用户
+专用的私有目录（权限 0700）中，文件权限为 0600。
+
+- USAGE_LEDGER_ENABLED: 是否记录用量（默认只在设置了 BUDGET_USD 时启用，花费预算依赖台账）
+- USAGE_LEDGER_DB: 数据库路径（默认为系统临时目录下 nano_banana-<uid>/usage.sqlite3）
+- USAGE_FLUSH_SECONDS: 批量写入的间隔（默认 2 秒）
+- USAGE_FLUSH_BATCH: 触发立即写入的记录数（默认 100）
+- MODEL_PRICES: 补充或覆盖价格表的 JSON，如 {"vendor/model": [输入单价, 输出单价]}
+"""
+
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import astuple, dataclass, field, fields
+from typing import Any, Optional
+
+from utils.config import env_bool, env_float, env_int, env_str
+from utils.private_files import private_dir, secure_db_file
+
+logger = logging.getLogger("nano_banana.usage")
+
+# 每百万 Token 的美元价格 (输入, 输出)，按模型 ID 前缀匹配（取最长的前缀）
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "google/gemini-2.5-flash-image": (0.30, 30.0),  # 输出图像按每张 1290 Token 计费
+    "google/gemini-2.5-flash": (0.30, 2.50),
+    "anthropic/claude-3-5-sonnet": (3.0, 15.0),
+    "openai/gpt-4o": (2.50, 10.0),
+}
+
+# 可用于汇总分组的维度
+GROUP_COLUMNS = ("owner", "model", "workflow", "mode")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    owner TEXT NOT NULL,
+    model TEXT NOT NULL,
+    workflow TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    total_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    images INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS usage_owner_time ON usage (owner, created_at);
+CREATE INDEX IF NOT EXISTS usage_model_time ON usage (model, created_at);
+"""
+
+
+def model_prices() -> dict[str, tuple[float, float]]:
+    """内置价格表，叠加 MODEL_PRICES 环境变量中的配置"""
+    prices = dict(MODEL_PRICES)
+    raw = env_str("MODEL_PRICES", "")
+    if raw:
+        try:
+            prices.update({model: (float(p[0]), float(p[1])) for model, p in json.loads(raw).items()})
+        except (ValueError, TypeError, IndexError, AttributeError):
+            logger.warning("MODEL_PRICES 格式无效，已忽略: %s", raw)
+    return prices
+
+
+def estimate_cost(model: str, usage: dict[str, Any]) -> float:
+    """按价格表估算一次调用的费用（美元）"""
+    if model.endswith(":free"):
+        return 0.0
+    prices = model_prices()
+    matches = [prefix for prefix in prices if model.startswith(prefix)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = prices[max(matches, key=len)]
+    return (
+        usage.get("prompt_tokens", 0) * prompt_price + usage.get("completion_tokens", 0) * completion_price
+    ) / 1_000_000
+
+
+@dataclass
+class UsageRecord:
+    """一次（或一批）生成的用量，字段顺序与数据表一致"""
+    owner: str
+    model: str
+    workflow: str = ""
+    mode: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_tokens: int = 0
+    cost: float = 0.0
+    images: int = 0
+    created_at: float = field(default_factory=time.time)
+
+    @classmethod
+    def from_usage(
+        cls, owner: str, model: str, usage: dict[str, Any], images: int = 0, workflow: str = "", mode: str = ""
+    ) -> "UsageRecord":
+        """由 OpenRouter 返回的 usage 构造记录，没有实际费用时按价格表估算"""
+        cost = usage.get("cost")
+        if not isinstance(cost, (int, float)):
+            cost = estimate_cost(model, usage)
+        return cls(
+            owner=owner,
+            model=model,
+            workflow=workflow or "",
+            mode=mode or "",
+            prompt_tokens=int(usage.get("prompt_tokens") or 0),
+            completion_tokens=int(usage.get("completion_tokens") or 0),
+            total_tokens=int(usage.get("total_tokens") or 0),
+            cost=float(cost),
+            images=images,
+        )
+
+
+def default_db_path() -> str:
+    return os.path.join(private_dir(), "usage.sqlite3")
+
+
+class UsageLedger:
+    """基于 SQLite 的用量台账，批量异步写入（线程安全，可被多个进程共享）"""
+
+    def __init__(self, path: str, flush_seconds: float = 2.0, flush_batch: int = 100):
+        self.path = path
+        self.flush_seconds = flush_seconds
+        self.flush_batch = max(1, flush_batch)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: list[UsageRecord] = []
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 台账包含 API Key 指纹和费用，只允许当前用户读写
+        secure_db_file(path)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        """每个线程使用独立的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ---- 写入 ----
+
+    def record(self, record: UsageRecord) -> None:
+        """追加一条记录，由后台线程批量写入"""
+        with self._lock:
+            self._pending.append(record)
+            full = len(self._pending) >= self.flush_batch
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._writer_loop, name="nano-banana-usage", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        if full:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """立即写入所有待写记录，返回写入的条数"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.executemany(
+                        f"INSERT INTO usage VALUES ({', '.join('?' * len(fields(UsageRecord)))})",
+                        [astuple(record) for record in pending],
+                    )
+            except Exception:
+                # 写入失败时放回队列，下次重试
+                with self._lock:
+                    self._pending = pending + self._pending
+                raise
+            return len(pending)
+
+    def _writer_loop(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("写入用量台账失败: %s", e)
+
+    # ---- 查询 ----
+
+    def spent(self, owner: str, since: float) -> float:
+        """owner 自 since 以来的花费（美元），包含尚未写入的记录"""
+        row = self._connect().execute(
+            "SELECT COALESCE(SUM(cost), 0) FROM usage WHERE owner = ? AND created_at >= ?", (owner, since)
+        ).fetchone()
+        with self._lock:
+            pending = sum(r.cost for r in self._pending if r.owner == owner and r.created_at >= since)
+        return row[0] + pending
+
+    def average_cost(self, model: str, samples: int = 20) -> Optional[float]:
+        """模型最近 samples 次调用的平均实际费用，没有记录时返回 None"""
+        with self._lock:
+            recent = [r.cost for r in self._pending if r.model == model][-samples:]
+        rows = self._connect().execute(
+            "SELECT cost FROM usage WHERE model = ? ORDER BY created_at DESC LIMIT ?",
+            (model, samples - len(recent)),
+        ).fetchall() if len(recent) < samples else []
+        costs = recent + [cost for (cost,) in rows]
+        return sum(costs) / len(costs) if costs else None
+
+    def aggregate(
+        self,
+        group_by: tuple[str, ...] = ("model",),
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        owner: Optional[str] = None,
+    ) -> list[dict[str, Any]]:
+        """
+        按维度汇总调用次数、Token 数、费用和图像数（先写入待写记录）
+
+        Args:
+            group_by: owner / model / workflow / mode 的组合，空元组表示汇总全部
+            since, until: 时间范围（Unix 时间戳）
+            owner: 只统计某个 API Key 指纹
+        """
+        invalid = [column for column in group_by if column not in GROUP_COLUMNS]
+        if invalid:
+            raise ValueError(f"无效的分组维度: {', '.join(invalid)}")
+        self.flush()
+
+        conditions, params = [], []
+        for clause, value in (("created_at >= ?", since), ("created_at < ?", until), ("owner = ?", owner)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        columns = ", ".join(group_by)
+        sql = (
+            f"SELECT {columns + ', ' if columns else ''}COUNT(*), SUM(prompt_tokens), SUM(completion_tokens), "
+            f"SUM(total_tokens), SUM(cost), SUM(images) FROM usage"
+            + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+            + (f" GROUP BY {columns} ORDER BY SUM(cost) DESC" if columns else "")
+        )
+        results = []
+        for row in self._connect().execute(sql, params):
+            keys, values = row[:len(group_by)], row[len(group_by):]
+            if not values[0]:
+                continue
+            results.append({
+                **dict(zip(group_by, keys)),
+                "calls": values[0],
+                "prompt_tokens": values[1],
+                "completion_tokens": values[2],
+                "total_tokens": values[3],
+                "cost": round(values[4], 6),
+                "images": values[5],
+            })
+        return results
+
+
+_ledger: Optional[UsageLedger] = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger() -> Optional[UsageLedger]:
+    """获取进程级用量台账，未启用时返回 None"""
+    global _ledger
+    if not env_bool("USAGE_LEDGER_ENABLED", env_float("BUDGET_USD", 0) > 0):
+        return None
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = UsageLedger(
+                env_str("USAGE_LEDGER_DB", "") or default_db_path(),
+                flush_seconds=env_float("USAGE_FLUSH_SECONDS", 2.0),
+                flush_batch=env_int("USAGE_FLUSH_BATCH", 100),
+            )
+    return _ledger
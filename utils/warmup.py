@@ -0,0 +1,98 @@
+"""
+插件进程的启动预热
+
+扩容或重启后的插件进程在处理第一个请求前，除了导入模块，还要完成
+DNS 解析、TCP + TLS 握手以及 Pillow 编解码器的加载。开启预热后，
+main.py 在 plugin.run() 之前启动一个后台线程，提前完成这些工作：
+
+- 向 OpenRouter 发送一次不带凭据的轻量请求，建立的 keep-alive 连接
+  留在共享连接池中（HTTP_ENGINE=async 时同时预热异步客户端）；
+- 导入延迟加载的 Pillow，注册全部格式插件，并用一张小图走一遍
+  PNG / JPEG / WebP 的编码和解码。
+
+预热失败只记录日志，不影响插件启动。
+
+- WARMUP_ENABLED: 是否在启动时预热（默认 false）
+- WARMUP_CONNECT: 是否预连接 OpenRouter（默认 true，仅在 WARMUP_ENABLED 时生效）
+"""
+
+import logging
+import threading
+import time
+from io import BytesIO
+from typing import Optional
+
+from utils.config import env_bool
+
+logger = logging.getLogger("nano_banana.warmup")
+
+# 预热时编解码一遍的格式
+PRIMED_FORMATS = ("PNG", "JPEG", "WEBP")
+
+
+def prime_codecs() -> float:
+    """导入 Pillow 并编解码一张小图，返回耗时（秒）"""
+    started = time.perf_counter()
+    from PIL import Image, features
+
+    Image.init()
+    sample = Image.new("RGB", (16, 16), "orange")
+    for pil_format in PRIMED_FORMATS:
+        if pil_format == "WEBP" and not features.check("webp"):
+            continue
+        buffer = BytesIO()
+        sample.save(buffer, format=pil_format)
+        buffer.seek(0)
+        Image.open(buffer).load()
+    return time.perf_counter() - started
+
+
+def preconnect(timeout: float = 10) -> float:
+    """
+    与 OpenRouter 建立 keep-alive 连接并留在共享连接池中，返回耗时（秒）
+
+    请求不带 API Key，返回的状态码（通常是 401）无关紧要。
+    """
+    from utils.async_client import get_async_client, run_sync, use_async_engine
+    from utils.http_pool import OPENROUTER_API_BASE, get_session
+
+    started = time.perf_counter()
+    url = f"{OPENROUTER_API_BASE}/key"
+    get_session().get(url, timeout=timeout).close()
+    if use_async_engine():
+        async def connect() -> None:
+            await get_async_client().get(url, timeout=timeout)
+
+        run_sync(connect(), timeout=timeout)
+    return time.perf_counter() - started
+
+
+def warm_up(connect: bool = True) -> dict[str, float]:
+    """
+    执行预热，返回各步骤的耗时（秒）；失败的步骤记录日志后跳过
+    """
+    timings: dict[str, float] = {}
+    steps = [("codecs", prime_codecs)]
+    if connect:
+        steps.append(("connect", preconnect))
+    for name, step in steps:
+        try:
+            timings[name] = step()
+        except Exception as e:
+            logger.warning("启动预热步骤 %s 失败: %s", name, e)
+    logger.info("启动预热完成: %s", {name: round(seconds * 1000, 1) for name, seconds in timings.items()})
+    return timings
+
+
+def start_warmup() -> Optional[threading.Thread]:
+    """WARMUP_ENABLED 时在后台线程中预热，不阻塞插件启动"""
+    if not env_bool("WARMUP_ENABLED", False):
+        return None
+    thread = threading.Thread(
+        target=warm_up,
+        kwargs={"connect": env_bool("WARMUP_CONNECT", True)},
+        name="nano-banana-warmup",
+        daemon=True,
+    )
+    thread.start()
+    return thread